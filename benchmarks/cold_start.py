@@ -0,0 +1,86 @@
+"""Time from a fresh interpreter to an app ready to serve, i.e. what an
+autoscaled API worker pays before it can take traffic, and the slowest
+imports on the way.
+
+    python -m benchmarks.cold_start [--runs N] [--top N]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+READY = """
+import asyncio, time
+start = time.perf_counter()
+from social.main import app, lifespan
+imported = time.perf_counter()
+
+async def ready():
+    async with lifespan(app):
+        pass
+
+asyncio.run(ready())
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def run_once(env: dict) -> tuple[float, float, float]:
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", READY],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    total = time.perf_counter() - start
+    imported, started = map(float, output.split())
+    return total, imported, started
+
+
+def slowest_imports(env: dict, top: int) -> list[tuple[int, str]]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import social.main"],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    imports = []
+    for line in stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        # Modules imported while importing social.main itself; nested
+        # imports are indented further and included in the cumulative time
+        if len(name) - len(name.lstrip()) == 3:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    env = {**os.environ, "ENV_STATE": os.environ.get("ENV_STATE", "test")}
+    run_once(env)  # warm the OS file cache and .pyc files
+    runs = [run_once(env) for _ in range(args.runs)]
+    for label, values in zip(
+        ("process to ready", "import social.main", "lifespan startup"),
+        zip(*runs),
+    ):
+        print(
+            f"{label:<20} median {statistics.median(values) * 1000:7.1f} ms"
+            f"  min {min(values) * 1000:7.1f} ms"
+        )
+
+    print("\nslowest imports of social.main")
+    for cumulative, name in slowest_imports(env, args.top):
+        print(f"{cumulative / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Time to serialize a feed page of N rows with the pydantic path and the
+FAST_JSON_RESPONSES orjson path of social.serialization.
+
+    python -m benchmarks.json_responses [--rows N ...] [--repeat N]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import sqlalchemy
+
+os.environ.setdefault("ENV_STATE", "test")
+from social.database import (  # noqa: E402
+    Database,
+    metadata,
+    post_table,
+    user_table,
+)
+from social.models.post import UserPostPage  # noqa: E402
+from social.routers.post import select_post_with_likes  # noqa: E402
+from social.serialization import fast_json, validated_json  # noqa: E402
+
+VARIANTS = [
+    {
+        "kind": "thumbnail",
+        "format": "webp",
+        "width": 160,
+        "height": 160,
+        "url": "https://example.com/variants/abc/thumbnail.webp",
+    },
+    {
+        "kind": "640w",
+        "format": "avif",
+        "width": 640,
+        "height": 480,
+        "url": "https://example.com/variants/abc/640w.avif",
+    },
+]
+
+
+def create_database(path: str, rows: int):
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(
+            user_table.insert(), [{"email": "user@example.com"}]
+        )
+        connection.execute(
+            post_table.insert(),
+            [
+                {
+                    "body": f"Post number {i} with a few words in it",
+                    "user_id": 1,
+                    "image_url": f"https://example.com/images/{i}.png",
+                    # Half the posts with image variants
+                    "image_variants": VARIANTS if i % 2 else None,
+                    "like_count": i,
+                }
+                for i in range(rows)
+            ],
+        )
+    engine.dispose()
+
+
+def timed(encode, content, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encode(UserPostPage, content)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+async def measure(rows: int, repeat: int):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "social.db")
+        create_database(path, rows)
+        async with Database(f"sqlite:///{path}") as db:
+            posts = await db.fetch_all(select_post_with_likes)
+    content = {"posts": posts, "next_cursor": None}
+
+    assert fast_json(UserPostPage, content) is not None
+    validated = timed(validated_json, content, repeat)
+    fast = timed(fast_json, content, repeat)
+    print(
+        f"{rows:>6} rows  pydantic {validated:9.2f} ms  "
+        f"orjson {fast:8.2f} ms  {validated / fast:5.1f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[100, 1_000, 10_000]
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        asyncio.run(measure(rows, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Per-request cost of resolving the email from an access token, with and
+without the decoded token cache.
+
+    python -m benchmarks.jwt_decode [--requests N]
+"""
+
+import argparse
+import os
+import timeit
+
+os.environ.setdefault("ENV_STATE", "test")
+from social import security  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+
+    token = security.create_access_token("test@davidnevin.net")
+
+    def request():
+        security.get_email_for_token_type(token, "access")
+
+    for enabled in (False, True):
+        security.config.JWT_DECODE_CACHE_ENABLED = enabled
+        security.decoded_token_cache.clear()
+        elapsed = timeit.timeit(request, number=args.requests)
+        print(
+            f"cache {'on ' if enabled else 'off'}  "
+            f"{elapsed / args.requests * 1_000_000:8.2f} us/request"
+        )
+
+
+if __name__ == "__main__":
+    main()
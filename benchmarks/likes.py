@@ -0,0 +1,122 @@
+"""Timings and SQLite query plans of the like endpoints on one post with
+many likes: the counter read by GET /post/like/{id} against COUNT(*),
+and the keyset pages of GET /post/{id}/like against OFFSET pages.
+
+    python -m benchmarks.likes [--likes N] [--page-size N]
+"""
+
+import argparse
+import os
+import time
+
+import sqlalchemy
+
+os.environ.setdefault("ENV_STATE", "test")
+from social.database import (  # noqa: E402
+    like_table,
+    metadata,
+    post_table,
+    user_table,
+)
+from social.pagination import encode_cursor  # noqa: E402
+from social.routers.post import (  # noqa: E402
+    select_likes_page,
+    select_post_with_likes,
+)
+
+POST_ID = 1
+# Other posts, with a few likes each, so the hot post's likes are a
+# slice of the table as in production
+OTHER_POSTS = 2_000
+OTHER_POST_LIKES = 50
+
+
+def populate(engine: sqlalchemy.engine.Engine, likes: int):
+    with engine.begin() as connection:
+        connection.execute(
+            user_table.insert(),
+            [{"email": f"user{i}@example.com"} for i in range(likes)],
+        )
+        connection.execute(
+            post_table.insert(),
+            [{"body": f"Post {i}", "user_id": 1} for i in range(OTHER_POSTS)],
+        )
+        # Interleaved like ids, with the counter triggers keeping
+        # posts.like_count in step
+        rows = [{"post_id": POST_ID, "user_id": i + 1} for i in range(likes)]
+        for post_id in range(2, OTHER_POSTS + 1):
+            start = post_id * OTHER_POST_LIKES % len(rows)
+            rows[start:start] = [
+                {"post_id": post_id, "user_id": i + 1}
+                for i in range(OTHER_POST_LIKES)
+            ]
+        connection.execute(like_table.insert(), rows)
+        connection.exec_driver_sql("ANALYZE")
+
+
+def queries(likes: int, middle_id: int, page_size: int) -> dict:
+    newest = like_table.select().where(like_table.c.post_id == POST_ID)
+    return {
+        "count: COUNT(*) of likes": sqlalchemy.select(
+            sqlalchemy.func.count()
+        ).where(like_table.c.post_id == POST_ID),
+        "count: like_count counter": select_post_with_likes.where(
+            post_table.c.id == POST_ID
+        ),
+        "first page: OFFSET": newest.order_by(like_table.c.id.desc())
+        .limit(page_size)
+        .offset(0),
+        "first page: keyset": select_likes_page(POST_ID, None, page_size),
+        "middle page: OFFSET": newest.order_by(like_table.c.id.desc())
+        .limit(page_size)
+        .offset(likes // 2),
+        "middle page: keyset": select_likes_page(
+            POST_ID, encode_cursor("likes", middle_id), page_size
+        ),
+    }
+
+
+def report(engine: sqlalchemy.engine.Engine, likes: int, page_size: int):
+    repeat = 20
+    with engine.connect() as connection:
+        # The id a keyset cursor halfway down the likes would hold
+        middle_id = connection.execute(
+            sqlalchemy.select(like_table.c.id)
+            .where(like_table.c.post_id == POST_ID)
+            .order_by(like_table.c.id.desc())
+            .offset(likes // 2 - 1)
+            .limit(1)
+        ).scalar_one()
+        for name, query in queries(likes, middle_id, page_size).items():
+            sql = str(
+                query.compile(
+                    dialect=engine.dialect,
+                    compile_kwargs={"literal_binds": True},
+                )
+            )
+            plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+            details = "; ".join(row[-1] for row in plan)
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                connection.exec_driver_sql(sql).fetchall()
+            elapsed = (time.perf_counter() - start) / repeat * 1000
+
+            print(f"{name:<28} {elapsed:8.3f} ms  {details}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--likes", type=int, default=200_000)
+    parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine("sqlite://")
+    metadata.create_all(engine)
+    populate(engine, args.likes)
+    print(f"{args.likes} likes on one post, pages of {args.page_size}")
+    report(engine, args.likes, args.page_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Measure event loop lag while concurrent logins verify bcrypt passwords,
+with verification on the event loop and on the password hash pool.
+
+    python -m benchmarks.password_hashing [--logins N]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("ENV_STATE", "test")
+from social import security  # noqa: E402
+
+TICK = 0.005
+
+
+async def measure_lag(stop: asyncio.Event) -> list[float]:
+    """Sleep for TICK in a loop and record how late each wake-up is."""
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+    return lags
+
+
+async def blocking_login(hashed: str):
+    security.verify_password("secret", hashed)
+
+
+async def offloaded_login(hashed: str):
+    await security.verify_password_async("secret", hashed)
+
+
+async def run(login, hashed: str, logins: int):
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(TICK * 2)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login(hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    lags = await lag_task
+    print(
+        f"{login.__name__:<16} {logins} logins in {elapsed:6.2f}s  "
+        f"loop lag p50 {statistics.median(lags) * 1000:7.1f} ms  "
+        f"max {max(lags) * 1000:7.1f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=16)
+    args = parser.parse_args()
+
+    hashed = security.get_password_hash("secret")
+    await run(blocking_login, hashed, args.logins)
+    await run(offloaded_login, hashed, args.logins)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
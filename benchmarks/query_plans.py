@@ -0,0 +1,125 @@
+"""Compare SQLite query plans and timings with and without the secondary
+indexes declared in `social.database`.
+
+    python -m benchmarks.query_plans [--posts N] [--likes-per-post N]
+"""
+
+import argparse
+import os
+import random
+import time
+
+import sqlalchemy
+
+os.environ.setdefault("ENV_STATE", "test")
+from social.database import (  # noqa: E402
+    comment_table,
+    like_table,
+    metadata,
+    post_table,
+    user_table,
+)
+
+QUERIES = {
+    "comments on a post": lambda: comment_table.select().where(
+        comment_table.c.post_id == 42
+    ),
+    "likes on a post": lambda: like_table.select().where(
+        like_table.c.post_id == 42
+    ),
+    "like by user on a post": lambda: like_table.select().where(
+        like_table.c.post_id == 42, like_table.c.user_id == 7
+    ),
+    "likes by a user": lambda: like_table.select().where(
+        like_table.c.user_id == 7
+    ),
+    "posts by a user": lambda: post_table.select().where(
+        post_table.c.user_id == 7
+    ),
+    "most_likes feed page": lambda: post_table.select()
+    .order_by(post_table.c.like_count.desc(), post_table.c.id.asc())
+    .limit(20),
+}
+
+
+def populate(engine: sqlalchemy.engine.Engine, posts: int, likes: int):
+    users = 1_000
+    with engine.begin() as connection:
+        connection.execute(
+            user_table.insert(),
+            [{"email": f"user{i}@example.com"} for i in range(users)],
+        )
+        connection.execute(
+            post_table.insert(),
+            [
+                {
+                    "body": f"Post {i}",
+                    "user_id": random.randrange(users) + 1,
+                    "like_count": random.randrange(likes * 2),
+                }
+                for i in range(posts)
+            ],
+        )
+        for post_id in range(1, posts + 1):
+            likers = random.sample(range(1, users + 1), likes)
+            connection.execute(
+                like_table.insert(),
+                [{"post_id": post_id, "user_id": u} for u in likers],
+            )
+            connection.execute(
+                comment_table.insert(),
+                [
+                    {"body": "Comment", "post_id": post_id, "user_id": u}
+                    for u in likers
+                ],
+            )
+
+
+def report(engine: sqlalchemy.engine.Engine, label: str, repeat: int = 20):
+    print(f"\n== {label}")
+    with engine.connect() as connection:
+        for name, build in QUERIES.items():
+            sql = str(
+                build().compile(
+                    dialect=engine.dialect,
+                    compile_kwargs={"literal_binds": True},
+                )
+            )
+            plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+            details = "; ".join(row[-1] for row in plan)
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                connection.exec_driver_sql(sql).fetchall()
+            elapsed = (time.perf_counter() - start) / repeat * 1000
+
+            print(f"{name:<24} {elapsed:8.3f} ms  {details}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=2_000)
+    parser.add_argument("--likes-per-post", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine("sqlite://")
+    metadata.create_all(engine)
+    populate(engine, args.posts, args.likes_per_post)
+
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(connection)
+        connection.exec_driver_sql("ANALYZE")
+    report(engine, "without secondary indexes")
+
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection)
+        connection.exec_driver_sql("ANALYZE")
+    report(engine, "with secondary indexes")
+
+
+if __name__ == "__main__":
+    main()
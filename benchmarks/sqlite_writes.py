@@ -0,0 +1,115 @@
+"""Throughput of concurrent like/comment writes mixed with feed reads on
+a SQLite file, in the default mode and in SQLITE_PERFORMANCE_MODE.
+
+    python -m benchmarks.sqlite_writes [--clients N] [--ops N]
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+os.environ.setdefault("ENV_STATE", "test")
+import sqlalchemy  # noqa: E402
+
+from social.config import config  # noqa: E402
+from social.database import (  # noqa: E402
+    Database,
+    comment_table,
+    like_table,
+    metadata,
+    post_table,
+    user_table,
+)
+from social.routers.post import (  # noqa: E402
+    insert_for_existing_post,
+    select_post_with_likes,
+)
+
+POSTS = 100
+
+
+def create_database(path: str, users: int):
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(
+            user_table.insert(),
+            [{"email": f"user{i}@example.com"} for i in range(users)],
+        )
+        connection.execute(
+            post_table.insert(),
+            [{"body": f"post {i}", "user_id": 1} for i in range(POSTS)],
+        )
+    engine.dispose()
+
+
+async def client(db: Database, user_id: int, ops: int) -> int:
+    errors = 0
+    for i in range(ops):
+        post_id = i % POSTS + 1
+        try:
+            if i % 3 == 0:
+                # Read then write in one transaction, like the job queue
+                async with db.transaction():
+                    await db.fetch_one(
+                        post_table.select().where(post_table.c.id == post_id)
+                    )
+                    await db.fetch_one(
+                        insert_for_existing_post(
+                            like_table, post_id, user_id=user_id
+                        )
+                    )
+            elif i % 3 == 1:
+                await db.fetch_one(
+                    insert_for_existing_post(
+                        comment_table, post_id, body="hi", user_id=user_id
+                    )
+                )
+            else:
+                await db.fetch_all(
+                    select_post_with_likes.order_by(
+                        post_table.c.id.desc()
+                    ).limit(20)
+                )
+        except sqlite3.OperationalError:
+            errors += 1
+    return errors
+
+
+async def run(performance_mode: bool, clients: int, ops: int):
+    config.SQLITE_PERFORMANCE_MODE = performance_mode
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "social.db")
+        create_database(path, clients)
+        async with Database(f"sqlite:///{path}") as db:
+            start = time.perf_counter()
+            errors = await asyncio.gather(
+                *(
+                    client(db, user_id, ops)
+                    for user_id in range(1, clients + 1)
+                )
+            )
+            elapsed = time.perf_counter() - start
+    total = clients * ops
+    print(
+        f"performance mode {'on ' if performance_mode else 'off'}  "
+        f"{total} ops in {elapsed:6.2f}s  {total / elapsed:8.0f} ops/s  "
+        f"{sum(errors)} locked errors"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--ops", type=int, default=150)
+    args = parser.parse_args()
+
+    for performance_mode in (False, True):
+        await run(performance_mode, args.clients, args.ops)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
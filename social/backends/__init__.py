@@ -0,0 +1,66 @@
+import time
+from typing import Union
+
+from sqlalchemy.sql.elements import ClauseElement, TextClause
+
+
+def is_write(query: Union[ClauseElement, str]) -> bool:
+    """Whether a statement may change the database. Raw SQL counts as a
+    write unless it is a SELECT or WITH query."""
+    if isinstance(query, str):
+        return not query.lstrip().upper().startswith(("SELECT", "WITH"))
+    if isinstance(query, TextClause):
+        return is_write(query.text)
+    return getattr(query, "is_dml", False) or getattr(query, "is_ddl", False)
+
+
+class PoolStats:
+    """Connection pool usage of one database, see /metrics.
+
+    `waiting` counts tasks blocked acquiring a connection right now, the
+    wait_seconds figures how long acquiring took since start up.
+    """
+
+    def __init__(self):
+        self.in_use = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+class InstrumentedConnection:
+    """Mixin for a databases ConnectionBackend that records its acquire
+    and release in `pool_stats`."""
+
+    pool_stats: PoolStats
+
+    async def acquire(self) -> None:
+        self.pool_stats.waiting += 1
+        start = time.perf_counter()
+        try:
+            await super().acquire()
+        finally:
+            self.pool_stats.waiting -= 1
+        wait = time.perf_counter() - start
+        self.pool_stats.in_use += 1
+        self.pool_stats.acquired += 1
+        self.pool_stats.wait_seconds_total += wait
+        self.pool_stats.wait_seconds_max = max(
+            self.pool_stats.wait_seconds_max, wait
+        )
+
+    async def release(self) -> None:
+        try:
+            await super().release()
+        finally:
+            self.pool_stats.in_use -= 1
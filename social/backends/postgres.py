@@ -0,0 +1,26 @@
+from databases.backends import postgres
+
+from social.backends import InstrumentedConnection, PoolStats
+
+
+class PostgresConnection(InstrumentedConnection, postgres.PostgresConnection):
+    pass
+
+
+class PostgresBackend(postgres.PostgresBackend):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool_stats = PoolStats()
+
+    def connection(self) -> PostgresConnection:
+        connection = PostgresConnection(self, self._dialect)
+        connection.pool_stats = self._pool_stats
+        return connection
+
+    def pool_stats(self) -> dict:
+        stats = self._pool_stats.stats()
+        if self._pool is not None:
+            stats["size"] = self._pool.get_size()
+            stats["idle"] = self._pool.get_idle_size()
+            stats["max_size"] = self._pool.get_max_size()
+        return stats
@@ -0,0 +1,161 @@
+import asyncio
+import contextlib
+import logging
+from typing import Any, Optional
+
+import aiosqlite
+from databases.backends import sqlite
+from sqlalchemy.sql.elements import ClauseElement
+
+from social.backends import InstrumentedConnection, PoolStats, is_write
+from social.config import config
+
+logger = logging.getLogger(__name__)
+
+
+def performance_pragmas() -> list[str]:
+    return [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}",
+        # Negative sizes are in KiB rather than pages
+        f"PRAGMA cache_size=-{config.SQLITE_CACHE_SIZE_KIB}",
+        f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}",
+    ]
+
+
+class SQLitePool(sqlite.SQLitePool):
+    """Keeps up to SQLITE_POOL_SIZE idle connections open, instead of
+    opening one (and its thread) per acquire, and sets the performance
+    pragmas once on each new connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._idle: list[aiosqlite.Connection] = []
+
+    async def acquire(self) -> aiosqlite.Connection:
+        if self._idle:
+            return self._idle.pop()
+        connection = await super().acquire()
+        for pragma in performance_pragmas():
+            await connection.execute(pragma)
+        return connection
+
+    async def release(self, connection: aiosqlite.Connection) -> None:
+        if (
+            len(self._idle) < config.SQLITE_POOL_SIZE
+            and not connection.in_transaction
+        ):
+            self._idle.append(connection)
+        else:
+            await super().release(connection)
+
+    async def close(self) -> None:
+        while self._idle:
+            await super().release(self._idle.pop())
+
+
+class SQLiteTransaction(sqlite.SQLiteTransaction):
+    """Holds the writer lock from BEGIN to COMMIT/ROLLBACK, so that a
+    transaction that reads before it writes can't be refused the write
+    lock by SQLite."""
+
+    async def start(self, is_root: bool, extra_options: dict) -> None:
+        if is_root:
+            await self._connection.acquire_writer()
+        try:
+            await super().start(is_root, extra_options)
+        except BaseException:
+            if is_root:
+                self._connection.release_writer()
+            raise
+
+    async def commit(self) -> None:
+        try:
+            await super().commit()
+        finally:
+            if self._is_root:
+                self._connection.release_writer()
+
+    async def rollback(self) -> None:
+        try:
+            await super().rollback()
+        finally:
+            if self._is_root:
+                self._connection.release_writer()
+
+
+class SQLiteConnection(InstrumentedConnection, sqlite.SQLiteConnection):
+    """With a `writer` lock, statements that write and transactions run
+    one at a time across all connections, while reads stay concurrent."""
+
+    writer: Optional[asyncio.Lock] = None
+    _holds_writer = False
+
+    async def acquire_writer(self) -> None:
+        if self.writer is not None:
+            await self.writer.acquire()
+            self._holds_writer = True
+
+    def release_writer(self) -> None:
+        if self._holds_writer:
+            self._holds_writer = False
+            self.writer.release()
+
+    @contextlib.asynccontextmanager
+    async def _writing(self, query: ClauseElement):
+        if self.writer is None or self._holds_writer or not is_write(query):
+            yield
+            return
+        async with self.writer:
+            yield
+
+    async def fetch_all(self, query: ClauseElement) -> list:
+        async with self._writing(query):
+            return await super().fetch_all(query)
+
+    async def fetch_one(self, query: ClauseElement) -> Any:
+        async with self._writing(query):
+            return await super().fetch_one(query)
+
+    async def execute(self, query: ClauseElement) -> Any:
+        async with self._writing(query):
+            return await super().execute(query)
+
+    def transaction(self) -> SQLiteTransaction:
+        return SQLiteTransaction(self)
+
+
+class SQLiteBackend(sqlite.SQLiteBackend):
+    """SQLite backend that records pool usage and, with
+    SQLITE_PERFORMANCE_MODE, runs WAL with tuned pragmas on pooled
+    connections and funnels every write through a single writer."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool_stats = PoolStats()
+        self._writer: Optional[asyncio.Lock] = None
+        self._performance_mode = config.SQLITE_PERFORMANCE_MODE
+        if self._performance_mode:
+            logger.info("Using SQLite performance mode")
+            self._pool = SQLitePool(self._database_url, **self._options)
+
+    async def connect(self) -> None:
+        if self._performance_mode:
+            # Created here rather than in __init__ to belong to the
+            # running event loop
+            self._writer = asyncio.Lock()
+
+    async def disconnect(self) -> None:
+        await super().disconnect()
+        if self._performance_mode:
+            await self._pool.close()
+
+    def connection(self) -> SQLiteConnection:
+        connection = SQLiteConnection(self._pool, self._dialect)
+        connection.pool_stats = self._pool_stats
+        connection.writer = self._writer
+        return connection
+
+    def pool_stats(self) -> dict:
+        return self._pool_stats.stats()
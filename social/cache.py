@@ -0,0 +1,132 @@
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Cache(ABC):
+    """Base class for the async key/value caches.
+
+    Values must be JSON serializable so that a shared backend can store
+    them. Every backend keeps hit/miss counters, see `stats`.
+    """
+
+    def __init__(self, namespace: str, ttl: float):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = await self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self._set(key, value, self.ttl if ttl is None else ttl)
+
+    @abstractmethod
+    async def delete(self, *keys: str): ...
+
+    @abstractmethod
+    async def clear(self): ...
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    @abstractmethod
+    async def _get(self, key: str) -> Optional[Any]: ...
+
+    @abstractmethod
+    async def _set(self, key: str, value: Any, ttl: float): ...
+
+
+class InMemoryCache(Cache):
+    """Per-process LRU cache whose entries also expire after `ttl`
+    seconds."""
+
+    def __init__(self, namespace: str, ttl: float, maxsize: int):
+        super().__init__(namespace, ttl)
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def _get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def _set(self, key: str, value: Any, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {**super().stats(), "size": len(self._entries)}
+
+
+class RedisCache(Cache):
+    """Cache shared between processes, stored in Redis as JSON."""
+
+    def __init__(self, namespace: str, ttl: float, url: str):
+        super().__init__(namespace, ttl)
+        try:
+            import redis.asyncio
+        except ImportError as e:
+            raise RuntimeError(
+                "A redis:// cache URL needs the redis package installed"
+            ) from e
+        self._redis = redis.asyncio.Redis.from_url(url)
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def _get(self, key: str) -> Optional[Any]:
+        value = await self._redis.get(self._key(key))
+        return None if value is None else json.loads(value)
+
+    async def _set(self, key: str, value: Any, ttl: float):
+        await self._redis.set(
+            self._key(key), json.dumps(value), px=int(ttl * 1000)
+        )
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._redis.delete(*(self._key(key) for key in keys))
+
+    async def clear(self):
+        async for key in self._redis.scan_iter(match=self._key("*")):
+            await self._redis.delete(key)
+
+
+def create_cache(
+    namespace: str, ttl: float, maxsize: int, url: Optional[str] = None
+) -> Cache:
+    """Build the cache backend for `url`: in-memory when it isn't set,
+    Redis for redis:// and rediss:// URLs."""
+    if url is None:
+        return InMemoryCache(namespace, ttl=ttl, maxsize=maxsize)
+    if url.startswith(("redis://", "rediss://")):
+        logger.debug(f"Using redis cache for {namespace}")
+        return RedisCache(namespace, ttl=ttl, url=url)
+    raise ValueError(f"Unsupported cache URL for {namespace}: {url}")
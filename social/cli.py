@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import logging
+import signal
+
+from social.config import config
+from social.database import database, get_engine
+from social.jobs import Worker, enqueue
+from social.logging_conf import configure_logging
+from social.migrations import upgrade
+from social.tasks import (
+    backfill_post_images,
+    close_http_client,
+    close_openai_client,
+    reconcile_follower_counts,
+    reconcile_post_counts,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def migrate(args: argparse.Namespace):
+    upgrade(get_engine())
+    # Columns added by the upgrade start at zero and removed duplicate
+    # likes leave the counters high, so recount afterwards.
+    await reconcile_counts(args)
+
+
+async def reconcile_counts(args: argparse.Namespace):
+    async with database:
+        await reconcile_post_counts(database)
+        await reconcile_follower_counts(database)
+
+
+async def backfill_images(args: argparse.Namespace):
+    async with database:
+        try:
+            post_ids = await backfill_post_images(database)
+        finally:
+            await close_http_client()
+        for post_id in post_ids:
+            await enqueue("process_post_image", post_id=post_id)
+
+
+async def worker(args: argparse.Namespace):
+    job_worker = Worker(database, config.JOB_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, job_worker.stop)
+    async with database:
+        try:
+            await job_worker.run()
+        finally:
+            await close_openai_client()
+            await close_http_client()
+
+
+COMMANDS = {
+    "migrate": migrate,
+    "reconcile-counts": reconcile_counts,
+    "backfill-images": backfill_images,
+    "worker": worker,
+}
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m social.cli")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser(
+        "migrate",
+        help="Create or upgrade the database schema, including indexes",
+    )
+    subparsers.add_parser(
+        "reconcile-counts",
+        help="Repair drift in the denormalized like, comment and follower "
+        "counters",
+    )
+    subparsers.add_parser(
+        "backfill-images",
+        help="Copy post images stored as external URLs into our bucket",
+    )
+    subparsers.add_parser(
+        "worker",
+        help="Run queued background jobs (emails, image generation)",
+    )
+
+    args = parser.parse_args(argv)
+    configure_logging()
+    asyncio.run(COMMANDS[args.command](args))
+
+
+if __name__ == "__main__":
+    main()
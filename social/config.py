@@ -15,18 +15,120 @@ class BaseConfig(BaseSettings):
 class GlobalConfig(BaseConfig):
     DATABASE_URL: Optional[str] = None
     DB_FORCE_ROLL_BACK: bool = False
+    # asyncpg pool of a postgresql:// DATABASE_URL
+    DATABASE_POOL_MIN_SIZE: int = 5
+    DATABASE_POOL_MAX_SIZE: int = 20
+    # Idle connections are closed after this long, and any connection
+    # after this many queries
+    DATABASE_POOL_RECYCLE_SECONDS: float = 300
+    DATABASE_POOL_MAX_QUERIES: int = 50_000
+    DATABASE_STATEMENT_TIMEOUT_MS: Optional[int] = None
+    # Read replicas of DATABASE_URL: reads go to a replica unless it lags
+    # more than REPLICA_MAX_LAG_SECONDS, or the client wrote within the
+    # last REPLICA_STICKY_SECONDS
+    DATABASE_REPLICA_URLS: list[str] = []
+    REPLICA_MAX_LAG_SECONDS: float = 5
+    REPLICA_LAG_CHECK_INTERVAL_SECONDS: float = 5
+    REPLICA_STICKY_SECONDS: float = 10
+    # A replica that doesn't connect or answer its lag check in time
+    # counts as unavailable; reads on a Postgres replica are cancelled
+    # after REPLICA_QUERY_TIMEOUT_SECONDS and retried on the primary
+    REPLICA_CHECK_TIMEOUT_SECONDS: float = 2
+    REPLICA_QUERY_TIMEOUT_SECONDS: float = 5
+    # Opt-in for sqlite:// URLs: WAL and tuned pragmas on pooled
+    # connections, with all writes serialized through one writer
+    SQLITE_PERFORMANCE_MODE: bool = False
+    SQLITE_POOL_SIZE: int = 8
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_CACHE_SIZE_KIB: int = 64 * 1024
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
     LOG_FILE: Optional[str] = None
     LOGTAIL_API_KEY: Optional[str] = None
     JWT_ALGORITHM: Optional[str] = None
     JWT_SECRET_KEY: Optional[str] = None
     MAILGUN_API_KEY: Optional[str] = None
     MAILGUN_DOMAIN: Optional[str] = None
+    # Shared outbound HTTP client (Mailgun); HTTP/2 needs the h2 package
+    HTTP_MAX_CONNECTIONS: int = 20
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 30
+    HTTP_TIMEOUT_SECONDS: float = 10
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = 5
+    HTTP2_ENABLED: bool = False
     B2_API_KEY_ID: Optional[str] = None
     B2_BUCKET_NAME: Optional[str] = None
     B2_API_KEY: Optional[str] = None
+    # In-memory b2sdk simulator instead of the real B2, for offline use
+    B2_SIMULATE: bool = False
+    # How long a client has to finish a direct upload it was authorized
+    # for, and how long the B2 key it was given for it is valid
+    B2_DIRECT_UPLOAD_TTL_SECONDS: float = 15 * 60
+    # Uploads over one part go up as B2 large files, parts are >= 5MB
+    B2_UPLOAD_PART_SIZE: int = 8 * 1024 * 1024
+    B2_UPLOAD_PARTS_IN_FLIGHT: int = 2
+    B2_UPLOAD_THREADS: int = 8
     OPENAI_API_KEY: Optional[str] = None
     OPENAI_IMAGE_SIZE: Optional[str] = None
+    # Per process limits for image generation, tune to the API tier
+    OPENAI_IMAGE_MAX_CONCURRENCY: int = 2
+    OPENAI_IMAGES_PER_MINUTE: float = 5
+    OPENAI_IMAGE_BURST: int = 1
+    # Retries of 429s and transient errors, honouring retry-after
+    OPENAI_MAX_RETRIES: int = 3
     SENTRY_DSN: Optional[str] = None
+    # Parallel downloads of `python -m social.cli backfill-images`
+    IMAGE_BACKFILL_CONCURRENCY: int = 8
+    # Resized copies of post images, see social.images
+    IMAGE_WORKERS: int = 2
+    IMAGE_THUMBNAIL_SIZE: int = 160
+    IMAGE_VARIANT_WIDTHS: list[int] = [320, 640, 1080]
+    IMAGE_VARIANT_FORMATS: list[str] = ["webp", "avif"]
+    POST_PAGE_SIZE: int = 20
+    POST_PAGE_SIZE_MAX: int = 100
+    LIKE_PAGE_SIZE: int = 50
+    COMMENT_PAGE_SIZE: int = 50
+    COMMENT_PAGE_SIZE_MAX: int = 500
+    # Comments embedded in GET /post/{id}, the rest are paged
+    POST_COMMENTS_EMBEDDED: int = 20
+    # Rows fetched per query by the NDJSON comment export
+    COMMENT_EXPORT_BATCH_SIZE: int = 1000
+    LIKE_PAGE_SIZE_MAX: int = 500
+    # Items accepted by one call of the batch like/comment endpoints
+    BATCH_MAX_ITEMS: int = 500
+    # Authors with more followers than this aren't fanned out to home
+    # timelines, their posts are merged in when reading instead
+    TIMELINE_FANOUT_MAX_FOLLOWERS: int = 10_000
+    # Latest posts of a user added to a timeline on following them
+    TIMELINE_FOLLOW_BACKFILL: int = 50
+    # Shared cache backend (redis://...), in-process memory when unset
+    CACHE_URL: Optional[str] = None
+    USER_CACHE_TTL_SECONDS: float = 60
+    USER_CACHE_MAXSIZE: int = 10_000
+    # Cached public post responses, see social.response_cache
+    RESPONSE_CACHE_MAXSIZE: int = 10_000
+    FEED_CACHE_TTL_SECONDS: float = 5
+    POST_CACHE_TTL_SECONDS: float = 30
+    COMMENTS_CACHE_TTL_SECONDS: float = 30
+    # Serialize public post responses straight from the rows with orjson
+    # (needs the orjson package) instead of validating them with pydantic
+    FAST_JSON_RESPONSES: bool = False
+    JWT_DECODE_CACHE_ENABLED: bool = True
+    JWT_DECODE_CACHE_MAXSIZE: int = 10_000
+    PASSWORD_HASH_WORKERS: int = 4
+    # Hash/verify calls allowed to wait for a worker before returning 503
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+    # Concurrent jobs per kind in each `python -m social.cli worker`
+    JOB_CONCURRENCY: dict[str, int] = {
+        "send_user_registration_email": 10,
+        "generate_image_and_add_to_post": 2,
+        "process_post_image": 2,
+        "fan_out_post": 4,
+    }
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BACKOFF_SECONDS: float = 10
+    # How long a job may run before another worker may claim it again
+    JOB_LEASE_SECONDS: float = 300
+    JOB_POLL_INTERVAL_SECONDS: float = 1
 
 
 class DevConfig(GlobalConfig):
@@ -44,6 +146,8 @@ class TestConfig(GlobalConfig):
         "4598398cca0a7ecb7c7466fb30e43d4525bb3f5c59974183c8f46724e63ccee7"
     )
     JWT_ALGORITHM: str = "HS256"
+    B2_SIMULATE: bool = True
+    B2_BUCKET_NAME: str = "test-bucket"
 
     model_config = SettingsConfigDict(env_prefix="TEST_")
 
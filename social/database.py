@@ -1,8 +1,44 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+import math
+import sqlite3
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, AsyncGenerator, Optional, Sequence, Union
+
 import databases
 import sqlalchemy
+from sqlalchemy.sql.elements import ClauseElement
 
+from social.backends import is_write
 from social.config import config
 
+logger = logging.getLogger(__name__)
+
+# The databases package hands driver exceptions straight through, so
+# constraint violations surface as the driver's own integrity error.
+INTEGRITY_ERRORS: tuple[type[Exception], ...] = (sqlite3.IntegrityError,)
+# Errors after which a read is retried on the primary
+REPLICA_ERRORS: tuple[type[Exception], ...] = (
+    OSError,
+    asyncio.TimeoutError,
+    sqlite3.OperationalError,
+)
+try:
+    import asyncpg
+
+    INTEGRITY_ERRORS += (asyncpg.IntegrityConstraintViolationError,)
+    REPLICA_ERRORS += (
+        asyncpg.PostgresConnectionError,
+        asyncpg.InterfaceError,
+        asyncpg.CannotConnectNowError,
+    )
+except ImportError:
+    pass
+
 metadata = sqlalchemy.MetaData()
 
 user_table = sqlalchemy.Table(
@@ -12,6 +48,44 @@ user_table = sqlalchemy.Table(
     sqlalchemy.Column("email", sqlalchemy.String, unique=True),
     sqlalchemy.Column("password", sqlalchemy.String),
     sqlalchemy.Column("is_active", sqlalchemy.Boolean, default=False),
+    # Kept in step with the follows table by the counter triggers, see
+    # COUNTERS; decides between fan-out and pull in social.timeline.
+    sqlalchemy.Column(
+        "follower_count",
+        sqlalchemy.Integer,
+        nullable=False,
+        server_default="0",
+    ),
+    # Set once any post of the user is pulled rather than fanned out,
+    # and never cleared, as those posts stay pulled.
+    sqlalchemy.Column(
+        "has_pulled_posts",
+        sqlalchemy.Boolean,
+        nullable=False,
+        server_default=sqlalchemy.false(),
+    ),
+)
+
+follow_table = sqlalchemy.Table(
+    "follows",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column(
+        "follower_id", sqlalchemy.ForeignKey("users.id"), nullable=False
+    ),
+    sqlalchemy.Column(
+        "followee_id", sqlalchemy.ForeignKey("users.id"), nullable=False
+    ),
+    sqlalchemy.Index(
+        "ix_follows_follower_id_followee_id",
+        "follower_id",
+        "followee_id",
+        unique=True,
+    ),
+    # The followers of a user, for the timeline fan-out.
+    sqlalchemy.Index(
+        "ix_follows_followee_id_follower_id", "followee_id", "follower_id"
+    ),
 )
 
 
@@ -24,6 +98,42 @@ post_table = sqlalchemy.Table(
         "user_id", sqlalchemy.ForeignKey("users.id"), nullable=False
     ),
     sqlalchemy.Column("image_url", sqlalchemy.String),
+    # Resized copies of the image, written by tasks.process_post_image
+    sqlalchemy.Column("image_variants", sqlalchemy.JSON),
+    # Denormalized counters, kept in step with the likes and comments
+    # tables by the triggers from create_counter_triggers; see
+    # tasks.reconcile_post_counts for drift repair.
+    sqlalchemy.Column(
+        "like_count",
+        sqlalchemy.Integer,
+        nullable=False,
+        server_default="0",
+    ),
+    sqlalchemy.Column(
+        "comment_count",
+        sqlalchemy.Integer,
+        nullable=False,
+        server_default="0",
+    ),
+    # Whether the post wasn't fanned out to followers' timelines, its
+    # author having too many followers then, and is merged in when they
+    # are read instead; see social.timeline.
+    sqlalchemy.Column(
+        "pulled",
+        sqlalchemy.Boolean,
+        nullable=False,
+        server_default=sqlalchemy.false(),
+    ),
+    # Backs the latest pulled, or fanned out, posts of a user, newest
+    # first, for timeline reads and the follow backfill, and lookups by
+    # user_id alone.
+    sqlalchemy.Index("ix_posts_user_id_pulled_id", "user_id", "pulled", "id"),
+)
+# Backs the keyset seek of the most_likes feed ordering.
+sqlalchemy.Index(
+    "ix_posts_like_count_id",
+    post_table.c.like_count.desc(),
+    post_table.c.id,
 )
 
 comment_table = sqlalchemy.Table(
@@ -37,6 +147,9 @@ comment_table = sqlalchemy.Table(
     sqlalchemy.Column(
         "user_id", sqlalchemy.ForeignKey("users.id"), nullable=False
     ),
+    # Backs the keyset pages of a post's comments, oldest first, and
+    # lookups by post_id alone.
+    sqlalchemy.Index("ix_comments_post_id_id", "post_id", "id"),
 )
 
 like_table = sqlalchemy.Table(
@@ -46,18 +159,488 @@ like_table = sqlalchemy.Table(
     sqlalchemy.Column(
         "post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False
     ),
+    sqlalchemy.Column(
+        "user_id",
+        sqlalchemy.ForeignKey("users.id"),
+        nullable=False,
+        index=True,
+    ),
+    # Also serves lookups by post_id alone, so that column needs no index
+    # of its own.
+    sqlalchemy.Index(
+        "ix_likes_post_id_user_id", "post_id", "user_id", unique=True
+    ),
+    # Backs the keyset pages of a post's likes, newest first.
+    sqlalchemy.Index("ix_likes_post_id_id", "post_id", "id"),
+)
+
+# Materialized home timelines, a row for each post in the timeline of
+# each follower of its author (and the author's own), see
+# social.timeline. Posts made while their author had more than
+# TIMELINE_FANOUT_MAX_FOLLOWERS followers aren't fanned out, they are
+# pulled when reading.
+timeline_table = sqlalchemy.Table(
+    "timeline_entries",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column(
         "user_id", sqlalchemy.ForeignKey("users.id"), nullable=False
     ),
+    sqlalchemy.Column(
+        "post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False
+    ),
+    sqlalchemy.Column(
+        "author_id", sqlalchemy.ForeignKey("users.id"), nullable=False
+    ),
+    # Backs the keyset pages of a timeline, newest post first.
+    sqlalchemy.Index(
+        "ix_timeline_entries_user_id_post_id",
+        "user_id",
+        "post_id",
+        unique=True,
+    ),
 )
 
-engine = sqlalchemy.create_engine(
-    config.DATABASE_URL,
-    connect_args={"check_same_thread": False},
+# Uploaded content stored once in B2 under its sha256, however many
+# uploads share it.
+blob_table = sqlalchemy.Table(
+    "blobs",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("sha256", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("file_name", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("file_id", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("file_url", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("size", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Index("ix_blobs_sha256", "sha256", unique=True),
+)
+
+# Files uploaded by users, see routers.upload. `name` is the user's name
+# for the file and `file_name` the B2 object name. Uploads through the
+# API point at a shared blob. A direct upload's row is created when the
+# upload is authorized and completed once the file is found in the bucket.
+upload_table = sqlalchemy.Table(
+    "uploads",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column(
+        "user_id",
+        sqlalchemy.ForeignKey("users.id"),
+        nullable=False,
+        index=True,
+    ),
+    sqlalchemy.Column("name", sqlalchemy.String),
+    sqlalchemy.Column("blob_id", sqlalchemy.ForeignKey("blobs.id")),
+    sqlalchemy.Column("file_name", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("expires_at", sqlalchemy.Float, nullable=False),
+    sqlalchemy.Column("file_id", sqlalchemy.String),
+    sqlalchemy.Column("file_url", sqlalchemy.String),
+    sqlalchemy.Column("size", sqlalchemy.Integer),
+    sqlalchemy.Column("completed_at", sqlalchemy.Float),
+)
+
+# Background jobs waiting to run, see social.jobs. run_at (epoch seconds)
+# is when the job is next due, and doubles as the lease of a running job.
+job_table = sqlalchemy.Table(
+    "jobs",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("kind", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("payload", sqlalchemy.JSON, nullable=False),
+    sqlalchemy.Column(
+        "attempts", sqlalchemy.Integer, nullable=False, server_default="0"
+    ),
+    sqlalchemy.Column("run_at", sqlalchemy.Float, nullable=False),
+    sqlalchemy.Column("last_error", sqlalchemy.String),
+    sqlalchemy.Index("ix_jobs_kind_run_at", "kind", "run_at"),
+)
+
+# Jobs that failed on every attempt, kept for inspection and replay.
+dead_letter_job_table = sqlalchemy.Table(
+    "dead_letter_jobs",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("kind", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("payload", sqlalchemy.JSON, nullable=False),
+    sqlalchemy.Column("attempts", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("last_error", sqlalchemy.String),
+    sqlalchemy.Column("failed_at", sqlalchemy.Float, nullable=False),
+)
+
+# Denormalized counters maintained by triggers, as (child table, its
+# foreign key, parent table, parent counter column).
+COUNTERS = (
+    ("likes", "post_id", "posts", "like_count"),
+    ("comments", "post_id", "posts", "comment_count"),
+    ("follows", "followee_id", "users", "follower_count"),
+)
+
+
+def create_counter_triggers(connection: sqlalchemy.engine.Connection):
+    """Create the triggers that maintain the counters in COUNTERS.
+
+    Doing this in the database keeps every insert into a child table a
+    single statement, and the counter can't be forgotten by a new write
+    path. Safe to run repeatedly.
+    """
+    dialect = connection.dialect.name
+    for table, key, parent, counter in COUNTERS:
+        if dialect == "sqlite":
+            statements = [
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_{counter}_insert
+                AFTER INSERT ON {table} BEGIN
+                    UPDATE {parent} SET {counter} = {counter} + 1
+                    WHERE id = NEW.{key};
+                END""",
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_{counter}_delete
+                AFTER DELETE ON {table} BEGIN
+                    UPDATE {parent} SET {counter} = {counter} - 1
+                    WHERE id = OLD.{key};
+                END""",
+            ]
+        elif dialect == "postgresql":
+            statements = [
+                f"""
+                CREATE OR REPLACE FUNCTION {parent}_{counter}()
+                RETURNS trigger AS $$ BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        UPDATE {parent} SET {counter} = {counter} + 1
+                        WHERE id = NEW.{key};
+                    ELSE
+                        UPDATE {parent} SET {counter} = {counter} - 1
+                        WHERE id = OLD.{key};
+                    END IF;
+                    RETURN NULL;
+                END $$ LANGUAGE plpgsql""",
+                f"""
+                CREATE OR REPLACE TRIGGER {table}_{counter}
+                AFTER INSERT OR DELETE ON {table}
+                FOR EACH ROW EXECUTE FUNCTION {parent}_{counter}()""",
+            ]
+        else:
+            logger.warning(
+                f"No counter triggers for {dialect}, {parent}.{counter} "
+                "won't be maintained"
+            )
+            continue
+        for statement in statements:
+            connection.execute(sqlalchemy.text(statement))
+
+
+@sqlalchemy.event.listens_for(metadata, "after_create")
+def _create_counter_triggers(target, connection, **kw):
+    create_counter_triggers(connection)
+
+
+class Database(databases.Database):
+    """databases.Database whose SQLite and Postgres backends record
+    connection pool usage, see `pool_stats`."""
+
+    SUPPORTED_BACKENDS = {
+        **databases.Database.SUPPORTED_BACKENDS,
+        "postgresql": "social.backends.postgres:PostgresBackend",
+        "postgres": "social.backends.postgres:PostgresBackend",
+        "sqlite": "social.backends.sqlite:SQLiteBackend",
+    }
+
+    def pool_stats(self) -> dict:
+        return self._backend.pool_stats()
+
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def database_options(
+    url: str, command_timeout: Optional[float] = None
+) -> dict:
+    """asyncpg pool settings from the config; SQLite has no pool.
+    `command_timeout` bounds every statement, client side."""
+    if is_sqlite(url):
+        return {}
+    options = {
+        "min_size": config.DATABASE_POOL_MIN_SIZE,
+        "max_size": config.DATABASE_POOL_MAX_SIZE,
+        "max_inactive_connection_lifetime": (
+            config.DATABASE_POOL_RECYCLE_SECONDS
+        ),
+        "max_queries": config.DATABASE_POOL_MAX_QUERIES,
+    }
+    if command_timeout:
+        options["command_timeout"] = command_timeout
+    if config.DATABASE_STATEMENT_TIMEOUT_MS:
+        options["server_settings"] = {
+            "statement_timeout": str(config.DATABASE_STATEMENT_TIMEOUT_MS)
+        }
+    return options
+
+
+class ReadRouting:
+    """Read-your-writes state of a request: its reads go to the primary
+    until `primary_until`, and `wrote` records that it wrote."""
+
+    def __init__(self, primary_until: float = 0.0):
+        self.primary_until = primary_until
+        self.wrote = False
+
+
+_read_routing: ContextVar[Optional[ReadRouting]] = ContextVar(
+    "read_routing", default=None
 )
 
-metadata.create_all(engine)
-database = databases.Database(
+
+def start_read_routing(primary_until: float = 0.0) -> ReadRouting:
+    """Give the current request its own read-your-writes state, shared
+    with the tasks it starts."""
+    routing = ReadRouting(primary_until)
+    _read_routing.set(routing)
+    return routing
+
+
+async def replica_lag(replica: databases.Database) -> float:
+    """Seconds a replica's replay is behind its primary. Only Postgres
+    replicates, other databases are only checked to answer."""
+    if replica.url.dialect not in ("postgresql", "postgres"):
+        await replica.fetch_val(sqlalchemy.select(0))
+        return 0.0
+    # An idle primary makes the last replay look old, so a replica that
+    # has replayed all it received counts as caught up.
+    lag = await replica.fetch_val(
+        sqlalchemy.text(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = "
+            "pg_last_wal_replay_lsn() THEN 0 ELSE EXTRACT(EPOCH FROM "
+            "now() - pg_last_xact_replay_timestamp()) END"
+        )
+    )
+    return float(lag or 0)
+
+
+class ReplicatedDatabase(Database):
+    """The primary database, which sends reads to its `replicas`.
+
+    Statements that write, and all statements while a transaction is
+    open on the task's connection, run on the primary.
+    Reads go round robin to the replicas lagging at most
+    REPLICA_MAX_LAG_SECONDS, rechecked every
+    REPLICA_LAG_CHECK_INTERVAL_SECONDS, and fall back to the primary
+    when none is fit or a replica fails. After a write, the request
+    (and with the cookie set in social.main, its client) reads from the
+    primary for REPLICA_STICKY_SECONDS to see its own writes.
+
+    Without replicas it behaves exactly like `Database`.
+    """
+
+    def __init__(self, url: str, *, replica_urls: Sequence[str] = (), **kw):
+        super().__init__(url, **kw)
+        self.replicas = [
+            Database(
+                replica_url,
+                **database_options(
+                    replica_url,
+                    command_timeout=config.REPLICA_QUERY_TIMEOUT_SECONDS,
+                ),
+            )
+            for replica_url in replica_urls
+        ]
+        self._lags = [0.0] * len(self.replicas)
+        self._next_replica = itertools.count()
+        self._monitor: Optional[asyncio.Task] = None
+
+    async def connect(self) -> None:
+        await super().connect()
+        if self.replicas:
+            await self.check_replicas()
+            self._monitor = asyncio.create_task(self._monitor_replicas())
+
+    async def disconnect(self) -> None:
+        if self._monitor is not None:
+            self._monitor.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._monitor
+            self._monitor = None
+        for replica in self.replicas:
+            if replica.is_connected:
+                await replica.disconnect()
+        await super().disconnect()
+
+    async def check_replicas(self) -> None:
+        """Measure the lag of every replica at once, connecting those
+        that aren't yet; one that can't be reached, or doesn't answer
+        within REPLICA_CHECK_TIMEOUT_SECONDS, counts as infinitely
+        behind."""
+        await asyncio.gather(
+            *(
+                self._check_replica(index)
+                for index in range(len(self.replicas))
+            )
+        )
+
+    async def _check_replica(self, index: int) -> None:
+        replica = self.replicas[index]
+
+        async def connect_and_measure() -> float:
+            if not replica.is_connected:
+                await replica.connect()
+            return await replica_lag(replica)
+
+        try:
+            self._lags[index] = await asyncio.wait_for(
+                connect_and_measure(), config.REPLICA_CHECK_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Replica {index} didn't answer in time")
+            self._lags[index] = math.inf
+        except Exception as e:
+            logger.warning(f"Replica {index} is unavailable: {e}")
+            self._lags[index] = math.inf
+        if self._lags[index] > config.REPLICA_MAX_LAG_SECONDS:
+            logger.warning(
+                f"Reading from the primary instead of replica {index}, "
+                f"{self._lags[index]}s behind"
+            )
+
+    async def _monitor_replicas(self) -> None:
+        while True:
+            await asyncio.sleep(config.REPLICA_LAG_CHECK_INTERVAL_SECONDS)
+            await self.check_replicas()
+
+    def replica_stats(self) -> list[dict]:
+        return [
+            {
+                "lag_seconds": None if math.isinf(lag) else lag,
+                "healthy": lag <= config.REPLICA_MAX_LAG_SECONDS,
+                "pool": replica.pool_stats() if replica.is_connected else None,
+            }
+            for replica, lag in zip(self.replicas, self._lags)
+        ]
+
+    def pinned_to_primary(self) -> bool:
+        """Whether reads in this context must see its recent writes, and
+        so go to the primary."""
+        routing = _read_routing.get()
+        return (
+            bool(self.replicas)
+            and routing is not None
+            and routing.primary_until > time.time()
+        )
+
+    def _wrote(self) -> None:
+        if not self.replicas:
+            return
+        routing = _read_routing.get()
+        if routing is None:
+            routing = start_read_routing()
+        routing.primary_until = time.time() + config.REPLICA_STICKY_SECONDS
+        routing.wrote = True
+
+    def in_transaction(self) -> bool:
+        """Whether a transaction is open on this task's connection, so
+        its reads must see its own uncommitted writes."""
+        connection = self._global_connection or self._connection
+        return connection is not None and bool(connection._transaction_stack)
+
+    def _reader(self, query: Union[ClauseElement, str]) -> Optional[int]:
+        """Index of the replica to run `query` on, None for the primary."""
+        if not self.replicas:
+            return None
+        if is_write(query):
+            self._wrote()
+            return None
+        if self.in_transaction() or self.pinned_to_primary():
+            return None
+        fit = [
+            index
+            for index, lag in enumerate(self._lags)
+            if lag <= config.REPLICA_MAX_LAG_SECONDS
+        ]
+        if not fit:
+            return None
+        return fit[next(self._next_replica) % len(fit)]
+
+    async def _read(self, method: str, query, values: Optional[dict]):
+        index = self._reader(query)
+        if index is not None:
+            try:
+                return await getattr(self.replicas[index], method)(
+                    query, values
+                )
+            except REPLICA_ERRORS as e:
+                logger.warning(f"Read from replica {index} failed: {e}")
+                self._lags[index] = math.inf
+        return await getattr(super(), method)(query, values)
+
+    async def fetch_all(self, query, values: Optional[dict] = None) -> list:
+        return await self._read("fetch_all", query, values)
+
+    async def fetch_one(self, query, values: Optional[dict] = None) -> Any:
+        return await self._read("fetch_one", query, values)
+
+    async def fetch_val(
+        self, query, values: Optional[dict] = None, column: Any = 0
+    ) -> Any:
+        row = await self.fetch_one(query, values)
+        return None if row is None else row[column]
+
+    async def iterate(
+        self, query, values: Optional[dict] = None
+    ) -> AsyncGenerator[Any, None]:
+        index = self._reader(query)
+        if index is not None:
+            started = False
+            try:
+                async for record in self.replicas[index].iterate(
+                    query, values
+                ):
+                    started = True
+                    yield record
+                return
+            except REPLICA_ERRORS as e:
+                logger.warning(f"Read from replica {index} failed: {e}")
+                self._lags[index] = math.inf
+                # Starting over on the primary would repeat the records
+                # already yielded
+                if started:
+                    raise
+        async for record in super().iterate(query, values):
+            yield record
+
+    async def execute(self, query, values: Optional[dict] = None) -> Any:
+        self._wrote()
+        return await super().execute(query, values)
+
+    async def execute_many(self, query, values: list) -> None:
+        self._wrote()
+        return await super().execute_many(query, values)
+
+    def transaction(self, *, force_rollback: bool = False, **kwargs):
+        self._wrote()
+        return super().transaction(force_rollback=force_rollback, **kwargs)
+
+
+@lru_cache()
+def get_engine() -> sqlalchemy.engine.Engine:
+    """Sync engine for schema changes, see social.migrations; the app
+    itself only uses `database`. Postgres URLs need a sync driver
+    (psycopg2) installed for this engine besides asyncpg.
+
+    The schema is no longer created on import, run
+    `python -m social.cli migrate` instead.
+    """
+    return sqlalchemy.create_engine(
+        config.DATABASE_URL,
+        connect_args=(
+            {"check_same_thread": False}
+            if is_sqlite(config.DATABASE_URL)
+            else {}
+        ),
+    )
+
+
+database = ReplicatedDatabase(
     config.DATABASE_URL,
+    replica_urls=config.DATABASE_REPLICA_URLS,
     force_rollback=config.DB_FORCE_ROLL_BACK,
+    **database_options(config.DATABASE_URL),
 )
@@ -0,0 +1,83 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from PIL import Image, ImageOps
+
+from social.config import config
+
+logger = logging.getLogger(__name__)
+
+# Pillow releases the GIL while resizing and encoding
+image_executor = ThreadPoolExecutor(
+    max_workers=config.IMAGE_WORKERS, thread_name_prefix="image"
+)
+
+# Image format -> (Pillow format name, save options)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "avif": ("AVIF", {"quality": 60, "speed": 8}),
+}
+
+
+class Variant(NamedTuple):
+    kind: str
+    format: str
+    width: int
+    height: int
+    data: bytes
+
+
+def _encode(image: Image.Image, kind: str, format: str) -> Variant:
+    pillow_format, options = VARIANT_FORMATS[format]
+    output = io.BytesIO()
+    image.save(output, format=pillow_format, **options)
+    return Variant(kind, format, image.width, image.height, output.getvalue())
+
+
+def render_variants(data: bytes) -> list[Variant]:
+    """Resize the image in `data` to a square IMAGE_THUMBNAIL_SIZE
+    thumbnail and to each of IMAGE_VARIANT_WIDTHS, encoded in every one of
+    IMAGE_VARIANT_FORMATS.
+
+    Images are never scaled up: widths above the original's are replaced
+    by a single variant at the original width. CPU bound, run it in the
+    `image_executor`.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    resized = [
+        (
+            "thumbnail",
+            ImageOps.fit(
+                image,
+                (config.IMAGE_THUMBNAIL_SIZE, config.IMAGE_THUMBNAIL_SIZE),
+                Image.Resampling.LANCZOS,
+            ),
+        )
+    ]
+    widths = sorted(
+        {min(width, image.width) for width in config.IMAGE_VARIANT_WIDTHS}
+    )
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized.append(
+            (
+                "responsive",
+                image.resize((width, height), Image.Resampling.LANCZOS),
+            )
+        )
+
+    variants = [
+        _encode(resized_image, kind, format)
+        for kind, resized_image in resized
+        for format in config.IMAGE_VARIANT_FORMATS
+    ]
+    logger.debug(
+        f"Rendered {len(variants)} variants of a "
+        f"{image.width}x{image.height} image"
+    )
+    return variants
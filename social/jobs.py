@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+import sqlalchemy
+from databases import Database
+
+from social import tasks, timeline
+from social.config import config
+from social.database import database, dead_letter_job_table, job_table
+
+logger = logging.getLogger(__name__)
+
+
+async def _send_user_registration_email(to: str, confirmation_url: str):
+    await tasks.send_user_registration_email(to, confirmation_url)
+
+
+async def _generate_image_and_add_to_post(
+    email: str, post_id: int, post_url: str, prompt: str
+):
+    await tasks.generate_image_and_add_to_post(
+        email, post_id, post_url, database, prompt
+    )
+    await enqueue("process_post_image", post_id=post_id)
+
+
+async def _process_post_image(post_id: int):
+    await tasks.process_post_image(post_id, database)
+
+
+async def _fan_out_post(post_id: int, author_id: int):
+    await timeline.fan_out_post(post_id, author_id, database)
+
+
+# Job kind -> coroutine function called with the job payload as kwargs
+JOB_HANDLERS: dict[str, Callable[..., Awaitable]] = {
+    "send_user_registration_email": _send_user_registration_email,
+    "generate_image_and_add_to_post": _generate_image_and_add_to_post,
+    "process_post_image": _process_post_image,
+    "fan_out_post": _fan_out_post,
+}
+
+
+async def enqueue(kind: str, **payload) -> int:
+    """Persist a job for the worker; the payload must be JSON
+    serializable."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind {kind}")
+    logger.info(f"Enqueueing {kind} job")
+    query = job_table.insert().values(
+        kind=kind, payload=payload, run_at=time.time()
+    )
+    logger.debug(query)
+    return await database.execute(query)
+
+
+def retry_delay(attempts: int) -> float:
+    return config.JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+
+
+class Worker:
+    """Runs queued jobs, `concurrency[kind]` at a time for each kind.
+
+    A job is claimed by pushing its run_at past the lease, so a job whose
+    worker died becomes due again once the lease runs out. Failed jobs
+    are retried with exponential backoff and moved to the dead letter
+    table after JOB_MAX_ATTEMPTS attempts.
+    """
+
+    def __init__(self, database: Database, concurrency: dict[str, int]):
+        self.database = database
+        self.concurrency = concurrency
+        self._stopping = asyncio.Event()
+
+    async def claim(self, kind: str):
+        now = time.time()
+        due = job_table.c.run_at <= now
+        next_job = (
+            sqlalchemy.select(job_table.c.id)
+            .where(job_table.c.kind == kind, due)
+            .order_by(job_table.c.run_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        # Repeating `due` makes a worker that lost the race to another
+        # claim of the same row get no row back, rather than a second copy.
+        query = (
+            job_table.update()
+            .where(job_table.c.id == next_job, due)
+            .values(
+                run_at=now + config.JOB_LEASE_SECONDS,
+                attempts=job_table.c.attempts + 1,
+            )
+            .returning(*job_table.c)
+        )
+        return await self.database.fetch_one(query)
+
+    async def execute(self, job):
+        logger.info(f"Running {job.kind} job {job.id}, attempt {job.attempts}")
+        try:
+            await JOB_HANDLERS[job.kind](**job.payload)
+        except Exception as e:
+            await self.fail(job, e)
+        else:
+            query = job_table.delete().where(job_table.c.id == job.id)
+            logger.debug(query)
+            await self.database.execute(query)
+
+    async def fail(self, job, error: Exception):
+        last_error = f"{type(error).__name__}: {error}"
+        if job.attempts < config.JOB_MAX_ATTEMPTS:
+            delay = retry_delay(job.attempts)
+            logger.warning(
+                f"{job.kind} job {job.id} failed, retrying in {delay}s: "
+                f"{last_error}"
+            )
+            query = (
+                job_table.update()
+                .where(job_table.c.id == job.id)
+                .values(run_at=time.time() + delay, last_error=last_error)
+            )
+            logger.debug(query)
+            await self.database.execute(query)
+            return
+
+        logger.error(
+            f"{job.kind} job {job.id} failed {job.attempts} times, moving to "
+            f"dead letter: {last_error}"
+        )
+        async with self.database.transaction():
+            await self.database.execute(
+                dead_letter_job_table.insert().values(
+                    kind=job.kind,
+                    payload=job.payload,
+                    attempts=job.attempts,
+                    last_error=last_error,
+                    failed_at=time.time(),
+                )
+            )
+            await self.database.execute(
+                job_table.delete().where(job_table.c.id == job.id)
+            )
+
+    async def run_pending(self) -> int:
+        """Run due jobs of every kind one at a time until none are left.
+        Returns the number of jobs run."""
+        count = 0
+        for kind in JOB_HANDLERS:
+            while job := await self.claim(kind):
+                await self.execute(job)
+                count += 1
+        return count
+
+    async def _consume(self, kind: str):
+        while not self._stopping.is_set():
+            try:
+                job = await self.claim(kind)
+            except Exception:
+                logger.exception(f"Could not claim {kind} job")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(
+                        self._stopping.wait(),
+                        config.JOB_POLL_INTERVAL_SECONDS,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.execute(job)
+            except Exception:
+                # The job stays leased, so it runs again once the lease
+                # runs out.
+                logger.exception(f"Could not run {job.kind} job {job.id}")
+
+    async def run(self):
+        consumers = [
+            self._consume(kind)
+            for kind, count in self.concurrency.items()
+            if kind in JOB_HANDLERS
+            for _ in range(count)
+        ]
+        logger.info(f"Worker started with {len(consumers)} consumers")
+        await asyncio.gather(*consumers)
+        logger.info("Worker stopped")
+
+    def stop(self):
+        self._stopping.set()
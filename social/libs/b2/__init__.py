@@ -1,5 +1,10 @@
+import asyncio
+import hashlib
+import io
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
+from typing import Awaitable, Callable, NamedTuple, Optional
 
 import b2sdk.v2 as b2
 
@@ -7,11 +12,17 @@ from social.config import config
 
 logger = logging.getLogger(__name__)
 
+# Content type that has B2 pick one from the file name; b2_start_large_file
+# requires one, unlike the uploads b2sdk makes for us.
+AUTO_CONTENT_TYPE = "b2/x-auto"
+
 
 @lru_cache()
 def b2_api():
     logger.debug("Creating and Authorizing B2 API")
     info = b2.InMemoryAccountInfo()
+    if config.B2_SIMULATE:
+        return _b2_simulator_api(info)
     b2_api = b2.B2Api(info)
     b2_api.authorize_account(
         "production", config.B2_API_KEY_ID, config.B2_API_KEY
@@ -19,6 +30,32 @@ def b2_api():
     return b2_api
 
 
+class _RawSimulator(b2.RawSimulator):
+    def get_upload_url(self, api_url, account_auth_token, bucket_id):
+        # b2sdk's simulator leaves the bucket out of this key check, so
+        # it refuses keys restricted to a bucket, unlike B2
+        bucket = self._get_bucket_by_id(bucket_id)
+        self._assert_account_auth(
+            api_url,
+            account_auth_token,
+            bucket.account_id,
+            "writeFiles",
+            bucket_id=bucket_id,
+        )
+        return bucket.get_upload_url(account_auth_token)
+
+
+def _b2_simulator_api(info: b2.InMemoryAccountInfo):
+    logger.warning("Using the in-memory B2 simulator, files are not kept")
+    b2_api = b2.B2Api(
+        info, api_config=b2.B2HttpApiConfig(_raw_api_class=_RawSimulator)
+    )
+    simulator = b2_api.session.raw_api
+    b2_api.authorize_account("production", *simulator.create_account())
+    b2_api.create_bucket(config.B2_BUCKET_NAME, "allPrivate")
+    return b2_api
+
+
 @lru_cache()
 def b2_get_bucket(api: b2.B2Api):
     return api.get_bucket_by_name(config.B2_BUCKET_NAME)
@@ -38,3 +75,215 @@ def b2_upload_file(local_file: str, file_name: str):
         f"Uploaded file {uploaded_file.file_name} with download url {download_url} "
     )
     return download_url
+
+
+class B2File(NamedTuple):
+    file_id: str
+    size: int
+    download_url: str
+
+
+# Shared by all uploads; each upload also caps its own parts in flight
+b2_upload_executor = ThreadPoolExecutor(
+    max_workers=config.B2_UPLOAD_THREADS, thread_name_prefix="b2-upload"
+)
+
+
+def _b2_upload_bytes(data: bytes, file_name: str) -> B2File:
+    api = b2_api()
+    uploaded_file = b2_get_bucket(api).upload_bytes(data, file_name)
+    return B2File(
+        uploaded_file.id_,
+        uploaded_file.size,
+        api.get_download_url_for_fileid(uploaded_file.id_),
+    )
+
+
+def _b2_start_large_file(file_name: str) -> str:
+    api = b2_api()
+    bucket = b2_get_bucket(api)
+    return api.session.start_large_file(
+        bucket.id_, file_name, AUTO_CONTENT_TYPE, {}
+    )["fileId"]
+
+
+def _b2_upload_part(file_id: str, part_number: int, data: bytes) -> str:
+    logger.debug(f"Uploading part {part_number} of {file_id}")
+    response = b2_api().session.upload_part(
+        file_id,
+        part_number,
+        len(data),
+        hashlib.sha1(data).hexdigest(),
+        io.BytesIO(data),
+    )
+    return response["contentSha1"]
+
+
+def _b2_finish_large_file(file_id: str, part_sha1s: list[str]) -> B2File:
+    api = b2_api()
+    response = api.session.finish_large_file(file_id, part_sha1s)
+    return B2File(
+        file_id,
+        response["contentLength"],
+        api.get_download_url_for_fileid(file_id),
+    )
+
+
+def _b2_cancel_large_file(file_id: str):
+    b2_api().session.cancel_large_file(file_id)
+
+
+async def _read_part(read: Callable[[int], Awaitable[bytes]], size: int):
+    part = bytearray()
+    while len(part) < size and (chunk := await read(size - len(part))):
+        part += chunk
+    return bytes(part)
+
+
+async def b2_upload_stream(
+    read: Callable[[int], Awaitable[bytes]], file_name: str
+) -> B2File:
+    """Upload what the async `read(size)` returns until it returns b"",
+    without blocking the event loop.
+
+    Anything up to B2_UPLOAD_PART_SIZE goes up in a single request, larger
+    streams as a B2 large file whose parts are uploaded from the
+    `b2_upload_executor` while the next part is read. At most
+    B2_UPLOAD_PARTS_IN_FLIGHT parts (plus the one being read) are held in
+    memory.
+    """
+    loop = asyncio.get_running_loop()
+    part_size = config.B2_UPLOAD_PART_SIZE
+
+    first_part = await _read_part(read, part_size)
+    part = await _read_part(read, part_size) if first_part else b""
+    if not part:
+        logger.debug(f"Uploading {file_name} to {config.B2_BUCKET_NAME}")
+        return await loop.run_in_executor(
+            b2_upload_executor, _b2_upload_bytes, first_part, file_name
+        )
+
+    file_id = await loop.run_in_executor(
+        b2_upload_executor, _b2_start_large_file, file_name
+    )
+    logger.debug(
+        f"Uploading {file_name} to {config.B2_BUCKET_NAME} as large file "
+        f"{file_id}"
+    )
+    in_flight = asyncio.Semaphore(config.B2_UPLOAD_PARTS_IN_FLIGHT)
+    uploads: list[asyncio.Future] = []
+
+    def upload_part(data: bytes):
+        future = loop.run_in_executor(
+            b2_upload_executor,
+            _b2_upload_part,
+            file_id,
+            len(uploads) + 1,
+            data,
+        )
+        future.add_done_callback(lambda _: in_flight.release())
+        uploads.append(future)
+
+    try:
+        await in_flight.acquire()
+        upload_part(first_part)
+        while part:
+            await in_flight.acquire()
+            for upload in uploads:
+                if upload.done() and upload.exception():
+                    raise upload.exception()
+            upload_part(part)
+            part = await _read_part(read, part_size)
+        part_sha1s = await asyncio.gather(*uploads)
+        uploaded_file = await loop.run_in_executor(
+            b2_upload_executor, _b2_finish_large_file, file_id, part_sha1s
+        )
+    except BaseException:
+        logger.warning(f"Cancelling large file upload {file_id}")
+        # Parts already running in a thread can't be stopped, wait for them
+        await asyncio.gather(*uploads, return_exceptions=True)
+        await loop.run_in_executor(
+            b2_upload_executor, _b2_cancel_large_file, file_id
+        )
+        raise
+
+    logger.debug(
+        f"Uploaded {file_name} with download url {uploaded_file.download_url}"
+    )
+    return uploaded_file
+
+
+def _b2_get_upload_url(
+    name_prefix: str, valid_duration_seconds: int
+) -> tuple[str, str]:
+    api = b2_api()
+    bucket_id = b2_get_bucket(api).id_
+    key = api.create_key(
+        capabilities=["writeFiles"],
+        key_name=name_prefix.strip("/").replace("/", "-"),
+        valid_duration_seconds=valid_duration_seconds,
+        bucket_id=bucket_id,
+        name_prefix=name_prefix,
+    )
+    # An upload token carries the restrictions of the key it was got
+    # with, so it's got with the new key rather than our own.
+    raw_api = api.session.raw_api
+    authorization = raw_api.authorize_account(
+        api.account_info.get_realm(), key.id_, key.application_key
+    )
+    response = raw_api.get_upload_url(
+        authorization["apiInfo"]["storageApi"]["apiUrl"],
+        authorization["authorizationToken"],
+        bucket_id,
+    )
+    return response["uploadUrl"], response["authorizationToken"]
+
+
+def _b2_find_file(file_name: str) -> Optional[B2File]:
+    api = b2_api()
+    try:
+        version = b2_get_bucket(api).get_file_info_by_name(file_name)
+    except b2.exception.FileNotPresent:
+        return None
+    return B2File(
+        version.id_, version.size, api.get_download_url_for_fileid(version.id_)
+    )
+
+
+async def b2_get_upload_url(
+    name_prefix: str, valid_duration_seconds: int
+) -> tuple[str, str]:
+    """Get an upload URL and its authorization token, for a client to
+    upload a file to the bucket itself.
+
+    The token is of a new application key that can only write files
+    under `name_prefix`, and expires after `valid_duration_seconds`.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        b2_upload_executor,
+        _b2_get_upload_url,
+        name_prefix,
+        valid_duration_seconds,
+    )
+
+
+async def b2_download_url() -> str:
+    """Base URL that the download URLs of the bucket's files start with."""
+    loop = asyncio.get_running_loop()
+    api = await loop.run_in_executor(b2_upload_executor, b2_api)
+    return api.account_info.get_download_url()
+
+
+async def b2_upload_bytes(data: bytes, file_name: str) -> B2File:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        b2_upload_executor, _b2_upload_bytes, data, file_name
+    )
+
+
+async def b2_find_file(file_name: str) -> Optional[B2File]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        b2_upload_executor, _b2_find_file, file_name
+    )
@@ -1,4 +1,6 @@
 import logging
+import math
+import time
 from contextlib import asynccontextmanager
 
 import fastapi
@@ -7,40 +9,82 @@ import sentry_sdk
 from asgi_correlation_id import CorrelationIdMiddleware
 
 from social.config import config
-from social.database import database
+from social.database import database, start_read_routing
 from social.logging_conf import configure_logging
-from social.routers import healthcheck, post, upload, user
+from social.routers import healthcheck, metrics, post, upload, user
+from social.tasks import (
+    close_http_client,
+    close_openai_client,
+    get_http_client,
+)
 
 logger = logging.getLogger(__name__)
 
 
-sentry_sdk.init(
-    dsn=config.SENTRY_DSN,
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    traces_sample_rate=1.0,
-    # Set profiles_sample_rate to 1.0 to profile 100%
-    # of sampled transactions.
-    # We recommend adjusting this value in production.
-    profiles_sample_rate=1.0,
-)
+# Without a DSN init would only set up the integrations, and some of
+# those import the packages they patch (openai alone takes ~0.3s).
+if config.SENTRY_DSN:
+    sentry_sdk.init(
+        dsn=config.SENTRY_DSN,
+        # Set traces_sample_rate to 1.0 to capture 100%
+        # of transactions for performance monitoring.
+        traces_sample_rate=1.0,
+        # Set profiles_sample_rate to 1.0 to profile 100%
+        # of sampled transactions.
+        # We recommend adjusting this value in production.
+        profiles_sample_rate=1.0,
+    )
 
 
 @asynccontextmanager
 async def lifespan(app: fastapi.FastAPI):
     configure_logging()
     await database.connect()
+    get_http_client()
     yield
+    await close_openai_client()
+    await close_http_client()
     await database.disconnect()
 
 
+READ_PRIMARY_COOKIE = "read_primary_until"
+
+
+async def read_your_writes(request: fastapi.Request, call_next):
+    """Pin a client that just wrote to the primary database, through a
+    cookie holding when its reads may go back to the replicas."""
+    try:
+        primary_until = float(request.cookies.get(READ_PRIMARY_COOKIE, 0))
+    except ValueError:
+        primary_until = 0.0
+    # The cookie is the client's to change, so it can't pin the client
+    # for longer than a write would.
+    primary_until = min(
+        primary_until, time.time() + config.REPLICA_STICKY_SECONDS
+    )
+    routing = start_read_routing(primary_until)
+    response = await call_next(request)
+    if routing.wrote:
+        response.set_cookie(
+            READ_PRIMARY_COOKIE,
+            str(routing.primary_until),
+            max_age=math.ceil(config.REPLICA_STICKY_SECONDS),
+            httponly=True,
+            samesite="lax",
+        )
+    return response
+
+
 app = fastapi.FastAPI(lifespan=lifespan)
+if database.replicas:
+    app.middleware("http")(read_your_writes)
 app.add_middleware(CorrelationIdMiddleware)
 
 app.include_router(user.router)
 app.include_router(post.router)
 app.include_router(healthcheck.router)
 app.include_router(upload.router)
+app.include_router(metrics.router)
 # app.include_router(sentry.router)
 
 
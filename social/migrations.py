@@ -0,0 +1,106 @@
+import logging
+
+import sqlalchemy
+from sqlalchemy.schema import CreateColumn
+
+from social.database import (
+    create_counter_triggers,
+    like_table,
+    metadata,
+    post_table,
+    timeline_table,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _add_missing_columns(connection: sqlalchemy.engine.Connection) -> None:
+    inspector = sqlalchemy.inspect(connection)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {
+            column["name"] for column in inspector.get_columns(table.name)
+        }
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            logger.info(f"Adding column {table.name}.{column.name}")
+            column_ddl = CreateColumn(column).compile(
+                dialect=connection.dialect
+            )
+            connection.execute(
+                sqlalchemy.text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"
+                )
+            )
+
+
+def _remove_duplicate_likes(connection: sqlalchemy.engine.Connection) -> None:
+    if not sqlalchemy.inspect(connection).has_table(like_table.name):
+        return
+    first_likes = sqlalchemy.select(
+        sqlalchemy.func.min(like_table.c.id)
+    ).group_by(like_table.c.post_id, like_table.c.user_id)
+    result = connection.execute(
+        like_table.delete().where(like_table.c.id.not_in(first_likes))
+    )
+    if result.rowcount:
+        logger.info(f"Removed {result.rowcount} duplicate likes")
+
+
+def _create_missing_indexes(connection: sqlalchemy.engine.Connection) -> None:
+    inspector = sqlalchemy.inspect(connection)
+    for table in metadata.sorted_tables:
+        existing = {
+            index["name"] for index in inspector.get_indexes(table.name)
+        }
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            logger.info(f"Creating index {index.name}")
+            index.create(connection)
+
+
+def _backfill_own_timelines(connection: sqlalchemy.engine.Connection) -> None:
+    # Posts made before home timelines existed were never fanned out, so
+    # give each its author's own entry. Follows are as new as timelines,
+    # and following a user backfills their posts into the follower's.
+    query = timeline_table.insert().from_select(
+        ["user_id", "post_id", "author_id"],
+        sqlalchemy.select(
+            post_table.c.user_id, post_table.c.id, post_table.c.user_id
+        ).where(
+            ~sqlalchemy.select(timeline_table.c.id)
+            .where(
+                timeline_table.c.user_id == post_table.c.user_id,
+                timeline_table.c.post_id == post_table.c.id,
+            )
+            .exists()
+        ),
+    )
+    result = connection.execute(query)
+    if result.rowcount:
+        logger.info(
+            f"Added {result.rowcount} posts to their authors' timelines"
+        )
+
+
+def upgrade(engine: sqlalchemy.engine.Engine) -> None:
+    """Bring an existing database up to the schema declared in
+    `social.database`.
+
+    New tables are created with their indexes. Tables that already exist
+    get any missing columns, indexes and counter triggers added; duplicate
+    likes are dropped first so the unique (post_id, user_id) index can be
+    built. Existing posts are added to their authors' home timelines.
+    Safe to run repeatedly.
+    """
+    with engine.begin() as connection:
+        _add_missing_columns(connection)
+        # Before the counter triggers exist, so the deletes don't count.
+        _remove_duplicate_likes(connection)
+        metadata.create_all(connection)
+        _create_missing_indexes(connection)
+        create_counter_triggers(connection)
+        _backfill_own_timelines(connection)
@@ -1,18 +1,27 @@
 from typing import Optional
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class UserPostIn(BaseModel):
     body: str
 
 
+class ImageVariant(BaseModel):
+    kind: str
+    format: str
+    width: int
+    height: int
+    url: str
+
+
 class UserPost(UserPostIn):
     model_config = ConfigDict(from_attributes=True)
 
     id: int
     user_id: int
     image_url: Optional[str] = None
+    image_variants: Optional[list[ImageVariant]] = None
 
 
 class UserPostWithLikes(UserPost):
@@ -20,6 +29,11 @@ class UserPostWithLikes(UserPost):
     likes: int
 
 
+class UserPostPage(BaseModel):
+    posts: list[UserPostWithLikes]
+    next_cursor: Optional[str] = None
+
+
 class CommentIn(BaseModel):
     body: str
     post_id: int
@@ -32,9 +46,34 @@ class Comment(CommentIn):
     user_id: int
 
 
+class CommentBatchIn(BaseModel):
+    comments: list[CommentIn] = Field(min_length=1)
+
+
+class BatchItemResult(BaseModel):
+    """Outcome of one item of a batch, with the status code the single
+    item endpoint would have answered."""
+
+    status_code: int
+    detail: Optional[str] = None
+
+
+class CommentResult(BatchItemResult):
+    comment: Optional[Comment] = None
+
+
+class CommentPage(BaseModel):
+    comments: list[Comment]
+    next_cursor: Optional[str] = None
+
+
 class UserPostWithComments(BaseModel):
     post: UserPostWithLikes
     comments: list[Comment]
+    # All comments on the post, `comments` only holds the first ones;
+    # next_comment_cursor pages on through GET /post/{id}/comment.
+    comment_count: int
+    next_comment_cursor: Optional[str] = None
 
 
 class PostLikeIn(BaseModel):
@@ -47,3 +86,16 @@ class PostLike(PostLikeIn):
     id: int
     user_id: int
     post_id: int
+
+
+class PostLikePage(BaseModel):
+    likes: list[PostLike]
+    next_cursor: Optional[str] = None
+
+
+class PostLikeBatchIn(BaseModel):
+    likes: list[PostLikeIn] = Field(min_length=1)
+
+
+class PostLikeResult(BatchItemResult):
+    like: Optional[PostLike] = None
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+
+class DirectUploadIn(BaseModel):
+    file_name: str
+
+
+class DirectUpload(BaseModel):
+    id: int
+    file_name: str
+    upload_url: str
+    authorization_token: str
+    expires_at: float
@@ -9,3 +9,9 @@ class User(BaseModel):
 
 class UserIn(User):
     password: str
+
+
+class Follow(BaseModel):
+    id: int
+    follower_id: int
+    followee_id: int
@@ -0,0 +1,36 @@
+import base64
+import binascii
+import json
+import logging
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+def encode_cursor(kind: str, *values: int) -> str:
+    payload = json.dumps([kind, *values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, kind: str, length: int) -> list[int]:
+    """Decode a cursor created by `encode_cursor` for the same `kind`.
+
+    Raises a 400 if the cursor is malformed, was issued for a different
+    listing/sort order or doesn't hold `length` integer values.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        decoded = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        logger.debug(f"Could not decode cursor {cursor[:20]}: {e}")
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+    if (
+        not isinstance(decoded, list)
+        or len(decoded) != length + 1
+        or decoded[0] != kind
+        or not all(type(value) is int for value in decoded[1:])
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return decoded[1:]
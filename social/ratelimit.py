@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Async context manager that admits at most `concurrency` holders at
+    once, and starts at most `rate` of them per second with bursts of up
+    to `burst` (a token bucket).
+
+    Callers over either limit wait their turn instead of failing.
+    """
+
+    def __init__(self, concurrency: int, rate: float, burst: int = 1):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._semaphore: asyncio.Semaphore | None = None
+        self._bucket_lock: asyncio.Lock | None = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    async def _take_token(self):
+        # The lock makes waiters take tokens in arrival order.
+        async with self._bucket_lock:
+            self._refill()
+            if self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate
+                logger.debug(f"Rate limited, waiting {delay:.2f}s")
+                await asyncio.sleep(delay)
+                self._refill()
+            self._tokens -= 1
+
+    async def __aenter__(self):
+        # Created on first use so they belong to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._bucket_lock = asyncio.Lock()
+        await self._semaphore.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
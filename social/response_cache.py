@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from fastapi import Request, Response
+
+from social.cache import create_cache
+from social.config import config
+from social.database import database
+from social.serialization import encode_json
+
+logger = logging.getLogger(__name__)
+
+# Cached JSON bodies of the public read endpoints in routers.post. With
+# the default in-memory backend every process has its own copy, and
+# writes made elsewhere (another API process, the job worker) only show
+# once the entries expire; set CACHE_URL to share and invalidate them.
+response_cache = create_cache(
+    "response",
+    ttl=config.POST_CACHE_TTL_SECONDS,
+    maxsize=config.RESPONSE_CACHE_MAXSIZE,
+    url=config.CACHE_URL,
+)
+
+FEED_GENERATION_KEY = "feed:generation"
+
+
+def post_key(post_id: int) -> str:
+    return f"post:{post_id}"
+
+
+def comments_key(post_id: int) -> str:
+    return f"post:{post_id}:comments"
+
+
+def post_likes_key(post_id: int) -> str:
+    return f"post:{post_id}:likes"
+
+
+async def feed_key(*parts: Any) -> str:
+    """Key for one page of the feed.
+
+    Any write can move posts between pages, so rather than tracking
+    which pages hold which post every key includes a generation that
+    `invalidate_feed` replaces.
+    """
+    generation = await response_cache.get(FEED_GENERATION_KEY)
+    if generation is None:
+        generation = await invalidate_feed()
+    return ":".join(["feed", generation, *map(str, parts)])
+
+
+async def invalidate_feed() -> str:
+    generation = uuid.uuid4().hex
+    # Outlives any feed page, an expired generation just starts afresh
+    await response_cache.set(FEED_GENERATION_KEY, generation, ttl=24 * 60 * 60)
+    return generation
+
+
+async def invalidate_post(post_id: int):
+    await invalidate_posts([post_id])
+
+
+async def invalidate_posts(post_ids: Iterable[int]):
+    """Drop the cached responses of several posts in one cache call."""
+    keys = [
+        key
+        for post_id in post_ids
+        for key in (
+            post_key(post_id),
+            comments_key(post_id),
+            post_likes_key(post_id),
+        )
+    ]
+    await response_cache.delete(*keys)
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+async def cached_json_response(
+    request: Request,
+    key: Optional[str],
+    ttl: float,
+    response_model: Any,
+    build: Callable[[], Awaitable[Any]],
+) -> Response:
+    """Serve the JSON for `key` from the cache, or from `build()` which is
+    encoded to `response_model` by social.serialization and cached for
+    `ttl` seconds.
+
+    Responses carry an ETag of the body and a request whose If-None-Match
+    holds it gets a 304 without a body.
+
+    A request pinned to the primary after a write skips the lookup, as
+    the entry may have been built from a replica that hadn't caught up,
+    and refreshes it instead. Without a `key` the response isn't cached,
+    for variants that invalidation doesn't track.
+    """
+    entry = None
+    if key is not None and not database.pinned_to_primary():
+        entry = await response_cache.get(key)
+    if entry is None:
+        body = encode_json(response_model, await build())
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        # Stored as text, a shared cache keeps entries as JSON
+        entry = {"etag": etag, "body": body.decode()}
+        if key is not None:
+            await response_cache.set(key, entry, ttl=ttl)
+    else:
+        logger.debug(f"Serving {key} from the response cache")
+
+    headers = {"ETag": entry["etag"]}
+    if _etag_matches(request, entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=entry["body"], media_type="application/json", headers=headers
+    )
@@ -0,0 +1,18 @@
+import fastapi
+
+import social.security as security
+from social.database import database
+from social.response_cache import response_cache
+
+router = fastapi.APIRouter()
+
+
+@router.get("/metrics")
+async def metrics():
+    return {
+        "user_cache": security.user_cache.stats(),
+        "decoded_token_cache": security.decoded_token_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "database_pool": database.pool_stats(),
+        "database_replicas": database.replica_stats(),
+    }
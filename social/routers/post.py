@@ -1,39 +1,121 @@
 import logging
 from enum import Enum
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Optional
 
 import sqlalchemy
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 
+import social.jobs as jobs
 import social.security as security
-from social.database import comment_table, database, like_table, post_table
+from social.config import config
+from social.database import (
+    INTEGRITY_ERRORS,
+    comment_table,
+    database,
+    follow_table,
+    like_table,
+    post_table,
+    timeline_table,
+    user_table,
+)
 from social.models.post import (
     Comment,
+    CommentBatchIn,
     CommentIn,
+    CommentPage,
+    CommentResult,
     PostLike,
+    PostLikeBatchIn,
     PostLikeIn,
+    PostLikePage,
+    PostLikeResult,
     UserPost,
     UserPostIn,
+    UserPostPage,
     UserPostWithComments,
     UserPostWithLikes,
 )
 from social.models.user import User
-from social.tasks import generate_image_and_add_to_post
+from social.pagination import decode_cursor, encode_cursor
+from social.response_cache import (
+    cached_json_response,
+    comments_key,
+    feed_key,
+    invalidate_feed,
+    invalidate_post,
+    invalidate_posts,
+    post_key,
+    post_likes_key,
+)
+from social.serialization import encode_json
 
 router = APIRouter()
 
 logger = logging.getLogger(__name__)
 
-select_post_with_likes = (
-    sqlalchemy.select(
-        post_table,
-        sqlalchemy.func.count(like_table.c.id).label("likes"),
-    )
-    .select_from(post_table.outerjoin(like_table))
-    .group_by(post_table.c.id)
+select_post_with_likes = sqlalchemy.select(
+    post_table,
+    post_table.c.like_count.label("likes"),
 )
 
 
+def insert_for_existing_post(table: sqlalchemy.Table, post_id: int, **values):
+    """INSERT ... SELECT that only adds the row when the post exists.
+
+    Folding the existence check into the insert keeps writes to a single
+    statement; the returned row is None when the post doesn't exist.
+    """
+    columns = {
+        "post_id": post_table.c.id,
+        **{
+            name: sqlalchemy.literal(value, table.c[name].type)
+            for name, value in values.items()
+        },
+    }
+    return (
+        table.insert()
+        .from_select(
+            list(columns),
+            sqlalchemy.select(*columns.values()).where(
+                post_table.c.id == post_id
+            ),
+        )
+        .returning(table.c.id)
+    )
+
+
+def check_batch_size(items: list):
+    if len(items) > config.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {config.BATCH_MAX_ITEMS} items per batch",
+        )
+
+
+async def find_existing_post_ids(post_ids: set[int]) -> set[int]:
+    query = sqlalchemy.select(post_table.c.id).where(
+        post_table.c.id.in_(post_ids)
+    )
+    logger.debug(query)
+    return {row.id for row in await database.fetch_all(query)}
+
+
+async def insert_many(table: sqlalchemy.Table, rows: list[dict]) -> list[int]:
+    """Insert `rows` with one multi-row INSERT and return their ids in the
+    order of `rows`.
+
+    Unlike execute_many this is a single statement that returns the ids.
+    Ids are assigned in VALUES order, so sorting them restores the
+    order whatever order RETURNING yields them in.
+    """
+    if not rows:
+        return []
+    query = table.insert().values(rows).returning(table.c.id)
+    logger.debug(query)
+    return sorted(row.id for row in await database.fetch_all(query))
+
+
 async def find_post(post_id: int):
     logger.info(f"Finding post {post_id}")
     query = post_table.select().where(post_table.c.id == post_id)
@@ -45,27 +127,38 @@ async def find_post(post_id: int):
 async def create_post(
     post: UserPostIn,
     current_user: Annotated[User, Depends(security.get_current_user)],
-    background_tasks: BackgroundTasks,
     request: Request,
 ):
     logger.info("Creating post")
     data = {**post.model_dump(), "user_id": current_user.id}
     query = post_table.insert().values(data)
     logger.debug(query)
-    last_record_id = await database.execute(query)
-
-    prompt = post.body
-    background_tasks.add_task(
-        generate_image_and_add_to_post,
-        current_user.email,
-        last_record_id,
-        request.url_for(
-            "get_post_with_comments",
+    async with database.transaction():
+        last_record_id = await database.execute(query)
+        # The author's own timeline right away, followers' by the job
+        await database.execute(
+            timeline_table.insert().values(
+                user_id=current_user.id,
+                post_id=last_record_id,
+                author_id=current_user.id,
+            )
+        )
+        await jobs.enqueue(
+            "generate_image_and_add_to_post",
+            email=current_user.email,
             post_id=last_record_id,
-        ),
-        database,
-        prompt,
-    )
+            post_url=str(
+                request.url_for(
+                    "get_post_with_comments",
+                    post_id=last_record_id,
+                )
+            ),
+            prompt=post.body,
+        )
+        await jobs.enqueue(
+            "fan_out_post", post_id=last_record_id, author_id=current_user.id
+        )
+    await invalidate_feed()
 
     return {**data, "id": last_record_id}
 
@@ -76,17 +169,150 @@ class PostSorting(str, Enum):
     most_likes = "most_likes"
 
 
-@router.get("/post", response_model=list[UserPostWithLikes])
-async def get_all_posts(sorting: PostSorting = PostSorting.new):
+@router.get("/post", response_model=UserPostPage)
+async def get_all_posts(
+    request: Request,
+    sorting: PostSorting = PostSorting.new,
+    cursor: Optional[str] = None,
+    limit: Annotated[
+        int, Query(ge=1, le=config.POST_PAGE_SIZE_MAX)
+    ] = config.POST_PAGE_SIZE,
+):
+    return await cached_json_response(
+        request,
+        await feed_key(sorting.value, cursor, limit),
+        config.FEED_CACHE_TTL_SECONDS,
+        UserPostPage,
+        lambda: find_posts(sorting, cursor, limit),
+    )
+
+
+async def find_posts(sorting: PostSorting, cursor: Optional[str], limit: int):
     logger.info("Getting all posts")
+    likes = post_table.c.like_count
+    query = select_post_with_likes
     if sorting == PostSorting.new:
-        query = select_post_with_likes.order_by(post_table.c.id.desc())
+        query = query.order_by(post_table.c.id.desc())
+        if cursor:
+            (last_id,) = decode_cursor(cursor, sorting.value, 1)
+            query = query.where(post_table.c.id < last_id)
     elif sorting == PostSorting.old:
-        query = select_post_with_likes.order_by(post_table.c.id.asc())
+        query = query.order_by(post_table.c.id.asc())
+        if cursor:
+            (last_id,) = decode_cursor(cursor, sorting.value, 1)
+            query = query.where(post_table.c.id > last_id)
     elif sorting == PostSorting.most_likes:
-        query = select_post_with_likes.order_by(sqlalchemy.desc("likes"))
+        # Ties on the like count are broken by id so that the order, and
+        # therefore the cursor position, is total and stable.
+        query = query.order_by(likes.desc(), post_table.c.id.asc())
+        if cursor:
+            last_likes, last_id = decode_cursor(cursor, sorting.value, 2)
+            query = query.where(
+                sqlalchemy.or_(
+                    likes < last_likes,
+                    sqlalchemy.and_(
+                        likes == last_likes, post_table.c.id > last_id
+                    ),
+                )
+            )
+    # Fetch one extra row to find out whether there is a next page.
+    query = query.limit(limit + 1)
     logger.debug(query)
-    return await database.fetch_all(query)
+    posts = await database.fetch_all(query)
+
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        last = posts[-1]
+        if sorting == PostSorting.most_likes:
+            next_cursor = encode_cursor(sorting.value, last.likes, last.id)
+        else:
+            next_cursor = encode_cursor(sorting.value, last.id)
+
+    return {"posts": posts, "next_cursor": next_cursor}
+
+
+@router.get("/timeline", response_model=UserPostPage)
+async def get_timeline(
+    current_user: Annotated[User, Depends(security.get_current_user)],
+    cursor: Optional[str] = None,
+    limit: Annotated[
+        int, Query(ge=1, le=config.POST_PAGE_SIZE_MAX)
+    ] = config.POST_PAGE_SIZE,
+):
+    """The home timeline of the current user: their own posts and those
+    of the users they follow, newest first."""
+    return await find_timeline(current_user.id, cursor, limit)
+
+
+async def find_timeline(user_id: int, cursor: Optional[str], limit: int):
+    logger.info(f"Getting the timeline of user {user_id}")
+    last_id = None
+    if cursor:
+        (last_id,) = decode_cursor(cursor, "timeline", 1)
+    # The materialized entries, a seek on (user_id, post_id)...
+    fanned_out = (
+        select_post_with_likes.select_from(
+            post_table.join(
+                timeline_table, timeline_table.c.post_id == post_table.c.id
+            )
+        )
+        .where(timeline_table.c.user_id == user_id)
+        .order_by(timeline_table.c.post_id.desc())
+        .limit(limit + 1)
+    )
+    if last_id is not None:
+        fanned_out = fanned_out.where(timeline_table.c.post_id < last_id)
+    logger.debug(fanned_out)
+    queries = [fanned_out]
+
+    # ...merged with the latest posts of followed authors that weren't
+    # fanned out. Each author gets its own seek on posts (user_id,
+    # pulled, id), so none of their other posts are read or sorted; a
+    # single query ordering all of them would sort every post they made.
+    followees = (
+        sqlalchemy.select(follow_table.c.followee_id)
+        .join(user_table, user_table.c.id == follow_table.c.followee_id)
+        .where(
+            follow_table.c.follower_id == user_id,
+            user_table.c.has_pulled_posts == sqlalchemy.true(),
+        )
+    )
+    logger.debug(followees)
+    followee_ids = [row[0] for row in await database.fetch_all(followees)]
+    if followee_ids:
+        seeks = []
+        for followee_id in followee_ids:
+            seek = (
+                select_post_with_likes.where(
+                    post_table.c.user_id == followee_id,
+                    post_table.c.pulled == sqlalchemy.true(),
+                )
+                .order_by(post_table.c.id.desc())
+                .limit(limit + 1)
+            )
+            if last_id is not None:
+                seek = seek.where(post_table.c.id < last_id)
+            # Wrapped, as SQLite only allows ORDER BY and LIMIT on the
+            # whole of a compound select.
+            seeks.append(seek.subquery().select())
+        pulled = sqlalchemy.union_all(*seeks)
+        logger.debug(pulled)
+        queries.append(pulled)
+
+    # A post can be in both while its author crosses the threshold
+    posts = {
+        post.id: post
+        for query in queries
+        for post in await database.fetch_all(query)
+    }
+    posts = sorted(posts.values(), key=lambda post: post.id, reverse=True)
+
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = encode_cursor("timeline", posts[-1].id)
+    return {"posts": posts, "next_cursor": next_cursor}
 
 
 @router.post("/comment", response_model=Comment, status_code=201)
@@ -95,41 +321,203 @@ async def create_comment(
     current_user: Annotated[User, Depends(security.get_current_user)],
 ):
     logger.info(f"Creating comment on post {comment.post_id}")
-    post = await find_post(comment.post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-
     data = {**comment.model_dump(), "user_id": current_user.id}
-    query = comment_table.insert().values(data)
+    query = insert_for_existing_post(
+        comment_table,
+        comment.post_id,
+        body=comment.body,
+        user_id=current_user.id,
+    )
     logger.debug(query)
-    last_record_id = await database.execute(query)
-    return {**data, "id": last_record_id}
+    comment_record = await database.fetch_one(query)
+    if not comment_record:
+        raise HTTPException(status_code=404, detail="Post not found")
+    await invalidate_post(comment.post_id)
+    return {**data, "id": comment_record.id}
+
+
+@router.post("/comment/batch", response_model=list[CommentResult])
+async def create_comments(
+    batch: CommentBatchIn,
+    current_user: Annotated[User, Depends(security.get_current_user)],
+):
+    """Create several comments at once, e.g. when a client syncs offline
+    activity. Each comment gets its own result, in the order sent."""
+    check_batch_size(batch.comments)
+    logger.info(f"Creating {len(batch.comments)} comments")
+    results: list[dict] = []
+    new_comments: list[tuple[dict, dict]] = []
+    # In a transaction so the posts found are on the primary and can't
+    # go away before the insert.
+    async with database.transaction():
+        post_ids = await find_existing_post_ids(
+            {comment.post_id for comment in batch.comments}
+        )
+        for comment in batch.comments:
+            if comment.post_id not in post_ids:
+                results.append(
+                    {"status_code": 404, "detail": "Post not found"}
+                )
+                continue
+            data = {**comment.model_dump(), "user_id": current_user.id}
+            result = {"status_code": 201}
+            results.append(result)
+            new_comments.append((result, data))
+
+        ids = await insert_many(
+            comment_table, [data for _, data in new_comments]
+        )
+    for (result, data), comment_id in zip(new_comments, ids):
+        result["comment"] = {**data, "id": comment_id}
+
+    await invalidate_posts({data["post_id"] for _, data in new_comments})
+    return results
 
 
-@router.get("/post/{post_id}/comment", response_model=list[Comment])
-async def get_comments_on_post(post_id: int):
+def select_comments_page(post_id: int, cursor: Optional[str], limit: int):
+    """Keyset page of a post's comments, oldest first, off the
+    (post_id, id) index."""
+    query = (
+        comment_table.select()
+        .where(comment_table.c.post_id == post_id)
+        .order_by(comment_table.c.id)
+        .limit(limit)
+    )
+    if cursor:
+        (last_id,) = decode_cursor(cursor, "comments", 1)
+        query = query.where(comment_table.c.id > last_id)
+    return query
+
+
+@router.get("/post/{post_id}/comment", response_model=CommentPage)
+async def get_comments_on_post(
+    post_id: int,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Annotated[
+        int, Query(ge=1, le=config.COMMENT_PAGE_SIZE_MAX)
+    ] = config.COMMENT_PAGE_SIZE,
+):
+    # Only the first page is cached, later pages are keyed by cursors
+    # invalidate_post can't enumerate.
+    first_page = cursor is None and limit == config.COMMENT_PAGE_SIZE
+    return await cached_json_response(
+        request,
+        comments_key(post_id) if first_page else None,
+        config.COMMENTS_CACHE_TTL_SECONDS,
+        CommentPage,
+        lambda: find_comments(post_id, cursor, limit),
+    )
+
+
+async def find_comments(post_id: int, cursor: Optional[str], limit: int):
     logger.info(f"Getting comments on post {post_id}")
-    query = comment_table.select().where(comment_table.c.post_id == post_id)
+    # Fetch one extra row to find out whether there is a next page.
+    query = select_comments_page(post_id, cursor, limit + 1)
     logger.debug(query)
-    return await database.fetch_all(query)
+    comments = await database.fetch_all(query)
+
+    next_cursor = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        next_cursor = encode_cursor("comments", comments[-1].id)
+    return {"comments": comments, "next_cursor": next_cursor}
+
+
+@router.get("/post/{post_id}/comment/export")
+async def export_comments_on_post(post_id: int):
+    """Every comment on a post as NDJSON, one Comment per line, oldest
+    first.
+
+    Rows are read COMMENT_EXPORT_BATCH_SIZE at a time by keyset and
+    written out as they arrive, so memory doesn't grow with the post.
+    """
+    if not await find_post(post_id):
+        raise HTTPException(status_code=404, detail="Post not found")
+    return StreamingResponse(
+        stream_comments(post_id), media_type="application/x-ndjson"
+    )
+
+
+async def stream_comments(post_id: int) -> AsyncIterator[bytes]:
+    logger.info(f"Exporting comments on post {post_id}")
+    cursor = None
+    while True:
+        query = select_comments_page(
+            post_id, cursor, config.COMMENT_EXPORT_BATCH_SIZE
+        )
+        comments = await database.fetch_all(query)
+        for comment in comments:
+            yield encode_json(Comment, comment) + b"\n"
+        if len(comments) < config.COMMENT_EXPORT_BATCH_SIZE:
+            return
+        cursor = encode_cursor("comments", comments[-1].id)
 
 
 @router.get("/post/{post_id}", response_model=UserPostWithComments)
-async def get_post_with_comments(post_id: int):
+async def get_post_with_comments(
+    post_id: int,
+    request: Request,
+    comments_limit: Annotated[
+        int, Query(ge=0, le=config.COMMENT_PAGE_SIZE_MAX)
+    ] = config.POST_COMMENTS_EMBEDDED,
+):
+    default_limit = comments_limit == config.POST_COMMENTS_EMBEDDED
+    return await cached_json_response(
+        request,
+        post_key(post_id) if default_limit else None,
+        config.POST_CACHE_TTL_SECONDS,
+        UserPostWithComments,
+        lambda: find_post_with_comments(post_id, comments_limit),
+    )
+
+
+async def find_post_with_comments(post_id: int, comments_limit: int):
     logger.info(f"Getting post {post_id} with comments")
-    query = select_post_with_likes.where(post_table.c.id == post_id)
+    # One query for the post and its first comments: the post columns
+    # repeat on every comment row, and a post without comments comes
+    # back as a single row with NULL comment columns. The comment total
+    # is the posts.comment_count counter.
+    query = (
+        select_post_with_likes.add_columns(
+            comment_table.c.id.label("comment_id"),
+            comment_table.c.body.label("comment_body"),
+            comment_table.c.user_id.label("comment_user_id"),
+        )
+        .select_from(post_table.outerjoin(comment_table))
+        .where(post_table.c.id == post_id)
+        .order_by(comment_table.c.id)
+        # One extra row to find out whether more comments follow.
+        .limit(comments_limit + 1)
+    )
     logger.debug(query)
 
-    post = await database.fetch_one(query)
-    if not post:
+    rows = await database.fetch_all(query)
+    if not rows:
         raise HTTPException(
             status_code=404, detail=f"Post with id {post_id} not found"
         )
 
+    comments = [
+        {
+            "id": row.comment_id,
+            "body": row.comment_body,
+            "post_id": post_id,
+            "user_id": row.comment_user_id,
+        }
+        for row in rows
+        if row.comment_id is not None
+    ]
+    next_comment_cursor = None
+    if len(comments) > comments_limit:
+        comments = comments[:comments_limit]
+        last_id = comments[-1]["id"] if comments else 0
+        next_comment_cursor = encode_cursor("comments", last_id)
     return {
-        "post": post,
-        "comments": await get_comments_on_post(post_id),
-        "likes": post.likes,
+        "post": rows[0],
+        "comments": comments,
+        "comment_count": rows[0].comment_count,
+        "next_comment_cursor": next_comment_cursor,
     }
 
 
@@ -139,22 +527,141 @@ async def like_post(
     current_user: Annotated[User, Depends(security.get_current_user)],
 ):
     logger.info("Like added to post")
-    post = await find_post(like.post_id)
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-
     data = {**like.model_dump(), "user_id": current_user.id}
-    query = like_table.insert().values(data)
+    query = insert_for_existing_post(
+        like_table, like.post_id, user_id=current_user.id
+    )
     logger.debug(query)
-    last_record_id = await database.execute(query)
-    return {**data, "id": last_record_id}
+    try:
+        like_record = await database.fetch_one(query)
+    except INTEGRITY_ERRORS as e:
+        raise HTTPException(
+            status_code=409, detail="Post already liked"
+        ) from e
+    if not like_record:
+        raise HTTPException(status_code=404, detail="Post not found")
+    await invalidate_post(like.post_id)
+    await invalidate_feed()
+    return {**data, "id": like_record.id}
 
 
-@router.get("/post/{post_id}/like", response_model=list[PostLike])
-async def get_likes_on_post(post_id: int):
-    pass
+@router.post("/post/like/batch", response_model=list[PostLikeResult])
+async def like_posts(
+    batch: PostLikeBatchIn,
+    current_user: Annotated[User, Depends(security.get_current_user)],
+):
+    """Like several posts at once. Each like gets its own result, in the
+    order sent, with a 409 for posts already liked (or liked twice in
+    the batch)."""
+    check_batch_size(batch.likes)
+    logger.info(f"Adding {len(batch.likes)} likes")
+    results: list[dict] = []
+    new_likes: list[tuple[dict, dict]] = []
+    async with database.transaction():
+        post_ids = await find_existing_post_ids(
+            {like.post_id for like in batch.likes}
+        )
+        query = sqlalchemy.select(like_table.c.post_id).where(
+            like_table.c.user_id == current_user.id,
+            like_table.c.post_id.in_(post_ids),
+        )
+        logger.debug(query)
+        liked = {row.post_id for row in await database.fetch_all(query)}
+        for like in batch.likes:
+            if like.post_id not in post_ids:
+                results.append(
+                    {"status_code": 404, "detail": "Post not found"}
+                )
+            elif like.post_id in liked:
+                results.append(
+                    {"status_code": 409, "detail": "Post already liked"}
+                )
+            else:
+                liked.add(like.post_id)
+                data = {"post_id": like.post_id, "user_id": current_user.id}
+                result = {"status_code": 201}
+                results.append(result)
+                new_likes.append((result, data))
+
+        try:
+            ids = await insert_many(
+                like_table, [data for _, data in new_likes]
+            )
+        except INTEGRITY_ERRORS as e:
+            # Another request liked one of the posts since the check
+            raise HTTPException(
+                status_code=409,
+                detail="Posts liked concurrently, retry the batch",
+            ) from e
+    for (result, data), like_id in zip(new_likes, ids):
+        result["like"] = {**data, "id": like_id}
+
+    if new_likes:
+        await invalidate_posts({data["post_id"] for _, data in new_likes})
+        await invalidate_feed()
+    return results
+
+
+def select_likes_page(post_id: int, cursor: Optional[str], limit: int):
+    """Keyset page of a post's likes, newest first, read straight off
+    the (post_id, id) index however deep the page."""
+    query = (
+        like_table.select()
+        .where(like_table.c.post_id == post_id)
+        .order_by(like_table.c.id.desc())
+        # One extra row to find out whether there is a next page.
+        .limit(limit + 1)
+    )
+    if cursor:
+        (last_id,) = decode_cursor(cursor, "likes", 1)
+        query = query.where(like_table.c.id < last_id)
+    return query
+
+
+@router.get("/post/{post_id}/like", response_model=PostLikePage)
+async def get_likes_on_post(
+    post_id: int,
+    cursor: Optional[str] = None,
+    limit: Annotated[
+        int, Query(ge=1, le=config.LIKE_PAGE_SIZE_MAX)
+    ] = config.LIKE_PAGE_SIZE,
+):
+    logger.info(f"Getting likes on post {post_id}")
+    query = select_likes_page(post_id, cursor, limit)
+    logger.debug(query)
+    likes = await database.fetch_all(query)
+    # Only an empty page needs telling a post without likes apart from
+    # a missing one.
+    if not likes and not await find_post(post_id):
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    next_cursor = None
+    if len(likes) > limit:
+        likes = likes[:limit]
+        next_cursor = encode_cursor("likes", likes[-1].id)
+    return {"likes": likes, "next_cursor": next_cursor}
 
 
 @router.get("/post/like/{post_id}", response_model=UserPostWithLikes)
-async def get_post_with_likes(post_id: int):
-    pass
+async def get_post_with_likes(post_id: int, request: Request):
+    return await cached_json_response(
+        request,
+        post_likes_key(post_id),
+        config.POST_CACHE_TTL_SECONDS,
+        UserPostWithLikes,
+        lambda: find_post_with_likes(post_id),
+    )
+
+
+async def find_post_with_likes(post_id: int):
+    logger.info(f"Getting post {post_id} with likes")
+    # The like count is the posts.like_count counter, one row whatever
+    # the number of likes.
+    query = select_post_with_likes.where(post_table.c.id == post_id)
+    logger.debug(query)
+    post = await database.fetch_one(query)
+    if not post:
+        raise HTTPException(
+            status_code=404, detail=f"Post with id {post_id} not found"
+        )
+    return post
@@ -1,12 +1,23 @@
+import hashlib
 import logging
-import tempfile
+import math
+import time
+import uuid
+from pathlib import PurePosixPath
 from typing import Annotated
 
-import aiofiles
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
 
 import social.security as security
-from social.libs.b2 import b2_upload_file
+from social.config import config
+from social.database import (
+    INTEGRITY_ERRORS,
+    blob_table,
+    database,
+    upload_table,
+)
+from social.libs.b2 import b2_find_file, b2_get_upload_url, b2_upload_stream
+from social.models.upload import DirectUpload, DirectUploadIn
 from social.models.user import User
 
 logger = logging.getLogger(__name__)
@@ -16,6 +27,49 @@ router = APIRouter()
 CHUNK_SIZE = 1024 * 1024
 
 
+async def hash_upload(file: UploadFile) -> str:
+    """sha256 of the upload, read from Starlette's local spool of the
+    request body and rewound for the upload to B2."""
+    digest = hashlib.sha256()
+    while chunk := await file.read(CHUNK_SIZE):
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest()
+
+
+async def find_blob(sha256: str):
+    query = blob_table.select().where(blob_table.c.sha256 == sha256)
+    logger.debug(query)
+    return await database.fetch_one(query)
+
+
+async def upload_blob(file: UploadFile, sha256: str):
+    """Store the upload in B2 under its content hash, unless the same
+    content is stored already."""
+    if blob := await find_blob(sha256):
+        logger.info(f"{file.filename} is already stored as {blob.file_name}")
+        return blob
+
+    suffix = PurePosixPath(file.filename or "").suffix.lower()
+    file_name = f"blobs/{sha256}{suffix}"
+    logger.info(f"Uploading {file.filename} as {file_name}")
+    uploaded_file = await b2_upload_stream(file.read, file_name)
+    query = blob_table.insert().values(
+        sha256=sha256,
+        file_name=file_name,
+        file_id=uploaded_file.file_id,
+        file_url=uploaded_file.download_url,
+        size=uploaded_file.size,
+    )
+    logger.debug(query)
+    try:
+        await database.execute(query)
+    except INTEGRITY_ERRORS:
+        # The same content was uploaded concurrently, keep the first blob
+        logger.info(f"Blob {sha256} was stored concurrently")
+    return await find_blob(sha256)
+
+
 @router.post(
     "/upload",
     status_code=status.HTTP_201_CREATED,
@@ -25,17 +79,7 @@ async def upload(
     current_user: Annotated[User, Depends(security.get_current_user)],
 ):
     try:
-        with tempfile.NamedTemporaryFile() as temp_file:
-            filename = temp_file.name
-            logger.info(f"Saving uploaded file as temp file to {filename}")
-            async with aiofiles.open(filename, "wb") as f:
-                while chunk := await file.read(CHUNK_SIZE):
-                    await f.write(chunk)
-
-            file_url = b2_upload_file(
-                local_file=filename, file_name=file.filename
-            )
-
+        blob = await upload_blob(file, await hash_upload(file))
     except Exception as e:
         logger.exception(e)
         raise HTTPException(
@@ -43,7 +87,138 @@ async def upload(
             detail="There was an error uploading the file.",
         )
 
+    now = time.time()
+    query = upload_table.insert().values(
+        user_id=current_user.id,
+        name=file.filename,
+        blob_id=blob.id,
+        file_name=blob.file_name,
+        file_id=blob.file_id,
+        file_url=blob.file_url,
+        size=blob.size,
+        expires_at=now,
+        completed_at=now,
+    )
+    logger.debug(query)
+    await database.execute(query)
+
     return {
         "detail": f"{file.filename} uploaded successfully",
-        "file_url": file_url,
+        "file_url": blob.file_url,
+    }
+
+
+@router.post(
+    "/upload/authorize",
+    response_model=DirectUpload,
+    status_code=status.HTTP_201_CREATED,
+)
+async def authorize_upload(
+    upload: DirectUploadIn,
+    current_user: Annotated[User, Depends(security.get_current_user)],
+):
+    """Let the client upload a file straight to the bucket.
+
+    The client uploads to `upload_url` with the authorization token and
+    exactly the returned `file_name` (b2_upload_file), then calls
+    /upload/{id}/complete before `expires_at`. The token only lets it
+    write under the upload's own prefix, and only until `expires_at`.
+    """
+    name = PurePosixPath(upload.file_name).name
+    if name in ("", ".."):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid file name",
+        )
+    name_prefix = f"uploads/{current_user.id}/{uuid.uuid4().hex}/"
+    file_name = f"{name_prefix}{name}"
+
+    try:
+        upload_url, authorization_token = await b2_get_upload_url(
+            name_prefix, math.ceil(config.B2_DIRECT_UPLOAD_TTL_SECONDS)
+        )
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="There was an error authorizing the upload.",
+        )
+
+    expires_at = time.time() + config.B2_DIRECT_UPLOAD_TTL_SECONDS
+    query = upload_table.insert().values(
+        user_id=current_user.id,
+        name=name,
+        file_name=file_name,
+        expires_at=expires_at,
+    )
+    logger.debug(query)
+    upload_id = await database.execute(query)
+    return {
+        "id": upload_id,
+        "file_name": file_name,
+        "upload_url": upload_url,
+        "authorization_token": authorization_token,
+        "expires_at": expires_at,
+    }
+
+
+@router.post(
+    "/upload/{upload_id}/complete",
+    status_code=status.HTTP_201_CREATED,
+)
+async def complete_upload(
+    upload_id: int,
+    current_user: Annotated[User, Depends(security.get_current_user)],
+):
+    query = upload_table.select().where(
+        upload_table.c.id == upload_id,
+        upload_table.c.user_id == current_user.id,
+    )
+    logger.debug(query)
+    upload = await database.fetch_one(query)
+    if not upload:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found"
+        )
+    if upload.completed_at is not None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload already completed",
+        )
+    if upload.expires_at < time.time():
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE, detail="Upload expired"
+        )
+
+    try:
+        file = await b2_find_file(upload.file_name)
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="There was an error completing the upload.",
+        )
+    if file is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File has not been uploaded",
+        )
+
+    query = (
+        upload_table.update()
+        .where(upload_table.c.id == upload_id)
+        .values(
+            file_id=file.file_id,
+            file_url=file.download_url,
+            size=file.size,
+            completed_at=time.time(),
+        )
+    )
+    logger.debug(query)
+    await database.execute(query)
+
+    name = PurePosixPath(upload.file_name).name
+    return {
+        "detail": f"{name} uploaded successfully",
+        "file_url": file.download_url,
     }
@@ -1,11 +1,19 @@
 import logging
+from typing import Annotated
 
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+import sqlalchemy
+from fastapi import APIRouter, Depends, HTTPException, Request
 
+import social.jobs as jobs
 import social.security as security
-import social.tasks as tasks
-from social.database import database, user_table
-from social.models.user import UserIn
+import social.timeline as timeline
+from social.database import (
+    INTEGRITY_ERRORS,
+    database,
+    follow_table,
+    user_table,
+)
+from social.models.user import Follow, User, UserIn
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -25,31 +33,30 @@ async def login(user: UserIn) -> dict:
 
 
 @router.post("/register", status_code=201)
-async def register(
-    user: UserIn, background_tasks: BackgroundTasks, request: Request
-) -> dict:
+async def register(user: UserIn, request: Request) -> dict:
     logger.info("Creating user")
     if await security.get_user(user.email):
         raise HTTPException(
             status_code=400,
             detail="A user with that email already registered",
         )
-    hased_password = security.get_password_hash(user.password)
+    hased_password = await security.get_password_hash_async(user.password)
     query = user_table.insert().values(
         email=user.email, password=hased_password
     )
     logger.debug(query)
-    await database.execute(query)
-    background_tasks.add_task(
-        tasks.send_user_registration_email,
-        user.email,
-        confirmation_url=str(
-            request.url_for(
-                "confirm_email",
-                token=security.create_confirmation_token(user.email),
+    async with database.transaction():
+        await database.execute(query)
+        await jobs.enqueue(
+            "send_user_registration_email",
+            to=user.email,
+            confirmation_url=str(
+                request.url_for(
+                    "confirm_email",
+                    token=security.create_confirmation_token(user.email),
+                ),
             ),
-        ),
-    )
+        )
     return {
         "detail": "User created. Please confirm your email",
     }
@@ -71,4 +78,69 @@ async def confirm_email(token: str) -> dict:
     )
     logger.debug(query)
     await database.execute(query)
+    await security.invalidate_cached_user(email)
     return {"detail": "User confirmed."}
+
+
+@router.post("/user/{user_id}/follow", response_model=Follow, status_code=201)
+async def follow_user(
+    user_id: int,
+    current_user: Annotated[User, Depends(security.get_current_user)],
+):
+    logger.info(f"Following user {user_id}")
+    if user_id == current_user.id:
+        raise HTTPException(status_code=400, detail="Can't follow yourself")
+    data = {"follower_id": current_user.id, "followee_id": user_id}
+    # Only follows users that exist, in the same statement
+    query = (
+        follow_table.insert()
+        .from_select(
+            ["follower_id", "followee_id"],
+            sqlalchemy.select(
+                sqlalchemy.literal(current_user.id, sqlalchemy.Integer),
+                user_table.c.id,
+            ).where(user_table.c.id == user_id),
+        )
+        .returning(follow_table.c.id)
+    )
+    logger.debug(query)
+    try:
+        async with database.transaction():
+            follow = await database.fetch_one(query)
+            if follow:
+                await timeline.add_followee_posts(
+                    current_user.id, user_id, database
+                )
+    except INTEGRITY_ERRORS as e:
+        raise HTTPException(
+            status_code=409, detail="User already followed"
+        ) from e
+    if not follow:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {**data, "id": follow.id}
+
+
+@router.delete("/user/{user_id}/follow", status_code=200)
+async def unfollow_user(
+    user_id: int,
+    current_user: Annotated[User, Depends(security.get_current_user)],
+) -> dict:
+    logger.info(f"Unfollowing user {user_id}")
+    query = (
+        follow_table.delete()
+        .where(
+            follow_table.c.follower_id == current_user.id,
+            follow_table.c.followee_id == user_id,
+        )
+        .returning(follow_table.c.id)
+    )
+    logger.debug(query)
+    async with database.transaction():
+        follow = await database.fetch_one(query)
+        if follow:
+            await timeline.remove_followee_posts(
+                current_user.id, user_id, database
+            )
+    if not follow:
+        raise HTTPException(status_code=404, detail="User not followed")
+    return {"detail": "User unfollowed"}
@@ -1,5 +1,10 @@
+import asyncio
 import datetime
+import hashlib
 import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Annotated, Literal
 
 import fastapi
@@ -7,8 +12,10 @@ import fastapi.security
 from jose import ExpiredSignatureError, JWTError, jwt
 from passlib.context import CryptContext
 
+from social.cache import create_cache
 from social.config import config
 from social.database import database, user_table
+from social.models.user import User
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +23,12 @@ JWT_SECRET = config.JWT_SECRET_KEY
 JWT_ALGORITHM = config.JWT_ALGORITHM
 oauth2_scheme = fastapi.security.OAuth2PasswordBearer(tokenUrl="login")
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+user_cache = create_cache(
+    "user",
+    ttl=config.USER_CACHE_TTL_SECONDS,
+    maxsize=config.USER_CACHE_MAXSIZE,
+    url=config.CACHE_URL,
+)
 
 
 def create_credentials_exception(details: str):
@@ -60,11 +73,71 @@ def create_confirmation_token(email: str, expires_minutes: int = None):
     return encoded_jwt
 
 
+class DecodedTokenCache:
+    """LRU of verified JWT claims keyed by the token's SHA-256 digest.
+
+    Entries are only served while the token's `exp` claim is still valid,
+    using the same whole-second comparison as `jwt.decode`, so an expired
+    token always goes back through `jwt.decode` and fails there.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._claims: OrderedDict[bytes, dict] = OrderedDict()
+
+    def get(self, token: str) -> dict | None:
+        key = hashlib.sha256(token.encode()).digest()
+        claims = self._claims.get(key)
+        if claims is not None and claims["exp"] < int(time.time()):
+            del self._claims[key]
+            claims = None
+        if claims is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._claims.move_to_end(key)
+        return claims
+
+    def set(self, token: str, claims: dict):
+        # Without an expiry there is no point at which the entry goes stale
+        if not isinstance(claims.get("exp"), int):
+            return
+        self._claims[hashlib.sha256(token.encode()).digest()] = claims
+        while len(self._claims) > self.maxsize:
+            self._claims.popitem(last=False)
+
+    def clear(self):
+        self._claims.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._claims),
+        }
+
+
+decoded_token_cache = DecodedTokenCache(config.JWT_DECODE_CACHE_MAXSIZE)
+
+
+def decode_token(token: str) -> dict:
+    if not config.JWT_DECODE_CACHE_ENABLED:
+        return jwt.decode(token, key=JWT_SECRET, algorithms=[JWT_ALGORITHM])
+
+    payload = decoded_token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, key=JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        decoded_token_cache.set(token, payload)
+    return payload
+
+
 def get_email_for_token_type(
     token: str, token_type: Literal["access", "confirmation"]
 ) -> str:
     try:
-        payload = jwt.decode(token, key=JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = decode_token(token)
     except ExpiredSignatureError as e:
         raise create_credentials_exception(details="Token has expired") from e
     except JWTError as e:
@@ -92,6 +165,44 @@ def verify_password(plain_password, hashed_password) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# bcrypt takes a few hundred milliseconds per call and releases the GIL,
+# so it runs on its own small thread pool instead of the event loop.
+password_hash_executor = ThreadPoolExecutor(
+    max_workers=config.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash",
+)
+_password_hash_pending = 0
+
+
+async def _run_password_hash(func, *args):
+    global _password_hash_pending
+    max_pending = config.PASSWORD_HASH_WORKERS + config.PASSWORD_HASH_MAX_QUEUE
+    if _password_hash_pending >= max_pending:
+        logger.warning("Password hashing queue is full")
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again",
+            headers={"Retry-After": "1"},
+        )
+
+    _password_hash_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_hash_executor, func, *args)
+    finally:
+        _password_hash_pending -= 1
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_password_hash(get_password_hash, password)
+
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await _run_password_hash(
+        verify_password, plain_password, hashed_password
+    )
+
+
 async def get_user(email: str):
     logger.debug("Getting user form the database", extra={"email": email})
     query = user_table.select().where(user_table.c.email == email)
@@ -102,12 +213,34 @@ async def get_user(email: str):
     return None
 
 
+async def get_cached_user(email: str) -> User | None:
+    cached_user = await user_cache.get(email)
+    if cached_user is not None:
+        return User(**cached_user)
+
+    result = await get_user(email)
+    if result is None:
+        return None
+    # is_active is NULL until the user confirms their email
+    user = User(
+        id=result.id, email=result.email, is_active=bool(result.is_active)
+    )
+    await user_cache.set(email, user.model_dump())
+    return user
+
+
+async def invalidate_cached_user(email: str):
+    """Must be called whenever a user row is updated."""
+    logger.debug("Invalidating cached user", extra={"email": email})
+    await user_cache.delete(email)
+
+
 async def authenticate_user(email: str, password: str):
     logger.debug("Authenticating user", extra={"email": email})
     user = await get_user(email)
     if not user:
         raise create_credentials_exception(details="Invalid email or password")
-    if not verify_password(password, user.password):
+    if not await verify_password_async(password, user.password):
         raise create_credentials_exception(details="Invalid email or password")
     if not user.is_active:
         raise create_credentials_exception(
@@ -121,7 +254,7 @@ async def get_current_user(
     token: Annotated[str, fastapi.Depends(oauth2_scheme)]
 ):
     email = get_email_for_token_type(token, "access")
-    user = await get_user(email=email)
+    user = await get_cached_user(email=email)
     if user is None:
         raise create_credentials_exception(details="Unknown user")
     return user
@@ -0,0 +1,113 @@
+import json
+import types
+import typing
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel, TypeAdapter
+
+from social.config import config
+
+
+@lru_cache(maxsize=None)
+def _adapter(response_model: Any) -> TypeAdapter:
+    # Building an adapter costs far more than using one
+    return TypeAdapter(response_model)
+
+
+def validated_json(response_model: Any, content: Any) -> bytes:
+    """`content` validated against `response_model` and serialized like
+    FastAPI would, reading rows through from_attributes."""
+    adapter = _adapter(response_model)
+    data = adapter.dump_python(
+        adapter.validate_python(content, from_attributes=True), mode="json"
+    )
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def _field(value: Any, name: str, default: Any) -> Any:
+    if isinstance(value, dict):
+        return value.get(name, default)
+    # Indexing a databases Record by name is much cheaper than its
+    # attribute fallback
+    try:
+        return value[name]
+    except (KeyError, TypeError):
+        return getattr(value, name, default)
+
+
+@lru_cache(maxsize=None)
+def _projector(annotation: Any) -> Optional[Callable[[Any], Any]]:
+    """Function picking the fields of `annotation` out of dicts, rows
+    and nested lists of them, without validating or converting values.
+    None for values that are used as they are."""
+    origin = typing.get_origin(annotation)
+    if origin in (typing.Union, types.UnionType):
+        (inner,) = [
+            arg for arg in typing.get_args(annotation) if arg is not type(None)
+        ]
+        project_inner = _projector(inner)
+        if project_inner is None:
+            return None
+        return lambda value: None if value is None else project_inner(value)
+    if origin is list:
+        (item,) = typing.get_args(annotation)
+        project_item = _projector(item)
+        if project_item is None:
+            return list
+        return lambda value: [project_item(v) for v in value]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return _model_projector(annotation)
+    return None
+
+
+def _model_projector(model: type[BaseModel]) -> Callable[[Any], dict]:
+    defaults = {
+        name: (
+            None
+            if field.is_required()
+            else field.get_default(call_default_factory=True)
+        )
+        for name, field in model.model_fields.items()
+    }
+    nested = [
+        (name, project)
+        for name, field in model.model_fields.items()
+        if (project := _projector(field.annotation)) is not None
+    ]
+
+    def project(value: Any) -> dict:
+        data = {
+            name: _field(value, name, default)
+            for name, default in defaults.items()
+        }
+        # Replacing the values in place keeps the fields in model order
+        for name, project_field in nested:
+            data[name] = project_field(data[name])
+        return data
+
+    return project
+
+
+def fast_json(response_model: Any, content: Any) -> bytes:
+    """`content` serialized with orjson to the schema of
+    `response_model`, skipping pydantic entirely.
+
+    Fields are picked by name and their values trusted to already have
+    the schema's types, as rows of our own tables do, so this is only
+    meant for read endpoints returning database rows.
+    """
+    try:
+        import orjson
+    except ImportError as e:
+        raise RuntimeError(
+            "FAST_JSON_RESPONSES needs the orjson package installed"
+        ) from e
+    project = _projector(response_model)
+    return orjson.dumps(content if project is None else project(content))
+
+
+def encode_json(response_model: Any, content: Any) -> bytes:
+    if config.FAST_JSON_RESPONSES:
+        return fast_json(response_model, content)
+    return validated_json(response_model, content)
@@ -1,12 +1,33 @@
+import asyncio
+import hashlib
 import logging
+import uuid
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable
 
 import httpx
-import openai
+import sqlalchemy
 from databases import Database
-from openai import AsyncOpenAI
 
 from social.config import config
-from social.database import post_table
+from social.database import (
+    comment_table,
+    follow_table,
+    like_table,
+    post_table,
+    user_table,
+)
+from social.images import image_executor, render_variants
+from social.libs.b2 import (
+    B2File,
+    b2_download_url,
+    b2_upload_bytes,
+    b2_upload_stream,
+)
+from social.ratelimit import RateLimiter
+from social.response_cache import invalidate_feed, invalidate_post
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 
@@ -15,30 +36,68 @@ class APIResponseException(Exception):
     pass
 
 
-async def send_simple_email(to: str, subject: str, body: str):
+_http_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """The process-wide pooled client for outbound API calls, so that
+    connections to the same host are kept alive and reused."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        logger.debug("Creating shared HTTP client")
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(
+                config.HTTP_TIMEOUT_SECONDS,
+                connect=config.HTTP_CONNECT_TIMEOUT_SECONDS,
+            ),
+            http2=config.HTTP2_ENABLED,
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        logger.debug("Closing shared HTTP client")
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def send_simple_email(
+    to: str,
+    subject: str,
+    body: str,
+    client: httpx.AsyncClient | None = None,
+):
     logger.debug(f"Sending email to '{to[:3]}' with subject '{subject[:10]}'")
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"https://api.mailgun.net/v3/{config.MAILGUN_DOMAIN}/messages",
-                auth=("api", config.MAILGUN_API_KEY),
-                data={
-                    "from": f"David <mailgun@{config.MAILGUN_DOMAIN}>",
-                    "to": [to],
-                    "subject": subject,
-                    "text": body,
-                },
-            )
-            response.raise_for_status()
-            logger.debug(response.content)
-            logger.debug(f"Email sent to {to[:3]} with subject {subject}")
-            return response
+    if client is None:
+        client = get_http_client()
+    try:
+        response = await client.post(
+            f"https://api.mailgun.net/v3/{config.MAILGUN_DOMAIN}/messages",
+            auth=("api", config.MAILGUN_API_KEY),
+            data={
+                "from": f"David <mailgun@{config.MAILGUN_DOMAIN}>",
+                "to": [to],
+                "subject": subject,
+                "text": body,
+            },
+        )
+        response.raise_for_status()
+        logger.debug(response.content)
+        logger.debug(f"Email sent to {to[:3]} with subject {subject}")
+        return response
 
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Error sending email: {e}")
-            raise APIResponseException(
-                f"API request with status code {e.response.status_code} failed"
-            ) from e
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Error sending email: {e}")
+        raise APIResponseException(
+            f"API request with status code {e.response.status_code} failed"
+        ) from e
 
 
 async def send_user_registration_email(to: str, confirmation_url: str):
@@ -53,53 +112,108 @@ async def send_user_registration_email(to: str, confirmation_url: str):
     logger.debug(f"Confirmation email sent to {to[:3]} with subject {subject}")
 
 
+# The openai package is imported on first use: it is by far the slowest
+# import, and only the job worker generates images.
+_openai_client: "AsyncOpenAI | None" = None
+
+image_generation_limiter = RateLimiter(
+    concurrency=config.OPENAI_IMAGE_MAX_CONCURRENCY,
+    rate=config.OPENAI_IMAGES_PER_MINUTE / 60,
+    burst=config.OPENAI_IMAGE_BURST,
+)
+
+
+def get_openai_client() -> "AsyncOpenAI":
+    global _openai_client
+    if _openai_client is None:
+        from openai import AsyncOpenAI
+
+        logger.debug("Creating OpenAI client")
+        _openai_client = AsyncOpenAI(
+            api_key=config.OPENAI_API_KEY,
+            max_retries=config.OPENAI_MAX_RETRIES,
+            timeout=60,
+        )
+    return _openai_client
+
+
+async def close_openai_client():
+    global _openai_client
+    if _openai_client is not None:
+        logger.debug("Closing OpenAI client")
+        await _openai_client.close()
+        _openai_client = None
+
+
 async def _generate_image_api(prompt: str):
-    logging.debug(f"Generating image from prompt: {prompt[:30]}")
-    openai_client = AsyncOpenAI(
-        api_key=config.OPENAI_API_KEY,
-        max_retries=1,
-        timeout=60,
-    )
+    import openai
+
+    logger.debug(f"Generating image from prompt: {prompt[:30]}")
+    openai_client = get_openai_client()
     try:
-        response = await openai_client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            n=1,
-            size=config.OPENAI_IMAGE_SIZE,
-        )
+        async with image_generation_limiter:
+            response = await openai_client.images.generate(
+                model="dall-e-3",
+                prompt=prompt,
+                n=1,
+                size=config.OPENAI_IMAGE_SIZE,
+            )
         logger.debug(response)
         output = response.model_dump(exclude_unset=True)
         logger.debug(f"The response form openai is {output}")
         return output
 
-    except openai.APIConnectionError as e:
-        # Handle connection error, e.g. check network or log
-        print(f"OpenAI API request failed to connect: {e}")
-        pass
-    except openai.BadRequestError as e:
-        # Handle invalid request error, e.g. validate parameters or log
-        print(f"OpenAI API request was invalid: {e}")
-        pass
-    except openai.AuthenticationError as e:
-        # Handle authentication error, e.g. check credentials or log
-        print(f"OpenAI API request was not authorized: {e}")
-        pass
-    except openai.PermissionDeniedError as e:
-        # Handle permission error, e.g. check scope or log
-        print(f"OpenAI API request was not permitted: {e}")
-        pass
-    except openai.RateLimitError as e:
-        # Handle rate limit error, e.g. wait or log
-        print(f"OpenAI API request exceeded rate limit: {e}")
-        pass
-    except openai.APIStatusError as e:
-        # Handle rate limit error, e.g. wait or log
-        print(f"OpenAI API request exceeded rate limit: {e}")
-        pass
+    except (
+        openai.BadRequestError,
+        openai.AuthenticationError,
+        openai.PermissionDeniedError,
+    ) as e:
+        # Retrying the same request won't help, so the post goes without
+        # an image.
+        logger.error(f"OpenAI API request was rejected: {e}")
+        raise APIResponseException(
+            f"Image generation failed with status code {e.status_code}"
+        ) from e
     except openai.APIError as e:
-        # Handle API error, e.g. retry or log
-        print(f"OpenAI API returned an API Error: {e}")
-        pass
+        # Connection errors, rate limits and server errors that outlived
+        # the client's own retries; the job backs off and tries again.
+        logger.warning(f"OpenAI API request failed: {e}")
+        raise
+
+
+def _chunk_reader(
+    chunks: AsyncIterator[bytes],
+) -> Callable[[int], Awaitable[bytes]]:
+    """Adapt an async iterator of chunks to the `read(size)` that
+    b2_upload_stream expects."""
+    buffer = bytearray()
+
+    async def read(size: int) -> bytes:
+        while len(buffer) < size and (chunk := await anext(chunks, b"")):
+            buffer.extend(chunk)
+        data = bytes(buffer[:size])
+        del buffer[:size]
+        return data
+
+    return read
+
+
+def post_image_name(post_id: int) -> str:
+    return f"posts/{post_id}/{uuid.uuid4().hex}.png"
+
+
+async def persist_image(url: str, file_name: str) -> B2File:
+    """Stream the image at `url` into our bucket as `file_name`."""
+    logger.debug(f"Copying image {url[:40]} to {file_name}")
+    client = get_http_client()
+    response = await client.send(client.build_request("GET", url), stream=True)
+    try:
+        response.raise_for_status()
+        return await b2_upload_stream(
+            _chunk_reader(response.aiter_bytes()), file_name
+        )
+    finally:
+        await response.aclose()
 
 
 async def generate_image_and_add_to_post(
@@ -109,28 +223,69 @@ async def generate_image_and_add_to_post(
     database: Database,
     prompt: str,
 ):
-    try:
-        response = await _generate_image_api(prompt)
-    except APIResponseException as e:
-        logger.error(f"Error generating image: {e}")
-        to = email
-        subject = "Error generating image"
-        body = (
-            "Hi there,\nUnfortunately there was an error "
-            "generating an image for your post"
-        )
-        return await send_simple_email(to, subject, body)
-
-    logger.debug("Connection to database to update image_url")
-    image_url = response["data"][0]["url"]
-    query = (
-        post_table.update()
-        .where(post_table.c.id == post_id)
-        .values(image_url=image_url)
+    # Retries must not pay for another generation: the generated URL is
+    # stored before the image is copied, so a retry after a failed copy
+    # only copies again, and one after a failed email only emails.
+    query = sqlalchemy.select(post_table.c.image_url).where(
+        post_table.c.id == post_id
     )
     logger.debug(query)
-    await database.execute(query)
-    logger.debug(f"Database background task for {post_id} closed")
+    image_url = await database.fetch_val(query)
+    response = None
+    if image_url is None:
+        try:
+            response = await _generate_image_api(prompt)
+        except APIResponseException as e:
+            logger.error(f"Error generating image: {e}")
+            to = email
+            subject = "Error generating image"
+            body = (
+                "Hi there,\nUnfortunately there was an error "
+                "generating an image for your post"
+            )
+            return await send_simple_email(to, subject, body)
+
+        image_url = response["data"][0]["url"]
+        query = (
+            post_table.update()
+            .where(post_table.c.id == post_id)
+            .values(image_url=image_url)
+        )
+        logger.debug(query)
+        await database.execute(query)
+    else:
+        logger.info(f"Post {post_id} already has an image, not generating")
+
+    if not image_url.startswith(await b2_download_url()):
+        # OpenAI's URLs expire, so only a copy in our bucket is kept
+        try:
+            persisted_image = await persist_image(
+                image_url, post_image_name(post_id)
+            )
+        except httpx.HTTPStatusError as e:
+            if e.response.is_client_error:
+                # Expired, so the next attempt generates a new image
+                logger.warning(f"Image of post {post_id} has expired")
+                await database.execute(
+                    post_table.update()
+                    .where(
+                        post_table.c.id == post_id,
+                        post_table.c.image_url == image_url,
+                    )
+                    .values(image_url=None)
+                )
+            raise
+        logger.debug("Connection to database to update image_url")
+        query = (
+            post_table.update()
+            .where(post_table.c.id == post_id)
+            .values(image_url=persisted_image.download_url)
+        )
+        logger.debug(query)
+        await database.execute(query)
+        await invalidate_post(post_id)
+        await invalidate_feed()
+        logger.debug(f"Database background task for {post_id} closed")
     to = email
     subject = "Image generated for your post!"
     body = (
@@ -139,3 +294,168 @@ async def generate_image_and_add_to_post(
     )
     await send_simple_email(to, subject, body)
     return response
+
+
+async def process_post_image(post_id: int, database: Database):
+    """Download the post's image once, store its thumbnail and responsive
+    variants in B2 and list them on the post."""
+    query = sqlalchemy.select(post_table.c.image_url).where(
+        post_table.c.id == post_id
+    )
+    logger.debug(query)
+    image_url = await database.fetch_val(query)
+    if image_url is None:
+        logger.info(f"Post {post_id} has no image to process")
+        return
+
+    response = await get_http_client().get(image_url)
+    response.raise_for_status()
+    data = response.content
+
+    loop = asyncio.get_running_loop()
+    variants = await loop.run_in_executor(
+        image_executor, render_variants, data
+    )
+    # Keyed by content, so reprocessing an image overwrites its variants
+    prefix = f"variants/{hashlib.sha256(data).hexdigest()}"
+    uploaded_files = await asyncio.gather(
+        *(
+            b2_upload_bytes(
+                variant.data,
+                f"{prefix}/{variant.kind}-{variant.width}.{variant.format}",
+            )
+            for variant in variants
+        )
+    )
+    image_variants = [
+        {
+            "kind": variant.kind,
+            "format": variant.format,
+            "width": variant.width,
+            "height": variant.height,
+            "url": uploaded_file.download_url,
+        }
+        for variant, uploaded_file in zip(variants, uploaded_files)
+    ]
+
+    # Unless the image was replaced while this one was processed
+    query = (
+        post_table.update()
+        .where(post_table.c.id == post_id, post_table.c.image_url == image_url)
+        .values(image_variants=image_variants)
+    )
+    logger.debug(query)
+    await database.execute(query)
+    await invalidate_post(post_id)
+    await invalidate_feed()
+    logger.info(f"Stored {len(image_variants)} image variants for {post_id}")
+
+
+async def backfill_post_images(database: Database) -> list[int]:
+    """Copy post images that aren't in our bucket yet, such as the
+    expiring OpenAI URLs stored by earlier versions, into the bucket.
+
+    Up to IMAGE_BACKFILL_CONCURRENCY images are copied at a time. Images
+    that can no longer be downloaded are logged and left as they are.
+    Returns the ids of the posts that were updated.
+    """
+    # substr rather than LIKE, whose % the databases driver layer
+    # mistakes for a parameter placeholder
+    download_url = await b2_download_url()
+    query = sqlalchemy.select(post_table.c.id, post_table.c.image_url).where(
+        post_table.c.image_url.is_not(None),
+        sqlalchemy.func.substr(post_table.c.image_url, 1, len(download_url))
+        != download_url,
+    )
+    logger.debug(query)
+    posts = await database.fetch_all(query)
+    limiter = asyncio.Semaphore(config.IMAGE_BACKFILL_CONCURRENCY)
+
+    async def backfill(post) -> int | None:
+        async with limiter:
+            try:
+                persisted_image = await persist_image(
+                    post.image_url, post_image_name(post.id)
+                )
+            except Exception as e:
+                logger.warning(f"Could not copy image of post {post.id}: {e}")
+                return None
+        query = (
+            post_table.update()
+            .where(
+                post_table.c.id == post.id,
+                post_table.c.image_url == post.image_url,
+            )
+            .values(image_url=persisted_image.download_url)
+        )
+        logger.debug(query)
+        await database.execute(query)
+        await invalidate_post(post.id)
+        return post.id
+
+    results = await asyncio.gather(*(backfill(post) for post in posts))
+    post_ids = [post_id for post_id in results if post_id is not None]
+    if post_ids:
+        await invalidate_feed()
+    logger.info(f"Copied the images of {len(post_ids)}/{len(posts)} posts")
+    return post_ids
+
+
+async def reconcile_post_counts(database: Database) -> int:
+    """Repair drift between the denormalized post counters and the
+    likes/comments tables. Returns the number of posts that were fixed."""
+    like_count = (
+        sqlalchemy.select(sqlalchemy.func.count(like_table.c.id))
+        .where(like_table.c.post_id == post_table.c.id)
+        .scalar_subquery()
+    )
+    comment_count = (
+        sqlalchemy.select(sqlalchemy.func.count(comment_table.c.id))
+        .where(comment_table.c.post_id == post_table.c.id)
+        .scalar_subquery()
+    )
+    drifted = sqlalchemy.or_(
+        post_table.c.like_count != like_count,
+        post_table.c.comment_count != comment_count,
+    )
+
+    async with database.transaction():
+        query = sqlalchemy.select(post_table.c.id).where(drifted)
+        logger.debug(query)
+        post_ids = [row.id for row in await database.fetch_all(query)]
+        if post_ids:
+            query = (
+                post_table.update()
+                .where(post_table.c.id.in_(post_ids))
+                .values(like_count=like_count, comment_count=comment_count)
+            )
+            logger.debug(query)
+            await database.execute(query)
+    for post_id in post_ids:
+        await invalidate_post(post_id)
+    if post_ids:
+        await invalidate_feed()
+
+    logger.info(f"Reconciled like and comment counts on {len(post_ids)} posts")
+    return len(post_ids)
+
+
+async def reconcile_follower_counts(database: Database) -> int:
+    """Repair drift between users.follower_count and the follows table.
+    Returns the number of users that were fixed."""
+    follower_count = (
+        sqlalchemy.select(sqlalchemy.func.count(follow_table.c.id))
+        .where(follow_table.c.followee_id == user_table.c.id)
+        .scalar_subquery()
+    )
+    query = (
+        user_table.update()
+        .where(user_table.c.follower_count != follower_count)
+        .values(follower_count=follower_count)
+        .returning(user_table.c.id)
+    )
+    logger.debug(query)
+    user_ids = [row.id for row in await database.fetch_all(query)]
+
+    logger.info(f"Reconciled follower counts on {len(user_ids)} users")
+    return len(user_ids)
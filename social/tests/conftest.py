@@ -4,14 +4,28 @@ from typing import AsyncGenerator, Generator
 from unittest.mock import AsyncMock, Mock
 
 import pytest
+import sqlalchemy
 from fastapi.testclient import TestClient
 from httpx import AsyncClient, Request, Response
 
 from social.tests.helpers import create_post  # noqa: E402
 
 os.environ["ENV_STATE"] = "test"
-from social.database import database, user_table  # noqa: E402
+from social.database import (  # noqa: E402
+    database,
+    get_engine,
+    post_table,
+    user_table,
+)
+from social.jobs import Worker  # noqa: E402
 from social.main import app  # noqa: E402
+from social.migrations import upgrade  # noqa: E402
+from social.response_cache import response_cache  # noqa: E402
+from social.security import (  # noqa: E402
+    create_access_token,
+    decoded_token_cache,
+    user_cache,
+)
 
 logging.getLogger("openai").setLevel(logging.DEBUG)
 
@@ -21,6 +35,11 @@ def anyio_backend():
     return "asyncio"
 
 
+@pytest.fixture(scope="session", autouse=True)
+def database_schema():
+    upgrade(get_engine())
+
+
 @pytest.fixture()
 def client() -> Generator:
     yield TestClient(app)
@@ -33,6 +52,14 @@ async def db() -> AsyncGenerator:
     await database.disconnect()
 
 
+@pytest.fixture(autouse=True)
+async def clear_caches() -> AsyncGenerator:
+    yield
+    await user_cache.clear()
+    await response_cache.clear()
+    decoded_token_cache.clear()
+
+
 @pytest.fixture()
 async def async_client(client) -> AsyncGenerator:
     async with AsyncClient(app=app, base_url=client.base_url) as ac:
@@ -63,6 +90,16 @@ async def confirmed_user(registered_user: dict) -> dict:
     return registered_user
 
 
+@pytest.fixture()
+async def other_user() -> dict:
+    """A second confirmed user, with an access token."""
+    email = "other@davidnevin.net"
+    user_id = await database.execute(
+        user_table.insert().values(email=email, is_active=True)
+    )
+    return {"id": user_id, "email": email, "token": create_access_token(email)}
+
+
 @pytest.fixture()
 async def logged_in_token(async_client: AsyncClient, confirmed_user: dict):
     response = await async_client.post("/token", json=confirmed_user)
@@ -85,29 +122,54 @@ def mock_generate_image(mocker):
     )
 
 
+@pytest.fixture()
+def run_jobs():
+    async def run() -> int:
+        return await Worker(database, {}).run_pending()
+
+    return run
+
+
 @pytest.fixture()
 async def created_post(
     async_client: AsyncClient,
     logged_in_token: str,
     mock_generate_image,
+    run_jobs,
 ):
-    return await create_post(
+    post = await create_post(
         "Test Post",
         async_client,
         logged_in_token,
     )
+    await run_jobs()
+    query = sqlalchemy.select(post_table.c.image_url).where(
+        post_table.c.id == post["id"]
+    )
+    post["image_url"] = await database.fetch_val(query)
+    return post
 
 
 @pytest.fixture(autouse=True)
 def mock_httpx_client(mocker):
-    mocked_client = mocker.patch("social.tasks.httpx.AsyncClient")
     mocked_async_client = Mock()
     response = Response(
         status_code=200, content="", request=Request("POST", "//")
     )
     mocked_async_client.post = AsyncMock(return_value=response)
-    mocked_client.return_value.__aenter__.return_value = (
-        mocked_async_client  # using async context manager
+    # Streamed downloads, see tasks.persist_image
+    mocked_async_client.send = AsyncMock(
+        return_value=Response(
+            status_code=200, content=b"image", request=Request("GET", "//")
+        )
+    )
+    mocked_async_client.get = AsyncMock(
+        return_value=Response(
+            status_code=404, content="", request=Request("GET", "//")
+        )
+    )
+    mocker.patch(
+        "social.tasks.get_http_client", return_value=mocked_async_client
     )
 
     return mocked_async_client
@@ -36,3 +36,13 @@ async def like_post(
         headers={"Authorization": f"Bearer {logged_in_token}"},
     )
     return response.json()
+
+
+async def follow(
+    user_id: int, async_client: AsyncClient, logged_in_token: str
+):
+    response = await async_client.post(
+        f"/user/{user_id}/follow",
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    return response
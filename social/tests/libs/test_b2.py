@@ -0,0 +1,91 @@
+import io
+
+import b2sdk.v2 as b2
+import pytest
+
+from social.config import config
+from social.libs import b2 as b2_lib
+
+
+@pytest.fixture()
+def b2_simulator(mocker):
+    api = b2.B2Api(
+        b2.InMemoryAccountInfo(),
+        api_config=b2.B2HttpApiConfig(_raw_api_class=b2.RawSimulator),
+    )
+    simulator = api.session.raw_api
+    api.authorize_account("production", *simulator.create_account())
+    bucket = api.create_bucket("test-bucket", "allPrivate")
+    mocker.patch("social.libs.b2.b2_api", return_value=api)
+    mocker.patch.object(config, "B2_BUCKET_NAME", "test-bucket")
+    mocker.patch.object(config, "B2_UPLOAD_PART_SIZE", simulator.MIN_PART_SIZE)
+    return bucket
+
+
+def downloaded(bucket, uploaded_file: b2_lib.B2File) -> bytes:
+    output = io.BytesIO()
+    bucket.download_file_by_id(uploaded_file.file_id).save(output)
+    return output.getvalue()
+
+
+async def upload(data: bytes) -> b2_lib.B2File:
+    stream = io.BytesIO(data)
+
+    async def read(size: int) -> bytes:
+        return stream.read(size)
+
+    return await b2_lib.b2_upload_stream(read, "f.bin")
+
+
+@pytest.mark.anyio
+async def test_small_upload_is_single_request(b2_simulator, mocker):
+    start_spy = mocker.spy(b2_lib, "_b2_start_large_file")
+    data = b"x" * config.B2_UPLOAD_PART_SIZE
+
+    uploaded_file = await upload(data)
+
+    assert downloaded(b2_simulator, uploaded_file) == data
+    start_spy.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_empty_upload(b2_simulator):
+    uploaded_file = await upload(b"")
+
+    assert downloaded(b2_simulator, uploaded_file) == b""
+
+
+@pytest.mark.anyio
+async def test_large_upload_in_parts(b2_simulator, mocker):
+    part_spy = mocker.spy(b2_lib, "_b2_upload_part")
+    data = bytes(range(256)) * 4  # five 200 byte parts plus 24 bytes
+
+    uploaded_file = await upload(data)
+
+    assert downloaded(b2_simulator, uploaded_file) == data
+    assert uploaded_file.size == len(data)
+    # The simulator doesn't require a content type, but B2 does
+    file_version = b2_simulator.get_file_info_by_id(uploaded_file.file_id)
+    assert file_version.content_type == b2_lib.AUTO_CONTENT_TYPE
+    assert [call.args[1] for call in part_spy.call_args_list] == [
+        1,
+        2,
+        3,
+        4,
+        5,
+        6,
+    ]
+
+
+@pytest.mark.anyio
+async def test_failed_part_cancels_large_file(b2_simulator, mocker):
+    mocker.patch.object(
+        b2_lib, "_b2_upload_part", side_effect=RuntimeError("boom")
+    )
+    cancel_spy = mocker.spy(b2_lib, "_b2_cancel_large_file")
+
+    with pytest.raises(RuntimeError):
+        await upload(b"x" * config.B2_UPLOAD_PART_SIZE * 4)
+
+    cancel_spy.assert_called_once()
+    assert not list(b2_simulator.list_unfinished_large_files())
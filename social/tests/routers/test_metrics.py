@@ -0,0 +1,28 @@
+import pytest
+from httpx import AsyncClient
+
+
+@pytest.mark.anyio
+async def test_metrics_user_cache(
+    async_client: AsyncClient, logged_in_token: str
+):
+    before = (await async_client.get("/metrics")).json()["user_cache"]
+    for _ in range(2):
+        await async_client.post(
+            "/upload", headers={"Authorization": f"Bearer {logged_in_token}"}
+        )
+
+    response = await async_client.get("/metrics")
+    assert response.status_code == 200
+    after = response.json()["user_cache"]
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 1
+
+
+@pytest.mark.anyio
+async def test_metrics_database_pool(async_client: AsyncClient):
+    response = await async_client.get("/metrics")
+    assert response.status_code == 200
+    assert {"in_use", "waiting", "wait_seconds_total"} <= set(
+        response.json()["database_pool"]
+    )
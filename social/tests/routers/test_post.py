@@ -1,8 +1,17 @@
+import json
+
 import pytest
 from httpx import AsyncClient
 
+import social.routers.post as post_router
+from social.database import database, like_table, timeline_table, user_table
 from social.security import create_access_token
-from social.tests.helpers import create_comment, create_post, like_post
+from social.tests.helpers import (
+    create_comment,
+    create_post,
+    follow,
+    like_post,
+)
 
 
 @pytest.fixture()
@@ -47,6 +56,7 @@ async def test_create_post_with_prompt(
     async_client: AsyncClient,
     logged_in_token: str,
     mock_generate_image,
+    run_jobs,
 ):
     body = "A small dog lived in the woods"
 
@@ -62,8 +72,10 @@ async def test_create_post_with_prompt(
         "body": body,
         "image_url": None,
     }.items() <= response.json().items()
+    mock_generate_image.assert_not_called()
 
-    mock_generate_image.assert_called()
+    await run_jobs()
+    mock_generate_image.assert_called_once_with(body)
 
 
 @pytest.mark.anyio
@@ -109,8 +121,10 @@ async def test_get_all_posts(
     response = await async_client.get("/post")
 
     assert response.status_code == 200
-    created_post["image_url"] = "https://test.com/image.png"
-    assert response.json() == [{**created_post, "likes": 0}]
+    assert response.json() == {
+        "posts": [{**created_post, "likes": 0}],
+        "next_cursor": None,
+    }
 
 
 @pytest.mark.anyio
@@ -141,10 +155,76 @@ async def test_get_all_posts_sorting(
     assert response.status_code == 200
 
     data = response.json()
-    post_ids = [post["id"] for post in data]
+    post_ids = [post["id"] for post in data["posts"]]
     assert post_ids == expected_order
 
 
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "sorting, expected_order",
+    [
+        ("new", [4, 3, 2, 1]),
+        ("old", [1, 2, 3, 4]),
+        ("most_likes", [3, 1, 2, 4]),
+    ],
+)
+async def test_get_all_posts_paginated(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sorting: str,
+    expected_order: list[int],
+    mock_generate_image,
+):
+    for i in range(1, 5):
+        await create_post(f"Test Post {i}", async_client, logged_in_token)
+    await like_post(3, async_client, logged_in_token)
+
+    pages = []
+    params = {"sorting": sorting, "limit": 2}
+    while True:
+        response = await async_client.get("/post", params=params)
+        assert response.status_code == 200
+        data = response.json()
+        pages.append([post["id"] for post in data["posts"]])
+        if data["next_cursor"] is None:
+            break
+        params["cursor"] = data["next_cursor"]
+
+    assert pages == [expected_order[:2], expected_order[2:]]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_invalid_cursor(async_client: AsyncClient):
+    response = await async_client.get("/post", params={"cursor": "invalid"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cursor_from_other_sorting(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    mock_generate_image,
+):
+    for i in range(1, 3):
+        await create_post(f"Test Post {i}", async_client, logged_in_token)
+    response = await async_client.get(
+        "/post", params={"sorting": "new", "limit": 1}
+    )
+    cursor = response.json()["next_cursor"]
+
+    response = await async_client.get(
+        "/post", params={"sorting": "most_likes", "cursor": cursor}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_limit_above_max(async_client: AsyncClient):
+    response = await async_client.get("/post", params={"limit": 10_000})
+    assert response.status_code == 422
+
+
 @pytest.mark.anyio
 async def test_get_all_posts_incorrect_sorting(async_client: AsyncClient):
     response = await async_client.get("/post", params={"sorting": "incorrect"})
@@ -178,6 +258,19 @@ async def test_create_comment(
     }.items() <= response.json().items()
 
 
+@pytest.mark.anyio
+async def test_create_comment_on_non_existent_post(
+    async_client: AsyncClient,
+    logged_in_token: str,
+):
+    response = await async_client.post(
+        "/comment",
+        json={"body": "Test Comment", "post_id": 999},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 404
+
+
 @pytest.mark.anyio
 async def test_get_comments_on_post(
     async_client: AsyncClient,
@@ -186,7 +279,10 @@ async def test_get_comments_on_post(
 ):
     response = await async_client.get(f"post/{created_post['id']}/comment")
     assert response.status_code == 200
-    assert response.json() == [created_comment]
+    assert response.json() == {
+        "comments": [created_comment],
+        "next_cursor": None,
+    }
 
 
 @pytest.mark.anyio
@@ -196,7 +292,7 @@ async def test_get_comments_on_post_empty(
 ):
     response = await async_client.get(f"post/{created_post['id']}/comment")
     assert response.status_code == 200
-    assert response.json() == []
+    assert response.json() == {"comments": [], "next_cursor": None}
 
 
 @pytest.mark.anyio
@@ -204,17 +300,41 @@ async def test_get_post_and_its_comments(
     async_client: AsyncClient, created_post: dict, created_comment: dict
 ):
     response = await async_client.get(f"/post/{created_post['id']}")
-    created_post["image_url"] = "https://test.com/image.png"
     assert response.status_code == 200
     assert (
         response.json().items()
         <= {
             "post": {**created_post, "likes": 0},
             "comments": [created_comment],
+            "comment_count": 1,
+            "next_comment_cursor": None,
         }.items()
     )
 
 
+@pytest.mark.anyio
+async def test_get_post_with_likes_and_comments(
+    async_client: AsyncClient,
+    created_post: dict,
+    logged_in_token: str,
+):
+    comments = [
+        await create_comment(
+            f"Test Comment {i}",
+            created_post["id"],
+            async_client,
+            logged_in_token,
+        )
+        for i in range(2)
+    ]
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.status_code == 200
+    assert response.json()["post"]["likes"] == 1
+    assert response.json()["comments"] == comments
+
+
 @pytest.mark.anyio
 async def test_get_non_existent_post(async_client: AsyncClient):
     response = await async_client.get("/post/999")
@@ -241,3 +361,634 @@ async def test_like_post(
         "post_id": created_post["id"],
         "user_id": confirmed_user["id"],
     }
+
+
+@pytest.mark.anyio
+async def test_like_post_twice(
+    async_client: AsyncClient,
+    created_post: dict,
+    logged_in_token: str,
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.post(
+        "/post/like",
+        json={"post_id": created_post["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 409
+
+    response = await async_client.get("/post")
+    assert response.json()["posts"][0]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_like_non_existent_post(
+    async_client: AsyncClient,
+    logged_in_token: str,
+):
+    response = await async_client.post(
+        "/post/like",
+        json={"post_id": 999},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_is_cached(
+    async_client: AsyncClient, created_post: dict, mocker
+):
+    find_posts_spy = mocker.spy(post_router, "find_posts")
+
+    first = await async_client.get("/post")
+    second = await async_client.get("/post")
+
+    assert first.json() == second.json()
+    assert find_posts_spy.call_count == 1
+
+
+@pytest.mark.anyio
+async def test_get_post_not_modified(
+    async_client: AsyncClient, created_post: dict
+):
+    response = await async_client.get(f"/post/{created_post['id']}")
+    etag = response.headers["etag"]
+
+    response = await async_client.get(
+        f"/post/{created_post['id']}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+
+@pytest.mark.anyio
+async def test_like_invalidates_post_and_feed(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    post = await async_client.get(f"/post/{created_post['id']}")
+    await async_client.get("/post")
+
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.get(
+        f"/post/{created_post['id']}",
+        headers={"If-None-Match": post.headers["etag"]},
+    )
+    assert response.status_code == 200
+    assert response.json()["post"]["likes"] == 1
+    response = await async_client.get("/post")
+    assert response.json()["posts"][0]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_comment_invalidates_post_comments(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await async_client.get(f"/post/{created_post['id']}/comment")
+
+    comment = await create_comment(
+        "Test Comment", created_post["id"], async_client, logged_in_token
+    )
+
+    response = await async_client.get(f"/post/{created_post['id']}/comment")
+    assert response.json()["comments"] == [comment]
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["comments"] == [comment]
+
+
+@pytest.mark.anyio
+async def test_create_post_invalidates_feed(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await async_client.get("/post")
+
+    await create_post("Second Post", async_client, logged_in_token)
+
+    response = await async_client.get("/post")
+    assert len(response.json()["posts"]) == 2
+
+
+@pytest.mark.anyio
+async def test_like_posts_batch(
+    async_client: AsyncClient,
+    created_post: dict,
+    logged_in_token: str,
+    confirmed_user: dict,
+):
+    second_post = await create_post(
+        "Second Post", async_client, logged_in_token
+    )
+    await async_client.get("/post")
+
+    response = await async_client.post(
+        "/post/like/batch",
+        json={
+            "likes": [
+                {"post_id": created_post["id"]},
+                {"post_id": 999},
+                {"post_id": second_post["id"]},
+                {"post_id": created_post["id"]},
+            ]
+        },
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 200
+    user_id = confirmed_user["id"]
+    assert response.json() == [
+        {
+            "status_code": 201,
+            "detail": None,
+            "like": {
+                "id": 1,
+                "post_id": created_post["id"],
+                "user_id": user_id,
+            },
+        },
+        {"status_code": 404, "detail": "Post not found", "like": None},
+        {
+            "status_code": 201,
+            "detail": None,
+            "like": {
+                "id": 2,
+                "post_id": second_post["id"],
+                "user_id": user_id,
+            },
+        },
+        {"status_code": 409, "detail": "Post already liked", "like": None},
+    ]
+    response = await async_client.get("/post")
+    assert [post["likes"] for post in response.json()["posts"]] == [1, 1]
+
+
+@pytest.mark.anyio
+async def test_like_posts_batch_already_liked(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.post(
+        "/post/like/batch",
+        json={"likes": [{"post_id": created_post["id"]}]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()[0]["status_code"] == 409
+
+
+@pytest.mark.anyio
+async def test_like_posts_batch_too_large(
+    async_client: AsyncClient, logged_in_token: str, mocker
+):
+    mocker.patch.object(post_router.config, "BATCH_MAX_ITEMS", 2)
+
+    response = await async_client.post(
+        "/post/like/batch",
+        json={"likes": [{"post_id": post_id} for post_id in range(3)]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_like_posts_batch_empty(
+    async_client: AsyncClient, logged_in_token: str
+):
+    response = await async_client.post(
+        "/post/like/batch",
+        json={"likes": []},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_create_comments_batch(
+    async_client: AsyncClient,
+    created_post: dict,
+    logged_in_token: str,
+    confirmed_user: dict,
+):
+    await async_client.get(f"/post/{created_post['id']}/comment")
+
+    response = await async_client.post(
+        "/comment/batch",
+        json={
+            "comments": [
+                {"body": "First", "post_id": created_post["id"]},
+                {"body": "Lost", "post_id": 999},
+                {"body": "Second", "post_id": created_post["id"]},
+            ]
+        },
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["status_code"] for result in results] == [201, 404, 201]
+    comments = [results[0]["comment"], results[2]["comment"]]
+    assert comments == [
+        {
+            "id": 1,
+            "body": "First",
+            "post_id": created_post["id"],
+            "user_id": confirmed_user["id"],
+        },
+        {
+            "id": 2,
+            "body": "Second",
+            "post_id": created_post["id"],
+            "user_id": confirmed_user["id"],
+        },
+    ]
+    response = await async_client.get(f"/post/{created_post['id']}/comment")
+    assert response.json()["comments"] == comments
+
+
+@pytest.mark.anyio
+async def test_create_comments_batch_unauthorized(async_client: AsyncClient):
+    response = await async_client.post(
+        "/comment/batch",
+        json={"comments": [{"body": "Test Comment", "post_id": 1}]},
+    )
+
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_get_likes_on_post(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    like = await like_post(created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.get(f"/post/{created_post['id']}/like")
+
+    assert response.status_code == 200
+    assert response.json() == {"likes": [like], "next_cursor": None}
+
+
+@pytest.mark.anyio
+async def test_get_likes_on_post_pages(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    first_like = await like_post(
+        created_post["id"], async_client, logged_in_token
+    )
+    other_user_id = await database.execute(
+        user_table.insert().values(email="other@davidnevin.net")
+    )
+    second_like = {"post_id": created_post["id"], "user_id": other_user_id}
+    second_like["id"] = await database.execute(
+        like_table.insert().values(second_like)
+    )
+
+    response = await async_client.get(
+        f"/post/{created_post['id']}/like", params={"limit": 1}
+    )
+    assert response.json()["likes"] == [second_like]
+
+    response = await async_client.get(
+        f"/post/{created_post['id']}/like",
+        params={"limit": 1, "cursor": response.json()["next_cursor"]},
+    )
+    assert response.json() == {"likes": [first_like], "next_cursor": None}
+
+
+@pytest.mark.anyio
+async def test_get_likes_on_post_without_likes(
+    async_client: AsyncClient, created_post: dict
+):
+    response = await async_client.get(f"/post/{created_post['id']}/like")
+
+    assert response.status_code == 200
+    assert response.json() == {"likes": [], "next_cursor": None}
+
+
+@pytest.mark.anyio
+async def test_get_likes_on_non_existent_post(async_client: AsyncClient):
+    response = await async_client.get("/post/999/like")
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_get_likes_on_post_invalid_cursor(
+    async_client: AsyncClient, created_post: dict
+):
+    response = await async_client.get(
+        f"/post/{created_post['id']}/like", params={"cursor": "nope"}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_get_post_with_likes(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await async_client.get(f"/post/like/{created_post['id']}")
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.get(f"/post/like/{created_post['id']}")
+
+    assert response.status_code == 200
+    assert {**created_post, "likes": 1}.items() <= response.json().items()
+
+
+@pytest.mark.anyio
+async def test_get_non_existent_post_with_likes(async_client: AsyncClient):
+    response = await async_client.get("/post/like/999")
+    assert response.status_code == 404
+
+
+@pytest.fixture()
+async def created_comments(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+) -> list[dict]:
+    return [
+        await create_comment(
+            f"Test Comment {i}",
+            created_post["id"],
+            async_client,
+            logged_in_token,
+        )
+        for i in range(3)
+    ]
+
+
+@pytest.mark.anyio
+async def test_get_comments_on_post_pages(
+    async_client: AsyncClient, created_post: dict, created_comments: list
+):
+    url = f"/post/{created_post['id']}/comment"
+
+    first = await async_client.get(url, params={"limit": 2})
+    assert first.json()["comments"] == created_comments[:2]
+
+    second = await async_client.get(
+        url, params={"limit": 2, "cursor": first.json()["next_cursor"]}
+    )
+    assert second.json() == {
+        "comments": created_comments[2:],
+        "next_cursor": None,
+    }
+
+
+@pytest.mark.anyio
+async def test_get_comments_on_post_invalid_cursor(
+    async_client: AsyncClient, created_post: dict
+):
+    response = await async_client.get(
+        f"/post/{created_post['id']}/comment", params={"cursor": "nope"}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_get_post_with_limited_comments(
+    async_client: AsyncClient, created_post: dict, created_comments: list
+):
+    response = await async_client.get(
+        f"/post/{created_post['id']}", params={"comments_limit": 1}
+    )
+
+    assert response.status_code == 200
+    post = response.json()
+    assert post["comments"] == created_comments[:1]
+    assert post["comment_count"] == 3
+
+    response = await async_client.get(
+        f"/post/{created_post['id']}/comment",
+        params={"cursor": post["next_comment_cursor"]},
+    )
+    assert response.json()["comments"] == created_comments[1:]
+
+
+@pytest.mark.anyio
+async def test_get_post_without_comments_embedded(
+    async_client: AsyncClient, created_post: dict, created_comments: list
+):
+    response = await async_client.get(
+        f"/post/{created_post['id']}", params={"comments_limit": 0}
+    )
+
+    post = response.json()
+    assert post["comments"] == []
+    assert post["comment_count"] == 3
+    response = await async_client.get(
+        f"/post/{created_post['id']}/comment",
+        params={"cursor": post["next_comment_cursor"]},
+    )
+    assert response.json()["comments"] == created_comments
+
+
+@pytest.mark.anyio
+async def test_export_comments_on_post(
+    async_client: AsyncClient,
+    created_post: dict,
+    created_comments: list,
+    mocker,
+):
+    # Several batches, the last one full
+    mocker.patch.object(post_router.config, "COMMENT_EXPORT_BATCH_SIZE", 1)
+
+    response = await async_client.get(
+        f"/post/{created_post['id']}/comment/export"
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert [json.loads(line) for line in lines] == created_comments
+
+
+@pytest.mark.anyio
+async def test_export_comments_on_non_existent_post(
+    async_client: AsyncClient,
+):
+    response = await async_client.get("/post/999/comment/export")
+    assert response.status_code == 404
+
+
+async def get_timeline(async_client: AsyncClient, token: str, **params):
+    response = await async_client.get(
+        "/timeline",
+        params=params,
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.anyio
+async def test_timeline_has_own_posts(
+    async_client: AsyncClient, logged_in_token: str, mock_generate_image
+):
+    post = await create_post("Test Post", async_client, logged_in_token)
+
+    # Before the fan-out job has run
+    timeline = await get_timeline(async_client, logged_in_token)
+
+    assert [p["id"] for p in timeline["posts"]] == [post["id"]]
+
+
+@pytest.mark.anyio
+async def test_timeline_fans_out_followed_posts(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    other_user: dict,
+    mock_generate_image,
+    run_jobs,
+):
+    response = await follow(other_user["id"], async_client, logged_in_token)
+    assert response.status_code == 201
+    post = await create_post("Other Post", async_client, other_user["token"])
+    await run_jobs()
+
+    timeline = await get_timeline(async_client, logged_in_token)
+
+    assert [p["id"] for p in timeline["posts"]] == [post["id"]]
+
+
+@pytest.mark.anyio
+async def test_timeline_backfills_on_follow(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    other_user: dict,
+    mock_generate_image,
+    run_jobs,
+):
+    post = await create_post("Other Post", async_client, other_user["token"])
+    await run_jobs()
+
+    response = await follow(other_user["id"], async_client, logged_in_token)
+    assert response.status_code == 201
+
+    timeline = await get_timeline(async_client, logged_in_token)
+    assert [p["id"] for p in timeline["posts"]] == [post["id"]]
+
+
+@pytest.mark.anyio
+async def test_timeline_unfollow_removes_posts(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    other_user: dict,
+    mock_generate_image,
+):
+    await create_post("Other Post", async_client, other_user["token"])
+    response = await follow(other_user["id"], async_client, logged_in_token)
+    assert response.status_code == 201
+
+    await async_client.delete(
+        f"/user/{other_user['id']}/follow",
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    timeline = await get_timeline(async_client, logged_in_token)
+    assert timeline["posts"] == []
+
+
+@pytest.mark.anyio
+async def test_timeline_pulls_high_follower_authors(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    other_user: dict,
+    mock_generate_image,
+    run_jobs,
+    mocker,
+):
+    mocker.patch.object(post_router.config, "TIMELINE_FANOUT_MAX_FOLLOWERS", 0)
+    own_post = await create_post("Own Post", async_client, logged_in_token)
+    response = await follow(other_user["id"], async_client, logged_in_token)
+    assert response.status_code == 201
+    other_post = await create_post(
+        "Other Post", async_client, other_user["token"]
+    )
+    await run_jobs()
+
+    entries = await database.fetch_all(
+        timeline_table.select().where(
+            timeline_table.c.author_id == other_user["id"]
+        )
+    )
+    assert [entry.user_id for entry in entries] == [other_user["id"]]
+    timeline = await get_timeline(async_client, logged_in_token)
+    assert [p["id"] for p in timeline["posts"]] == [
+        other_post["id"],
+        own_post["id"],
+    ]
+
+
+@pytest.mark.anyio
+async def test_timeline_keeps_pulled_posts_below_threshold(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    other_user: dict,
+    mock_generate_image,
+    run_jobs,
+    mocker,
+):
+    mocker.patch.object(post_router.config, "TIMELINE_FANOUT_MAX_FOLLOWERS", 0)
+    response = await follow(other_user["id"], async_client, logged_in_token)
+    assert response.status_code == 201
+    pulled_post = await create_post(
+        "Pulled Post", async_client, other_user["token"]
+    )
+    await run_jobs()
+
+    # The author drops to the threshold, so new posts are fanned out
+    mocker.patch.object(post_router.config, "TIMELINE_FANOUT_MAX_FOLLOWERS", 1)
+    fanned_out_post = await create_post(
+        "Fanned Out Post", async_client, other_user["token"]
+    )
+    await run_jobs()
+
+    timeline = await get_timeline(async_client, logged_in_token)
+    assert [p["id"] for p in timeline["posts"]] == [
+        fanned_out_post["id"],
+        pulled_post["id"],
+    ]
+
+
+@pytest.mark.anyio
+async def test_timeline_pages(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    other_user: dict,
+    mock_generate_image,
+    run_jobs,
+    mocker,
+):
+    mocker.patch.object(post_router.config, "TIMELINE_FANOUT_MAX_FOLLOWERS", 0)
+    response = await follow(other_user["id"], async_client, logged_in_token)
+    assert response.status_code == 201
+    # Alternating fanned out (own) and pulled (followed) posts
+    posts = [
+        await create_post(
+            f"Post {i}",
+            async_client,
+            logged_in_token if i % 2 else other_user["token"],
+        )
+        for i in range(4)
+    ]
+    await run_jobs()
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        timeline = await get_timeline(async_client, logged_in_token, **params)
+        seen += [p["id"] for p in timeline["posts"]]
+        cursor = timeline["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == [post["id"] for post in reversed(posts)]
+
+
+@pytest.mark.anyio
+async def test_timeline_unauthenticated(async_client: AsyncClient):
+    response = await async_client.get("/timeline")
+    assert response.status_code == 401
@@ -1,11 +1,15 @@
-import contextlib
-import os
+import hashlib
+import io
 import pathlib
-import tempfile
+import time
 
 import pytest
 from httpx import AsyncClient
 
+from social.config import config
+from social.database import blob_table, database, upload_table
+from social.libs.b2 import B2File, b2_api
+
 
 @pytest.fixture
 def sample_image(fs) -> pathlib.Path:
@@ -15,31 +19,13 @@ def sample_image(fs) -> pathlib.Path:
 
 
 @pytest.fixture(autouse=True)
-def mock_b2_upload_file(mocker):
+def mock_b2_upload_stream(mocker):
     return mocker.patch(
-        "social.routers.upload.b2_upload_file",
-        return_value="https://fakeurl.com",
+        "social.routers.upload.b2_upload_stream",
+        return_value=B2File("file-id", 0, "https://fakeurl.com"),
     )
 
 
-@pytest.fixture(autouse=True)
-def aiofiles_mock_open(mocker, fs):
-    mock_open = mocker.patch("aiofiles.open")
-
-    @contextlib.asynccontextmanager
-    async def async_file_open(fname: str, mode: str = "r"):
-        out_fs_mock = mocker.AsyncMock(
-            name=f"async_file_open:{fname!r}/{mode!r}"
-        )
-        with open(fname, mode) as fin:
-            out_fs_mock.read.side_effect = fin.read
-            out_fs_mock.write.side_effect = fin.write
-            yield out_fs_mock
-
-    mock_open.side_effect = async_file_open
-    return mock_open
-
-
 async def call_upload_endpoint(
     async_client: AsyncClient,
     token: str,
@@ -74,16 +60,236 @@ async def test_upload_image_unauthorized(
 
 
 @pytest.mark.anyio
-async def test_temp_file_removed_after_upload(
+async def test_upload_streams_file(
     async_client: AsyncClient,
     logged_in_token: str,
     sample_image: pathlib.Path,
-    mocker,
+    mock_b2_upload_stream,
 ):
-    named_temp_file_spy = mocker.spy(tempfile, "NamedTemporaryFile")
     response = await call_upload_endpoint(
         async_client, logged_in_token, sample_image
     )
     assert response.status_code == 201
-    created_temp_file = named_temp_file_spy.spy_return
-    assert not os.path.exists(created_temp_file.name)
+    read, file_name = mock_b2_upload_stream.call_args.args
+    assert file_name == f"blobs/{hashlib.sha256(b'').hexdigest()}.png"
+    assert callable(read)
+
+
+@pytest.mark.anyio
+async def test_upload_same_content_stored_once(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    mock_b2_upload_stream,
+):
+    for _ in range(2):
+        response = await call_upload_endpoint(
+            async_client, logged_in_token, sample_image
+        )
+        assert response.status_code == 201
+        assert response.json()["file_url"] == "https://fakeurl.com"
+
+    mock_b2_upload_stream.assert_called_once()
+    blobs = await database.fetch_all(blob_table.select())
+    uploads = await database.fetch_all(upload_table.select())
+    assert len(blobs) == 1
+    assert [upload.blob_id for upload in uploads] == [blobs[0].id] * 2
+    assert [upload.name for upload in uploads] == ["myfile.png"] * 2
+
+
+@pytest.mark.anyio
+async def test_upload_different_content_stored_separately(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    mock_b2_upload_stream,
+    fs,
+):
+    other_image = fs.create_file("/other.png", contents="other")
+    await call_upload_endpoint(async_client, logged_in_token, sample_image)
+    await call_upload_endpoint(
+        async_client, logged_in_token, pathlib.Path(other_image.path)
+    )
+
+    assert mock_b2_upload_stream.call_count == 2
+    assert len(await database.fetch_all(blob_table.select())) == 2
+
+
+@pytest.mark.anyio
+async def test_upload_error(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    mock_b2_upload_stream,
+):
+    mock_b2_upload_stream.side_effect = RuntimeError("B2 is down")
+    response = await call_upload_endpoint(
+        async_client, logged_in_token, sample_image
+    )
+    assert response.status_code == 500
+
+
+async def authorize_upload(
+    async_client: AsyncClient, token: str, file_name: str = "myfile.png"
+):
+    return await async_client.post(
+        "/upload/authorize",
+        json={"file_name": file_name},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+
+async def complete_upload(
+    async_client: AsyncClient, token: str, upload_id: int
+):
+    return await async_client.post(
+        f"/upload/{upload_id}/complete",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+
+def upload_to_bucket(authorization: dict, data: bytes = b"image"):
+    # What the client does against B2 itself, here the simulator
+    b2_api().session.raw_api.upload_file(
+        authorization["upload_url"],
+        authorization["authorization_token"],
+        authorization["file_name"],
+        len(data),
+        "b2/x-auto",
+        hashlib.sha1(data).hexdigest(),
+        {},
+        io.BytesIO(data),
+    )
+
+
+@pytest.mark.anyio
+async def test_authorize_upload(
+    async_client: AsyncClient, logged_in_token: str, registered_user: dict
+):
+    response = await authorize_upload(
+        async_client, logged_in_token, "../../other/myfile.png"
+    )
+    assert response.status_code == 201
+    file_name = response.json()["file_name"]
+    assert file_name.startswith(f"uploads/{registered_user['id']}/")
+    assert file_name.endswith("/myfile.png")
+    assert response.json()["upload_url"]
+    assert response.json()["authorization_token"]
+
+
+@pytest.mark.anyio
+async def test_authorize_upload_key_is_scoped(
+    async_client: AsyncClient, logged_in_token: str
+):
+    authorization = (
+        await authorize_upload(async_client, logged_in_token)
+    ).json()
+
+    # The simulator's upload URLs end with the token of the key used
+    simulator = b2_api().session.raw_api
+    token = authorization["upload_url"].rsplit("/", 1)[1]
+    key = simulator.auth_token_to_key[token]
+    name_prefix = authorization["file_name"].rsplit("/", 1)[0] + "/"
+    assert key.name_prefix_or_none == name_prefix
+    assert key.capabilities == ["writeFiles"]
+    assert (
+        key.bucket_id_or_none
+        == b2_api().get_bucket_by_name(config.B2_BUCKET_NAME).id_
+    )
+    assert key.expiration_timestamp_or_none == pytest.approx(
+        time.time() + config.B2_DIRECT_UPLOAD_TTL_SECONDS, abs=5
+    )
+
+
+@pytest.mark.anyio
+async def test_authorize_upload_invalid_file_name(
+    async_client: AsyncClient, logged_in_token: str
+):
+    response = await authorize_upload(async_client, logged_in_token, "a/..")
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_authorize_upload_unauthorized(async_client: AsyncClient):
+    response = await authorize_upload(async_client, "fake_token")
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_complete_upload(
+    async_client: AsyncClient, logged_in_token: str
+):
+    authorization = (
+        await authorize_upload(async_client, logged_in_token)
+    ).json()
+    upload_to_bucket(authorization)
+
+    response = await complete_upload(
+        async_client, logged_in_token, authorization["id"]
+    )
+    assert response.status_code == 201
+    assert response.json()["file_url"]
+
+    upload = await database.fetch_one(
+        upload_table.select().where(upload_table.c.id == authorization["id"])
+    )
+    assert upload.size == len(b"image")
+    assert upload.completed_at is not None
+
+
+@pytest.mark.anyio
+async def test_complete_upload_twice(
+    async_client: AsyncClient, logged_in_token: str
+):
+    authorization = (
+        await authorize_upload(async_client, logged_in_token)
+    ).json()
+    upload_to_bucket(authorization)
+    await complete_upload(async_client, logged_in_token, authorization["id"])
+
+    response = await complete_upload(
+        async_client, logged_in_token, authorization["id"]
+    )
+    assert response.status_code == 409
+
+
+@pytest.mark.anyio
+async def test_complete_upload_not_uploaded(
+    async_client: AsyncClient, logged_in_token: str
+):
+    authorization = (
+        await authorize_upload(async_client, logged_in_token)
+    ).json()
+
+    response = await complete_upload(
+        async_client, logged_in_token, authorization["id"]
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_complete_upload_not_found(
+    async_client: AsyncClient, logged_in_token: str
+):
+    response = await complete_upload(async_client, logged_in_token, 999)
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_complete_upload_expired(
+    async_client: AsyncClient, logged_in_token: str
+):
+    authorization = (
+        await authorize_upload(async_client, logged_in_token)
+    ).json()
+    upload_to_bucket(authorization)
+    await database.execute(
+        upload_table.update()
+        .where(upload_table.c.id == authorization["id"])
+        .values(expires_at=time.time() - 1)
+    )
+
+    response = await complete_upload(
+        async_client, logged_in_token, authorization["id"]
+    )
+    assert response.status_code == 410
@@ -1,7 +1,11 @@
 import pytest
-from fastapi import BackgroundTasks
+import sqlalchemy
 from httpx import AsyncClient
 
+from social import jobs
+from social.database import database, user_table
+from social.tests.helpers import follow
+
 
 async def create_user(email: str, password: str, async_client: AsyncClient):
     return await async_client.post(
@@ -73,7 +77,7 @@ async def test_login_unconfirmed_user(
 
 @pytest.mark.anyio
 async def test_activate_user(async_client: AsyncClient, mocker):
-    spy = mocker.spy(BackgroundTasks, "add_task")
+    spy = mocker.spy(jobs, "enqueue")
     await create_user(
         "test@davidnevin.net",
         "password",
@@ -100,7 +104,7 @@ async def test_activate_user_with_expired_token(
     mocker.patch(
         "social.security.confirmation_token_expire_minutes", return_value=-1
     )
-    spy = mocker.spy(BackgroundTasks, "add_task")
+    spy = mocker.spy(jobs, "enqueue")
     await create_user(
         email,
         "password",
@@ -110,3 +114,93 @@ async def test_activate_user_with_expired_token(
     response = await async_client.get(confirmation_url)
     assert response.status_code == 401
     assert {"detail": "Token has expired"}.items() <= response.json().items()
+
+
+async def follower_count(user_id: int) -> int:
+    return await database.fetch_val(
+        sqlalchemy.select(user_table.c.follower_count).where(
+            user_table.c.id == user_id
+        )
+    )
+
+
+@pytest.mark.anyio
+async def test_follow_user(
+    async_client: AsyncClient,
+    confirmed_user: dict,
+    logged_in_token: str,
+    other_user: dict,
+):
+    response = await follow(other_user["id"], async_client, logged_in_token)
+
+    assert response.status_code == 201
+    assert response.json() == {
+        "id": 1,
+        "follower_id": confirmed_user["id"],
+        "followee_id": other_user["id"],
+    }
+    assert await follower_count(other_user["id"]) == 1
+
+
+@pytest.mark.anyio
+async def test_follow_user_twice(
+    async_client: AsyncClient, logged_in_token: str, other_user: dict
+):
+    await follow(other_user["id"], async_client, logged_in_token)
+
+    response = await follow(other_user["id"], async_client, logged_in_token)
+
+    assert response.status_code == 409
+    assert await follower_count(other_user["id"]) == 1
+
+
+@pytest.mark.anyio
+async def test_follow_yourself(
+    async_client: AsyncClient, confirmed_user: dict, logged_in_token: str
+):
+    response = await follow(
+        confirmed_user["id"], async_client, logged_in_token
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_follow_non_existent_user(
+    async_client: AsyncClient, logged_in_token: str
+):
+    response = await follow(999, async_client, logged_in_token)
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_follow_unauthenticated(
+    async_client: AsyncClient, other_user: dict
+):
+    response = await async_client.post(f"/user/{other_user['id']}/follow")
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_unfollow_user(
+    async_client: AsyncClient, logged_in_token: str, other_user: dict
+):
+    await follow(other_user["id"], async_client, logged_in_token)
+
+    response = await async_client.delete(
+        f"/user/{other_user['id']}/follow",
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 200
+    assert await follower_count(other_user["id"]) == 0
+
+
+@pytest.mark.anyio
+async def test_unfollow_user_not_followed(
+    async_client: AsyncClient, logged_in_token: str, other_user: dict
+):
+    response = await async_client.delete(
+        f"/user/{other_user['id']}/follow",
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 404
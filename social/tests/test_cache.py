@@ -0,0 +1,57 @@
+import pytest
+
+from social.cache import Cache, InMemoryCache, create_cache
+
+
+@pytest.mark.anyio
+async def test_in_memory_cache_get_set():
+    cache = InMemoryCache("test", ttl=60, maxsize=10)
+    assert await cache.get("a") is None
+    await cache.set("a", {"id": 1})
+    assert await cache.get("a") == {"id": 1}
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+@pytest.mark.anyio
+async def test_in_memory_cache_evicts_least_recently_used():
+    cache = InMemoryCache("test", ttl=60, maxsize=2)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    await cache.get("a")
+    await cache.set("c", 3)
+    assert await cache.get("b") is None
+    assert await cache.get("a") == 1
+    assert await cache.get("c") == 3
+
+
+@pytest.mark.anyio
+async def test_in_memory_cache_expires(mocker):
+    monotonic = mocker.patch("social.cache.time.monotonic", return_value=0)
+    cache = InMemoryCache("test", ttl=60, maxsize=10)
+    await cache.set("a", 1)
+    await cache.set("b", 2, ttl=120)
+    monotonic.return_value = 60
+    assert await cache.get("a") is None
+    assert await cache.get("b") == 2
+
+
+@pytest.mark.anyio
+async def test_in_memory_cache_delete():
+    cache = InMemoryCache("test", ttl=60, maxsize=10)
+    await cache.set("a", 1)
+    await cache.delete("a", "missing")
+    assert await cache.get("a") is None
+
+
+def test_create_cache_unsupported_url():
+    with pytest.raises(ValueError):
+        create_cache("test", ttl=60, maxsize=10, url="memcached://localhost")
+
+
+def test_incomplete_cache_backend():
+    class GetOnlyCache(Cache):
+        async def _get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnlyCache("test", ttl=60)
@@ -0,0 +1,252 @@
+import asyncio
+import math
+
+import pytest
+import sqlalchemy
+
+from social.config import config
+from social.database import (
+    Database,
+    ReplicatedDatabase,
+    database_options,
+    metadata,
+    post_table,
+    start_read_routing,
+    user_table,
+)
+
+
+@pytest.mark.anyio
+async def test_pool_stats():
+    db = Database(config.DATABASE_URL)
+    async with db:
+        await db.fetch_val(sqlalchemy.select(1))
+        async with db.connection():
+            assert db.pool_stats()["in_use"] == 1
+
+    stats = db.pool_stats()
+    assert stats["in_use"] == 0
+    assert stats["waiting"] == 0
+    assert stats["acquired"] == 2
+    assert stats["wait_seconds_max"] <= stats["wait_seconds_total"]
+
+
+def test_database_options_sqlite():
+    assert database_options("sqlite:///test.db") == {}
+
+
+def test_database_options_postgres(mocker):
+    mocker.patch.object(config, "DATABASE_STATEMENT_TIMEOUT_MS", 5000)
+
+    options = database_options("postgresql://user@localhost/social")
+
+    assert options["min_size"] == config.DATABASE_POOL_MIN_SIZE
+    assert options["max_size"] == config.DATABASE_POOL_MAX_SIZE
+    assert options["server_settings"] == {"statement_timeout": "5000"}
+    assert "command_timeout" not in options
+
+
+def test_database_options_command_timeout():
+    options = database_options(
+        "postgresql://user@localhost/social", command_timeout=5
+    )
+
+    assert options["command_timeout"] == 5
+
+
+@pytest.fixture()
+def sqlite_url(tmp_path, mocker) -> str:
+    mocker.patch.object(config, "SQLITE_PERFORMANCE_MODE", True)
+    url = f"sqlite:///{tmp_path / 'social.db'}"
+    engine = sqlalchemy.create_engine(url)
+    metadata.create_all(engine)
+    engine.dispose()
+    return url
+
+
+@pytest.mark.anyio
+async def test_sqlite_performance_mode_pragmas(sqlite_url: str):
+    async with Database(sqlite_url) as db:
+        assert await db.fetch_val("PRAGMA journal_mode") == "wal"
+        assert await db.fetch_val("PRAGMA synchronous") == 1
+        assert await db.fetch_val("PRAGMA busy_timeout") == (
+            config.SQLITE_BUSY_TIMEOUT_MS
+        )
+
+
+@pytest.mark.anyio
+async def test_sqlite_performance_mode_concurrent_writes(sqlite_url: str):
+    async with Database(sqlite_url) as db:
+        user_id = await db.execute(
+            user_table.insert().values(email="test@davidnevin.net")
+        )
+
+        async def write(i: int):
+            # Reads before writing, which SQLite refuses ("database is
+            # locked") when two such transactions overlap
+            async with db.transaction():
+                await db.fetch_all(post_table.select())
+                await db.execute(
+                    post_table.insert().values(body=f"{i}", user_id=user_id)
+                )
+
+        async def read():
+            return await db.fetch_all(post_table.select())
+
+        await asyncio.gather(
+            *(write(i) for i in range(20)), *(read() for _ in range(20))
+        )
+
+        assert (
+            await db.fetch_val(
+                sqlalchemy.select(sqlalchemy.func.count(post_table.c.id))
+            )
+            == 20
+        )
+
+
+def _sqlite_database(path, email: str) -> str:
+    url = f"sqlite:///{path}"
+    engine = sqlalchemy.create_engine(url)
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(user_table.insert().values(email=email))
+    engine.dispose()
+    return url
+
+
+@pytest.fixture()
+async def replicated(tmp_path):
+    # Separate files with different rows stand in for a primary and a
+    # replica, so the email read back tells which one answered.
+    primary = _sqlite_database(tmp_path / "primary.db", "primary")
+    replica = _sqlite_database(tmp_path / "replica.db", "replica")
+    start_read_routing()
+    async with ReplicatedDatabase(primary, replica_urls=[replica]) as db:
+        yield db
+
+
+async def _read_email(db: ReplicatedDatabase) -> str:
+    return await db.fetch_val(sqlalchemy.select(user_table.c.email))
+
+
+@pytest.mark.anyio
+async def test_replicated_reads_go_to_replica(replicated: ReplicatedDatabase):
+    assert await _read_email(replicated) == "replica"
+    assert replicated.replica_stats()[0]["healthy"]
+
+
+@pytest.mark.anyio
+async def test_replicated_reads_own_writes(replicated: ReplicatedDatabase):
+    await replicated.execute(
+        user_table.update().values(email="primary@davidnevin.net")
+    )
+
+    assert replicated.pinned_to_primary()
+    assert await _read_email(replicated) == "primary@davidnevin.net"
+
+
+@pytest.mark.anyio
+async def test_replicated_write_returning_goes_to_primary(
+    replicated: ReplicatedDatabase,
+):
+    row = await replicated.fetch_one(
+        user_table.insert()
+        .values(email="new@davidnevin.net")
+        .returning(user_table.c.id)
+    )
+
+    assert row.id == 2
+    assert replicated.pinned_to_primary()
+
+
+@pytest.mark.anyio
+async def test_replicated_stickiness_expires(
+    replicated: ReplicatedDatabase, mocker
+):
+    mocker.patch.object(config, "REPLICA_STICKY_SECONDS", 0)
+    await replicated.execute(user_table.update().values(email="primary"))
+
+    assert await _read_email(replicated) == "replica"
+
+
+@pytest.mark.anyio
+async def test_replicated_transaction_reads_primary(
+    replicated: ReplicatedDatabase, mocker
+):
+    mocker.patch.object(config, "REPLICA_STICKY_SECONDS", 0)
+
+    async with replicated.transaction():
+        assert replicated.in_transaction()
+        assert await _read_email(replicated) == "primary"
+    assert await _read_email(replicated) == "replica"
+
+
+@pytest.mark.anyio
+async def test_replicated_lagging_replica_falls_back_to_primary(
+    replicated: ReplicatedDatabase, mocker
+):
+    mocker.patch(
+        "social.database.replica_lag",
+        return_value=config.REPLICA_MAX_LAG_SECONDS + 1,
+    )
+    await replicated.check_replicas()
+
+    assert await _read_email(replicated) == "primary"
+    assert not replicated.replica_stats()[0]["healthy"]
+
+
+@pytest.mark.anyio
+async def test_replicated_unresponsive_replica_falls_back_to_primary(
+    replicated: ReplicatedDatabase, mocker
+):
+    async def hang(replica):
+        await asyncio.sleep(60)
+
+    mocker.patch("social.database.replica_lag", side_effect=hang)
+    mocker.patch.object(config, "REPLICA_CHECK_TIMEOUT_SECONDS", 0.01)
+    await replicated.check_replicas()
+
+    assert replicated.replica_stats()[0]["lag_seconds"] is None
+    assert await _read_email(replicated) == "primary"
+
+
+@pytest.mark.anyio
+async def test_replicated_failed_replica_falls_back_to_primary(
+    replicated: ReplicatedDatabase,
+):
+    await replicated.replicas[0].execute("DROP TABLE users")
+
+    assert await _read_email(replicated) == "primary"
+    assert replicated.replica_stats()[0]["lag_seconds"] is None
+
+    # Until the next check finds it working again
+    await replicated.check_replicas()
+    assert replicated.replica_stats()[0]["lag_seconds"] == 0
+
+
+@pytest.mark.anyio
+async def test_replicated_failed_replica_iterate_falls_back_to_primary(
+    replicated: ReplicatedDatabase,
+):
+    await replicated.replicas[0].execute("DROP TABLE users")
+
+    emails = [
+        record.email
+        async for record in replicated.iterate(
+            sqlalchemy.select(user_table.c.email)
+        )
+    ]
+    assert emails == ["primary"]
+    assert replicated.replica_stats()[0]["lag_seconds"] is None
+
+
+@pytest.mark.anyio
+async def test_replicated_unreachable_replica(tmp_path):
+    primary = _sqlite_database(tmp_path / "primary.db", "primary")
+    replica = f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"
+    start_read_routing()
+
+    async with ReplicatedDatabase(primary, replica_urls=[replica]) as db:
+        assert math.isinf(db._lags[0])
+        assert await _read_email(db) == "primary"
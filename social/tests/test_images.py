@@ -0,0 +1,48 @@
+import io
+
+from PIL import Image
+
+from social.images import render_variants
+
+
+def image_bytes(width: int, height: int, mode: str = "RGB") -> bytes:
+    output = io.BytesIO()
+    Image.new(mode, (width, height)).save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_render_variants():
+    variants = render_variants(image_bytes(1600, 800))
+
+    assert [
+        (variant.kind, variant.format, variant.width, variant.height)
+        for variant in variants
+    ] == [
+        ("thumbnail", "webp", 160, 160),
+        ("thumbnail", "avif", 160, 160),
+        ("responsive", "webp", 320, 160),
+        ("responsive", "avif", 320, 160),
+        ("responsive", "webp", 640, 320),
+        ("responsive", "avif", 640, 320),
+        ("responsive", "webp", 1080, 540),
+        ("responsive", "avif", 1080, 540),
+    ]
+    for variant in variants:
+        with Image.open(io.BytesIO(variant.data)) as image:
+            assert image.format == variant.format.upper()
+            assert image.size == (variant.width, variant.height)
+
+
+def test_render_variants_does_not_upscale():
+    variants = render_variants(image_bytes(500, 100))
+
+    assert sorted(
+        {variant.width for variant in variants if variant.kind != "thumbnail"}
+    ) == [320, 500]
+
+
+def test_render_variants_keeps_transparency():
+    variants = render_variants(image_bytes(200, 200, mode="RGBA"))
+
+    with Image.open(io.BytesIO(variants[0].data)) as image:
+        assert "A" in image.getbands()
@@ -0,0 +1,107 @@
+import time
+
+import pytest
+from databases import Database
+
+from social import jobs
+from social.config import config
+from social.database import dead_letter_job_table, job_table
+
+
+@pytest.fixture()
+def mock_send_email(mocker):
+    return mocker.patch(
+        "social.tasks.send_user_registration_email", return_value=None
+    )
+
+
+@pytest.mark.anyio
+async def test_enqueue_and_run(db: Database, mock_send_email):
+    await jobs.enqueue(
+        "send_user_registration_email",
+        to="test@davidnevin.net",
+        confirmation_url="http://test/confirm",
+    )
+
+    assert await jobs.Worker(db, {}).run_pending() == 1
+    mock_send_email.assert_awaited_once_with(
+        "test@davidnevin.net", "http://test/confirm"
+    )
+    assert await db.fetch_all(job_table.select()) == []
+
+
+@pytest.mark.anyio
+async def test_enqueue_unknown_kind():
+    with pytest.raises(ValueError):
+        await jobs.enqueue("unknown")
+
+
+@pytest.mark.anyio
+async def test_claimed_job_is_not_claimed_again(db: Database):
+    await jobs.enqueue(
+        "send_user_registration_email", to="a@b.net", confirmation_url="/"
+    )
+    worker = jobs.Worker(db, {})
+
+    job = await worker.claim("send_user_registration_email")
+    assert job.attempts == 1
+    assert job.run_at > time.time()
+    assert await worker.claim("send_user_registration_email") is None
+
+
+@pytest.mark.anyio
+async def test_failed_job_is_retried_with_backoff(
+    db: Database, mock_send_email
+):
+    mock_send_email.side_effect = RuntimeError("Mailgun is down")
+    await jobs.enqueue(
+        "send_user_registration_email", to="a@b.net", confirmation_url="/"
+    )
+
+    before = time.time()
+    assert await jobs.Worker(db, {}).run_pending() == 1
+
+    job = await db.fetch_one(job_table.select())
+    assert job.attempts == 1
+    assert job.run_at >= before + config.JOB_RETRY_BACKOFF_SECONDS
+    assert job.last_error == "RuntimeError: Mailgun is down"
+
+
+def test_retry_delay_backs_off_exponentially():
+    delays = [jobs.retry_delay(attempts) for attempts in range(1, 4)]
+    base = config.JOB_RETRY_BACKOFF_SECONDS
+    assert delays == [base, base * 2, base * 4]
+
+
+@pytest.mark.anyio
+async def test_job_moved_to_dead_letter(db: Database, mock_send_email, mocker):
+    mocker.patch.object(config, "JOB_RETRY_BACKOFF_SECONDS", 0)
+    mock_send_email.side_effect = RuntimeError("Mailgun is down")
+    await jobs.enqueue(
+        "send_user_registration_email", to="a@b.net", confirmation_url="/"
+    )
+
+    assert await jobs.Worker(db, {}).run_pending() == config.JOB_MAX_ATTEMPTS
+
+    assert await db.fetch_all(job_table.select()) == []
+    dead_job = await db.fetch_one(dead_letter_job_table.select())
+    assert dead_job.kind == "send_user_registration_email"
+    assert dead_job.payload == {"to": "a@b.net", "confirmation_url": "/"}
+    assert dead_job.attempts == config.JOB_MAX_ATTEMPTS
+
+
+@pytest.mark.anyio
+async def test_consumer_survives_failed_execute(db: Database, mocker):
+    await jobs.enqueue(
+        "send_user_registration_email", to="a@b.net", confirmation_url="/"
+    )
+    worker = jobs.Worker(db, {})
+
+    def fail(job):
+        worker.stop()
+        raise RuntimeError("Database is gone")
+
+    mocker.patch.object(worker, "execute", side_effect=fail)
+
+    await worker._consume("send_user_registration_email")
+    worker.execute.assert_awaited_once()
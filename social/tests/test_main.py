@@ -0,0 +1,45 @@
+import time
+
+import pytest
+from fastapi import Request, Response
+
+from social.config import config
+from social.database import _read_routing
+from social.main import READ_PRIMARY_COOKIE, read_your_writes
+
+
+async def routed_primary_until(cookie: str) -> float:
+    request = Request(
+        {
+            "type": "http",
+            "headers": [
+                (b"cookie", f"{READ_PRIMARY_COOKIE}={cookie}".encode())
+            ],
+        }
+    )
+    primary_until = None
+
+    async def call_next(request: Request) -> Response:
+        nonlocal primary_until
+        primary_until = _read_routing.get().primary_until
+        return Response()
+
+    await read_your_writes(request, call_next)
+    return primary_until
+
+
+@pytest.mark.anyio
+async def test_read_your_writes_cookie():
+    primary_until = time.time() + 1
+
+    assert await routed_primary_until(str(primary_until)) == primary_until
+
+
+@pytest.mark.anyio
+async def test_read_your_writes_cookie_is_capped():
+    before = time.time()
+
+    primary_until = await routed_primary_until("1e12")
+
+    assert primary_until <= time.time() + config.REPLICA_STICKY_SECONDS
+    assert primary_until >= before + config.REPLICA_STICKY_SECONDS
@@ -0,0 +1,95 @@
+import pathlib
+
+import pytest
+import sqlalchemy
+
+from social.migrations import upgrade
+
+# The schema as it was before like/comment counters and indexes existed.
+LEGACY_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER PRIMARY KEY, email VARCHAR UNIQUE,
+        password VARCHAR, is_active BOOLEAN)""",
+    """CREATE TABLE posts (
+        id INTEGER PRIMARY KEY, body VARCHAR,
+        user_id INTEGER NOT NULL REFERENCES users (id), image_url VARCHAR)""",
+    """CREATE TABLE comments (
+        id INTEGER PRIMARY KEY, body VARCHAR,
+        post_id INTEGER NOT NULL REFERENCES posts (id),
+        user_id INTEGER NOT NULL REFERENCES users (id))""",
+    """CREATE TABLE likes (
+        id INTEGER PRIMARY KEY,
+        post_id INTEGER NOT NULL REFERENCES posts (id),
+        user_id INTEGER NOT NULL REFERENCES users (id))""",
+    "INSERT INTO users (id, email, password) VALUES (1, 'a@b.net', 'x')",
+    "INSERT INTO posts (id, body, user_id) VALUES (1, 'Test Post', 1)",
+    "INSERT INTO likes (id, post_id, user_id) VALUES (1, 1, 1), (2, 1, 1)",
+]
+
+
+@pytest.fixture()
+def legacy_engine(tmp_path: pathlib.Path) -> sqlalchemy.engine.Engine:
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(sqlalchemy.text(statement))
+    yield engine
+    engine.dispose()
+
+
+def test_upgrade_legacy_database(legacy_engine: sqlalchemy.engine.Engine):
+    upgrade(legacy_engine)
+
+    inspector = sqlalchemy.inspect(legacy_engine)
+    post_columns = {c["name"] for c in inspector.get_columns("posts")}
+    assert {"like_count", "comment_count"} <= post_columns
+    like_indexes = {i["name"]: i for i in inspector.get_indexes("likes")}
+    assert like_indexes["ix_likes_post_id_user_id"]["unique"]
+    assert "ix_comments_post_id_id" in {
+        i["name"] for i in inspector.get_indexes("comments")
+    }
+    assert "ix_posts_user_id_pulled_id" in {
+        i["name"] for i in inspector.get_indexes("posts")
+    }
+
+    with legacy_engine.connect() as connection:
+        likes = connection.execute(sqlalchemy.text("SELECT id FROM likes"))
+        assert likes.scalars().all() == [1]
+        post = connection.execute(sqlalchemy.text("SELECT * FROM posts"))
+        assert post.mappings().one()["like_count"] == 0
+
+
+def test_upgrade_creates_counter_triggers(
+    legacy_engine: sqlalchemy.engine.Engine,
+):
+    upgrade(legacy_engine)
+
+    with legacy_engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO comments (body, post_id, user_id) "
+                "VALUES ('Test Comment', 1, 1)"
+            )
+        )
+        post = connection.execute(sqlalchemy.text("SELECT * FROM posts"))
+        assert post.mappings().one()["comment_count"] == 1
+
+
+def test_upgrade_is_idempotent(legacy_engine: sqlalchemy.engine.Engine):
+    upgrade(legacy_engine)
+    upgrade(legacy_engine)
+
+
+def test_upgrade_backfills_own_timelines(
+    legacy_engine: sqlalchemy.engine.Engine,
+):
+    upgrade(legacy_engine)
+    upgrade(legacy_engine)
+
+    with legacy_engine.connect() as connection:
+        entries = connection.execute(
+            sqlalchemy.text(
+                "SELECT user_id, post_id, author_id FROM timeline_entries"
+            )
+        )
+        assert entries.all() == [(1, 1, 1)]
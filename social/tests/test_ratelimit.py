@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+
+from social.ratelimit import RateLimiter
+
+
+@pytest.mark.anyio
+async def test_rate_limiter_caps_concurrency():
+    limiter = RateLimiter(concurrency=2, rate=1000, burst=10)
+    running = 0
+    max_running = 0
+
+    async def work():
+        nonlocal running, max_running
+        async with limiter:
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*(work() for _ in range(6)))
+    assert max_running == 2
+
+
+@pytest.mark.anyio
+async def test_rate_limiter_spaces_out_starts():
+    limiter = RateLimiter(concurrency=10, rate=20, burst=1)
+    starts = []
+
+    async def work():
+        async with limiter:
+            starts.append(time.monotonic())
+
+    await asyncio.gather(*(work() for _ in range(3)))
+    # The first start uses the burst token, the others wait 1/20s each
+    assert starts[-1] - starts[0] >= 2 / 20 * 0.9
+
+
+@pytest.mark.anyio
+async def test_rate_limiter_allows_burst():
+    limiter = RateLimiter(concurrency=10, rate=0.01, burst=3)
+    start = time.monotonic()
+    for _ in range(3):
+        async with limiter:
+            pass
+    assert time.monotonic() - start < 0.5
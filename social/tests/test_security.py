@@ -1,3 +1,5 @@
+import asyncio
+import time
 from typing import Optional
 
 import pytest
@@ -119,6 +121,47 @@ def test_get_email_for_token_wrong_type():
     assert exc_info.value.detail == "Token is of invalid type, expected access"
 
 
+def test_get_email_for_token_type_uses_decode_cache(mocker):
+    email = "test@davidnevin.net"
+    token = security.create_access_token(email)
+    security.get_email_for_token_type(token, "access")
+
+    decode_spy = mocker.spy(security.jwt, "decode")
+    assert security.get_email_for_token_type(token, "access") == email
+    decode_spy.assert_not_called()
+
+    with pytest.raises(security.fastapi.HTTPException) as exc_info:
+        security.get_email_for_token_type(token, "confirmation")
+    assert (
+        exc_info.value.detail
+        == "Token is of invalid type, expected confirmation"
+    )
+
+
+def test_decode_cache_honours_expiry(mocker):
+    token = security.create_access_token("test@davidnevin.net")
+    security.get_email_for_token_type(token, "access")
+
+    mocker.patch(
+        "social.security.time.time",
+        return_value=time.time()
+        + 60 * security.access_token_expire_minutes()
+        + 1,
+    )
+    assert security.decoded_token_cache.get(token) is None
+
+
+def test_decode_cache_disabled(mocker):
+    mocker.patch.object(security.config, "JWT_DECODE_CACHE_ENABLED", False)
+    email = "test@davidnevin.net"
+    token = security.create_access_token(email)
+    security.get_email_for_token_type(token, "access")
+
+    decode_spy = mocker.spy(security.jwt, "decode")
+    assert security.get_email_for_token_type(token, "access") == email
+    decode_spy.assert_called_once()
+
+
 @pytest.mark.slow(reason="Slow test")
 def test_password_hashes():
     password = "secret"
@@ -126,6 +169,31 @@ def test_password_hashes():
     assert security.verify_password(password, hashed_password)
 
 
+@pytest.mark.anyio
+async def test_password_hashes_async():
+    password = "secret"
+    hashed_password = await security.get_password_hash_async(password)
+    assert await security.verify_password_async(password, hashed_password)
+    assert not await security.verify_password_async("wrong", hashed_password)
+
+
+@pytest.mark.anyio
+async def test_password_hash_queue_full(mocker):
+    mocker.patch.object(security.config, "PASSWORD_HASH_WORKERS", 1)
+    mocker.patch.object(security.config, "PASSWORD_HASH_MAX_QUEUE", 1)
+    mocker.patch.object(
+        security, "get_password_hash", side_effect=lambda p: time.sleep(0.2)
+    )
+
+    results = await asyncio.gather(
+        *(security.get_password_hash_async("secret") for _ in range(3)),
+        return_exceptions=True,
+    )
+    errors = [r for r in results if isinstance(r, Exception)]
+    assert len(errors) == 1
+    assert errors[0].status_code == 503
+
+
 @pytest.mark.anyio
 async def test_get_user(registered_user: dict):
     user: Optional[Record] = await security.get_user(registered_user["email"])
@@ -173,6 +241,34 @@ async def test_get_current_user(registered_user: dict):
     assert user.email == registered_user["email"]
 
 
+@pytest.mark.anyio
+async def test_get_current_user_is_cached(registered_user: dict, mocker):
+    token = security.create_access_token(registered_user["email"])
+    await security.get_current_user(token)
+
+    get_user_spy = mocker.spy(security, "get_user")
+    user = await security.get_current_user(token)
+    assert user.id == registered_user["id"]
+    get_user_spy.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_invalidate_cached_user(registered_user: dict, mocker):
+    token = security.create_access_token(registered_user["email"])
+    user = await security.get_current_user(token)
+    assert not user.is_active
+
+    await security.database.execute(
+        security.user_table.update()
+        .where(security.user_table.c.email == registered_user["email"])
+        .values(is_active=True)
+    )
+    await security.invalidate_cached_user(registered_user["email"])
+
+    user = await security.get_current_user(token)
+    assert user.is_active
+
+
 @pytest.mark.anyio
 async def test_get_current_user_invalid_token():
     with pytest.raises(security.fastapi.HTTPException):
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+from httpx import AsyncClient
+
+from social.config import config
+from social.database import database, post_table
+from social.models.post import UserPostPage, UserPostWithComments
+from social.routers.post import select_post_with_likes
+from social.serialization import fast_json, validated_json
+
+
+@pytest.fixture()
+async def post_rows(created_post: dict) -> list:
+    await database.execute(
+        post_table.update().values(
+            image_variants=[
+                {
+                    "kind": "thumbnail",
+                    "format": "webp",
+                    "width": 160,
+                    "height": 90,
+                    "url": "https://example.com/thumb.webp",
+                }
+            ]
+        )
+    )
+    await database.execute(
+        post_table.insert().values(body="No image", user_id=1)
+    )
+    return await database.fetch_all(
+        select_post_with_likes.order_by(post_table.c.id)
+    )
+
+
+@pytest.mark.anyio
+async def test_fast_json_matches_validated_json(post_rows: list):
+    content = {"posts": post_rows, "next_cursor": "abc"}
+
+    fast = json.loads(fast_json(UserPostPage, content))
+
+    assert fast == json.loads(validated_json(UserPostPage, content))
+    assert fast["posts"][0]["image_variants"][0]["width"] == 160
+    assert fast["posts"][1]["image_variants"] is None
+
+
+@pytest.mark.anyio
+async def test_fast_json_defaults(post_rows: list):
+    # next_comment_cursor missing, as a builder may leave it out
+    content = {"post": post_rows[0], "comments": [], "comment_count": 0}
+
+    assert json.loads(fast_json(UserPostWithComments, content)) == json.loads(
+        validated_json(UserPostWithComments, content)
+    )
+
+
+@pytest.mark.anyio
+async def test_fast_json_responses(
+    async_client: AsyncClient, post_rows: list, mocker
+):
+    expected = await async_client.get("/post")
+    mocker.patch.object(config, "FAST_JSON_RESPONSES", True)
+
+    # Another page size, so the response isn't served from the cache
+    response = await async_client.get("/post", params={"limit": 19})
+
+    assert response.json() == expected.json()
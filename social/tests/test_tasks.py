@@ -1,17 +1,37 @@
+import io
 from unittest.mock import AsyncMock, Mock
 
 import httpx
 import pytest
+import sqlalchemy
 from databases import Database
+from PIL import Image
 
 from social.config import config
-from social.database import post_table
+from social.database import post_table, user_table
+from social.libs.b2 import B2File, b2_api, b2_download_url
 from social.tasks import (
     APIResponseException,
+    _chunk_reader,
     _generate_image_api,
+    backfill_post_images,
+    close_http_client,
+    close_openai_client,
     generate_image_and_add_to_post,
+    get_http_client,
+    get_openai_client,
+    persist_image,
+    process_post_image,
+    reconcile_follower_counts,
+    reconcile_post_counts,
     send_simple_email,
 )
+from social.tests.helpers import (
+    create_comment,
+    create_post,
+    follow,
+    like_post,
+)
 
 
 @pytest.mark.anyio
@@ -36,6 +56,31 @@ async def test_send_simple_email_with_error(
         )
 
 
+@pytest.mark.anyio
+async def test_send_simple_email_with_client():
+    client = Mock()
+    client.post = AsyncMock(
+        return_value=httpx.Response(
+            status_code=200, content="", request=httpx.Request("POST", "//")
+        )
+    )
+    await send_simple_email(
+        "test@davidnevin.net", "Test subject", "Test body", client=client
+    )
+    client.post.assert_awaited_once()
+
+
+@pytest.mark.anyio
+async def test_http_client_is_shared():
+    client = get_http_client()
+    assert get_http_client() is client
+
+    await close_http_client()
+    assert client.is_closed
+    assert get_http_client() is not client
+    await close_http_client()
+
+
 mock_response = {"data": [{"url": "https://example.com/image.png"}]}
 
 
@@ -50,7 +95,8 @@ async def test_generate_image_api(mocker):
         "data": [{"url": "https://example.com/image.png"}]
     }
 
-    mock_openai_client = mocker.patch("social.tasks.AsyncOpenAI")
+    mocker.patch("social.tasks._openai_client", None)
+    mock_openai_client = mocker.patch("openai.AsyncOpenAI")
     mock_openai_client.return_value.images.generate = AsyncMock(
         return_value=mock_response
     )
@@ -68,13 +114,63 @@ async def test_generate_image_api(mocker):
     )
 
 
+@pytest.mark.anyio
+async def test_generate_image_api_rejected(mocker):
+    import openai
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/images")
+    mocker.patch("social.tasks._openai_client", None)
+    mock_openai_client = mocker.patch("openai.AsyncOpenAI")
+    mock_openai_client.return_value.images.generate = AsyncMock(
+        side_effect=openai.BadRequestError(
+            "Invalid prompt",
+            response=httpx.Response(400, request=request),
+            body=None,
+        )
+    )
+
+    with pytest.raises(APIResponseException, match="status code 400"):
+        await _generate_image_api(prompt="Test prompt")
+
+
+@pytest.mark.anyio
+async def test_generate_image_api_connection_error_is_raised(mocker):
+    import openai
+
+    request = httpx.Request("POST", "https://api.openai.com/v1/images")
+    mocker.patch("social.tasks._openai_client", None)
+    mock_openai_client = mocker.patch("openai.AsyncOpenAI")
+    mock_openai_client.return_value.images.generate = AsyncMock(
+        side_effect=openai.APIConnectionError(request=request)
+    )
+
+    with pytest.raises(openai.APIConnectionError):
+        await _generate_image_api(prompt="Test prompt")
+
+
+@pytest.mark.anyio
+async def test_openai_client_is_shared(mocker):
+    mocker.patch.object(config, "OPENAI_API_KEY", "test-key")
+    client = get_openai_client()
+    assert get_openai_client() is client
+
+    await close_openai_client()
+    assert get_openai_client() is not client
+    await close_openai_client()
+
+
 @pytest.mark.anyio
 async def test_generate_and_add_to_post_success(
     db: Database,
-    created_post: dict,
+    async_client: httpx.AsyncClient,
     confirmed_user: dict,
+    logged_in_token: str,
     mocker,
 ):
+    # Not created_post, whose image the job has already generated
+    created_post = await create_post(
+        "Test Post", async_client, logged_in_token
+    )
     mock_response = {"data": [{"url": "https://example.com/image.png"}]}
 
     mocker.patch(
@@ -90,4 +186,295 @@ async def test_generate_and_add_to_post_success(
     )
     query = post_table.select().where(post_table.c.id == created_post["id"])
     updated_post = await db.fetch_one(query)
-    assert updated_post.image_url == json_data["data"][0]["url"]
+    assert updated_post.image_url != json_data["data"][0]["url"]
+    assert updated_post.image_url.startswith(await b2_download_url())
+
+
+@pytest.mark.anyio
+async def test_generate_and_add_to_post_skips_existing_image(
+    db: Database,
+    created_post: dict,
+    confirmed_user: dict,
+    mock_generate_image,
+    mock_httpx_client,
+):
+    assert created_post["image_url"] is not None
+    mock_generate_image.reset_mock()
+
+    await generate_image_and_add_to_post(
+        email=confirmed_user["email"],
+        post_id=created_post["id"],
+        post_url="/post/1",
+        database=db,
+        prompt="a fictional cartoon character from the 90's",
+    )
+
+    mock_generate_image.assert_not_called()
+    mock_httpx_client.post.assert_called()
+
+
+async def generate_for(post_id: int, db: Database, email: str):
+    return await generate_image_and_add_to_post(
+        email=email,
+        post_id=post_id,
+        post_url=f"/post/{post_id}",
+        database=db,
+        prompt="a fictional cartoon character from the 90's",
+    )
+
+
+@pytest.mark.anyio
+async def test_generate_and_add_to_post_retry_only_copies(
+    db: Database,
+    async_client: httpx.AsyncClient,
+    confirmed_user: dict,
+    logged_in_token: str,
+    mock_generate_image,
+    mocker,
+):
+    post = await create_post("Test Post", async_client, logged_in_token)
+    generated_url = mock_generate_image.return_value["data"][0]["url"]
+    persisted = B2File("file-id", 5, f"{await b2_download_url()}/posts/1")
+    mock_persist_image = mocker.patch(
+        "social.tasks.persist_image",
+        side_effect=[RuntimeError("B2 is down"), persisted],
+    )
+    query = sqlalchemy.select(post_table.c.image_url).where(
+        post_table.c.id == post["id"]
+    )
+
+    with pytest.raises(RuntimeError):
+        await generate_for(post["id"], db, confirmed_user["email"])
+    assert await db.fetch_val(query) == generated_url
+
+    await generate_for(post["id"], db, confirmed_user["email"])
+    mock_generate_image.assert_awaited_once()
+    assert [call.args[0] for call in mock_persist_image.call_args_list] == [
+        generated_url,
+        generated_url,
+    ]
+    assert await db.fetch_val(query) == persisted.download_url
+
+
+@pytest.mark.anyio
+async def test_generate_and_add_to_post_expired_image(
+    db: Database,
+    async_client: httpx.AsyncClient,
+    confirmed_user: dict,
+    logged_in_token: str,
+    mock_generate_image,
+    mocker,
+):
+    post = await create_post("Test Post", async_client, logged_in_token)
+    request = httpx.Request("GET", "https://test.com/image.png")
+    mocker.patch(
+        "social.tasks.persist_image",
+        side_effect=httpx.HTTPStatusError(
+            "Forbidden",
+            request=request,
+            response=httpx.Response(403, request=request),
+        ),
+    )
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await generate_for(post["id"], db, confirmed_user["email"])
+
+    # So that the next attempt generates the image again
+    query = sqlalchemy.select(post_table.c.image_url).where(
+        post_table.c.id == post["id"]
+    )
+    assert await db.fetch_val(query) is None
+
+
+@pytest.mark.anyio
+async def test_chunk_reader():
+    async def chunks():
+        for chunk in (b"abc", b"de", b"fghij"):
+            yield chunk
+
+    read = _chunk_reader(chunks())
+
+    assert [await read(4), await read(4), await read(4)] == [
+        b"abcd",
+        b"efgh",
+        b"ij",
+    ]
+    assert await read(4) == b""
+
+
+def downloaded(file_id: str) -> bytes:
+    output = io.BytesIO()
+    bucket = b2_api().get_bucket_by_name(config.B2_BUCKET_NAME)
+    bucket.download_file_by_id(file_id).save(output)
+    return output.getvalue()
+
+
+@pytest.mark.anyio
+async def test_persist_image(mock_httpx_client):
+    persisted_image = await persist_image(
+        "https://example.com/image.png", "posts/1/image.png"
+    )
+
+    request = mock_httpx_client.build_request.return_value
+    mock_httpx_client.build_request.assert_called_with(
+        "GET", "https://example.com/image.png"
+    )
+    mock_httpx_client.send.assert_called_with(request, stream=True)
+    assert downloaded(persisted_image.file_id) == b"image"
+
+
+@pytest.mark.anyio
+async def test_persist_image_download_error(mock_httpx_client):
+    mock_httpx_client.send.return_value = httpx.Response(
+        status_code=403, content="", request=httpx.Request("GET", "//")
+    )
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await persist_image("https://example.com/image.png", "image.png")
+
+
+@pytest.mark.anyio
+async def test_backfill_post_images(
+    db: Database,
+    created_post: dict,
+    async_client: httpx.AsyncClient,
+    logged_in_token: str,
+    mock_httpx_client,
+):
+    external_post = await create_post(
+        "External", async_client, logged_in_token
+    )
+    query = (
+        post_table.update()
+        .where(post_table.c.id == external_post["id"])
+        .values(image_url="https://example.com/image.png")
+    )
+    await db.execute(query)
+
+    assert await backfill_post_images(db) == [external_post["id"]]
+
+    mock_httpx_client.build_request.assert_called_with(
+        "GET", "https://example.com/image.png"
+    )
+    query = sqlalchemy.select(post_table.c.image_url).where(
+        post_table.c.id == external_post["id"]
+    )
+    assert (await db.fetch_val(query)).startswith(await b2_download_url())
+    assert await backfill_post_images(db) == []
+
+
+@pytest.mark.anyio
+async def test_backfill_post_images_download_error(
+    db: Database, created_post: dict, mock_httpx_client
+):
+    query = (
+        post_table.update()
+        .where(post_table.c.id == created_post["id"])
+        .values(image_url="https://example.com/expired.png")
+    )
+    await db.execute(query)
+    mock_httpx_client.send.return_value = httpx.Response(
+        status_code=403, content="", request=httpx.Request("GET", "//")
+    )
+
+    assert await backfill_post_images(db) == []
+
+    query = sqlalchemy.select(post_table.c.image_url).where(
+        post_table.c.id == created_post["id"]
+    )
+    assert await db.fetch_val(query) == "https://example.com/expired.png"
+
+
+@pytest.mark.anyio
+async def test_process_post_image(
+    db: Database, created_post: dict, mock_httpx_client
+):
+    image = io.BytesIO()
+    Image.new("RGB", (400, 200)).save(image, format="PNG")
+    mock_httpx_client.get.return_value = httpx.Response(
+        status_code=200,
+        content=image.getvalue(),
+        request=httpx.Request("GET", "//"),
+    )
+
+    await process_post_image(created_post["id"], db)
+
+    mock_httpx_client.get.assert_called_with(created_post["image_url"])
+    query = post_table.select().where(post_table.c.id == created_post["id"])
+    post = await db.fetch_one(query)
+    sizes = {
+        (variant["kind"], variant["width"], variant["height"])
+        for variant in post.image_variants
+    }
+    assert sizes == {
+        ("thumbnail", 160, 160),
+        ("responsive", 320, 160),
+        ("responsive", 400, 200),
+    }
+    assert {variant["format"] for variant in post.image_variants} == {
+        "webp",
+        "avif",
+    }
+    assert all(variant["url"] for variant in post.image_variants)
+
+
+@pytest.mark.anyio
+async def test_process_post_image_without_image(
+    db: Database,
+    async_client: httpx.AsyncClient,
+    logged_in_token: str,
+    mock_httpx_client,
+):
+    post = await create_post("Test Post", async_client, logged_in_token)
+
+    await process_post_image(post["id"], db)
+
+    mock_httpx_client.get.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_reconcile_post_counts(
+    db: Database,
+    async_client: httpx.AsyncClient,
+    created_post: dict,
+    logged_in_token: str,
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+    await create_comment(
+        "Test Comment", created_post["id"], async_client, logged_in_token
+    )
+    query = post_table.select().where(post_table.c.id == created_post["id"])
+    post = await db.fetch_one(query)
+    assert (post.like_count, post.comment_count) == (1, 1)
+
+    await db.execute(
+        post_table.update()
+        .where(post_table.c.id == created_post["id"])
+        .values(like_count=7, comment_count=0)
+    )
+    assert await reconcile_post_counts(db) == 1
+
+    post = await db.fetch_one(query)
+    assert (post.like_count, post.comment_count) == (1, 1)
+    assert await reconcile_post_counts(db) == 0
+
+
+@pytest.mark.anyio
+async def test_reconcile_follower_counts(
+    db: Database,
+    async_client: httpx.AsyncClient,
+    logged_in_token: str,
+    other_user: dict,
+):
+    await follow(other_user["id"], async_client, logged_in_token)
+    query = user_table.select().where(user_table.c.id == other_user["id"])
+    await db.execute(
+        user_table.update()
+        .where(user_table.c.id == other_user["id"])
+        .values(follower_count=7)
+    )
+    assert await reconcile_follower_counts(db) == 1
+
+    user = await db.fetch_one(query)
+    assert user.follower_count == 1
+    assert await reconcile_follower_counts(db) == 0
@@ -0,0 +1,130 @@
+import logging
+
+import sqlalchemy
+from databases import Database
+
+from social.config import config
+from social.database import (
+    follow_table,
+    post_table,
+    timeline_table,
+    user_table,
+)
+
+logger = logging.getLogger(__name__)
+
+# Writes to the materialized home timelines of timeline_table. The
+# reading side, which merges in the posts too widely followed to fan
+# out, is routers.post.find_timeline.
+#
+# Whether a post is pulled is decided once, when it is fanned out, and
+# recorded in posts.pulled. Deciding again from the author's current
+# follower_count would lose the posts made on the other side of the
+# threshold when the author crosses it.
+
+
+def is_pulled(follower_count: int) -> bool:
+    """Whether a new post of an author with `follower_count` followers
+    is pulled at read time rather than fanned out to each of them."""
+    return follower_count > config.TIMELINE_FANOUT_MAX_FOLLOWERS
+
+
+def _not_in_timeline(user_id, post_id) -> sqlalchemy.ColumnElement[bool]:
+    # Fan-out and follow backfill can both reach a post, so inserts skip
+    # the entries that already exist rather than fail on the unique index.
+    return ~(
+        sqlalchemy.select(timeline_table.c.id)
+        .where(
+            timeline_table.c.user_id == user_id,
+            timeline_table.c.post_id == post_id,
+        )
+        .exists()
+    )
+
+
+async def fan_out_post(post_id: int, author_id: int, database: Database):
+    """Add a new post to its author's timeline and, unless the author's
+    posts are pulled, to the timeline of each follower, in one
+    INSERT ... SELECT."""
+    author = await database.fetch_one(
+        sqlalchemy.select(user_table.c.follower_count).where(
+            user_table.c.id == author_id
+        )
+    )
+    if author is None:
+        logger.warning(f"Author {author_id} of post {post_id} not found")
+        return
+    owners = sqlalchemy.select(user_table.c.id.label("user_id")).where(
+        user_table.c.id == author_id
+    )
+    if is_pulled(author.follower_count):
+        logger.info(f"Not fanning out post {post_id}, its author is pulled")
+        query = (
+            post_table.update()
+            .where(post_table.c.id == post_id)
+            .values(pulled=True)
+        )
+        logger.debug(query)
+        await database.execute(query)
+        query = (
+            user_table.update()
+            .where(user_table.c.id == author_id)
+            .values(has_pulled_posts=True)
+        )
+        logger.debug(query)
+        await database.execute(query)
+    else:
+        owners = owners.union_all(
+            sqlalchemy.select(follow_table.c.follower_id).where(
+                follow_table.c.followee_id == author_id
+            )
+        )
+    owners = owners.subquery()
+    query = timeline_table.insert().from_select(
+        ["user_id", "post_id", "author_id"],
+        sqlalchemy.select(
+            owners.c.user_id,
+            sqlalchemy.literal(post_id, sqlalchemy.Integer),
+            sqlalchemy.literal(author_id, sqlalchemy.Integer),
+        ).where(_not_in_timeline(owners.c.user_id, post_id)),
+    )
+    logger.debug(query)
+    await database.execute(query)
+
+
+async def add_followee_posts(
+    follower_id: int, followee_id: int, database: Database
+):
+    """Backfill the latest TIMELINE_FOLLOW_BACKFILL fanned out posts of a
+    user just followed; their pulled posts are read without."""
+    latest = (
+        sqlalchemy.select(post_table.c.id)
+        .where(
+            post_table.c.user_id == followee_id,
+            post_table.c.pulled == sqlalchemy.false(),
+        )
+        .order_by(post_table.c.id.desc())
+        .limit(config.TIMELINE_FOLLOW_BACKFILL)
+        .subquery()
+    )
+    query = timeline_table.insert().from_select(
+        ["user_id", "post_id", "author_id"],
+        sqlalchemy.select(
+            sqlalchemy.literal(follower_id, sqlalchemy.Integer),
+            latest.c.id,
+            sqlalchemy.literal(followee_id, sqlalchemy.Integer),
+        ).where(_not_in_timeline(follower_id, latest.c.id)),
+    )
+    logger.debug(query)
+    await database.execute(query)
+
+
+async def remove_followee_posts(
+    follower_id: int, followee_id: int, database: Database
+):
+    query = timeline_table.delete().where(
+        timeline_table.c.user_id == follower_id,
+        timeline_table.c.author_id == followee_id,
+    )
+    logger.debug(query)
+    await database.execute(query)